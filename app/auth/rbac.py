@@ -101,3 +101,27 @@ def scope_checker(required_scopes: list, user_scopes: list):
                 status_code=403, detail=f"Not enough permissions. Missing scope: {scope}",
             )
     return has_permission
+
+
+def is_admin_token(token: str | None):
+    """Bearer token of an existing user with the "admin" role/function (no exception)"""
+    if not token:
+        return False
+    try:
+        payload = decode_access_token(token)
+        user = get_user(payload.get("sub"))
+    except (HTTPException, IndexError):
+        return False
+    return user is not None and "admin" in user.roles + user.functions
+
+
+def is_active_staff_token(token: str | None):
+    """Bearer token that get_current_active_user would accept (no exception); for WebSocket handshakes"""
+    if not token:
+        return False
+    try:
+        payload = decode_access_token(token)
+        user = get_user(payload.get("sub"))
+    except (HTTPException, IndexError):
+        return False
+    return user is not None and user.is_active and "staff" in user.roles + user.functions
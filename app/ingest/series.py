@@ -0,0 +1,426 @@
+# ingest/series.py
+"""
+Compact in-memory time series of fetched IoW DataPoints.
+
+    timestamps   int64 epoch ns (UTC)
+    values       float64 (or float32, see SERIES_VALUE_DTYPE); missing values are NaN
+    station      categorical: `stations` names + `station_codes` (None = every point is stations[0])
+    quality      optional uint8 flags (DataPoints `Quality`), None when IoW does not send them
+    utc_offset   offset (sec) of the IoW TimeStamp strings, used to render local times; None = naive
+
+16 bytes per point (12 with float32) instead of ~98 for the DataFrame built from the
+DataPoints dicts (object-dtype TimeStamp strings, Station repeated per row).
+The statistics kernels work on the arrays; `to_frame()` gives a typed DataFrame for writers.
+"""
+from datetime import timedelta, timezone
+from itertools import islice
+from decouple import Config, RepositoryEnv
+import numpy as np
+import pandas as pd
+import os
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+SERIES_VALUE_DTYPE = ENV.get('SERIES_VALUE_DTYPE', default='float64')
+SERIES_BATCH_SIZE = ENV.get('SERIES_BATCH_SIZE', default=8192, cast=int)
+QUALITY_KEY = "Quality"
+NS_PER_SEC = 1_000_000_000
+NS_PER_DAY = 86_400 * NS_PER_SEC
+
+
+def offset_suffix(utc_offset):
+    """28800 -> "+08:00", None -> "" """
+    if utc_offset is None:
+        return ""
+    sign = "-" if utc_offset < 0 else "+"
+    minutes = abs(int(utc_offset)) // 60
+    return f"{sign}{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_timestamps(timestamps):
+    """(int64 epoch ns, utc offset sec or None) of IoW TimeStamp strings / datetimes"""
+    parsed = pd.to_datetime(pd.Series(timestamps), format="ISO8601")
+    tz = parsed.dt.tz
+    if tz is None:
+        return parsed.to_numpy(dtype="datetime64[ns]").view(np.int64), None
+    utc_offset = parsed.iloc[0].utcoffset()
+    utc = parsed.dt.tz_convert("UTC").dt.tz_localize(None)
+    return utc.to_numpy(dtype="datetime64[ns]").view(np.int64), int(utc_offset.total_seconds())
+
+
+class TimeSeries:
+    """Points of one or more PQs; arrays are shared, not copied, by `take` / `to_frame`"""
+
+    __slots__ = ("timestamps", "values", "stations", "station_codes", "quality", "utc_offset")
+
+    def __init__(self, timestamps, values, stations=("",), station_codes=None, quality=None, utc_offset=None):
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+        self.values = np.asarray(values)
+        self.stations = list(stations)
+        self.station_codes = station_codes
+        self.quality = quality
+        self.utc_offset = utc_offset
+
+    @classmethod
+    def empty(cls, station="", value_dtype=None):
+        return cls(np.empty(0, np.int64), np.empty(0, value_dtype or SERIES_VALUE_DTYPE), [station or ""])
+
+    @classmethod
+    def from_points(cls, points, station="", value_dtype=None, batch_size=None):
+        """
+        From IoW `DataPoints` ([{"TimeStamp": ..., "Value": ...}, ...]) without building row records.
+        `points` may be any iterable (e.g. `iter_json_array` over a streamed response): it is read
+        in batches of `batch_size`, so only one batch of point dicts is alive at a time.
+        """
+        value_dtype = value_dtype or SERIES_VALUE_DTYPE
+        batch_size = batch_size or SERIES_BATCH_SIZE
+        points = iter(points)
+        batches = []
+        while True:
+            batch = list(islice(points, batch_size))
+            if not batch:
+                break
+            batches.append(cls.from_batch(batch, station, value_dtype))
+        if not batches:
+            return cls.empty(station, value_dtype)
+        return batches[0] if len(batches) == 1 else cls.concat(batches)
+
+    @classmethod
+    def from_batch(cls, points, station, value_dtype):
+        n_points = len(points)
+        timestamps, utc_offset = parse_timestamps([point["TimeStamp"] for point in points])
+        values = np.fromiter(
+            (np.nan if point.get("Value") is None else point["Value"] for point in points),
+            dtype=value_dtype, count=n_points
+        )
+        quality = None
+        if QUALITY_KEY in points[0]:
+            quality = np.fromiter((point.get(QUALITY_KEY) or 0 for point in points), dtype=np.uint8, count=n_points)
+        return cls(timestamps, values, [station or ""], None, quality, utc_offset)
+
+    @classmethod
+    def from_frame(cls, df, station="", value_dtype=None):
+        """From a DataFrame with TimeStamp (ISO strings or datetimes) and Value columns"""
+        if df is None or "TimeStamp" not in df or "Value" not in df or df.shape[0] == 0:
+            return cls.empty(station, value_dtype)
+        timestamps, utc_offset = parse_timestamps(df["TimeStamp"])
+        values = pd.to_numeric(df["Value"], errors="coerce").to_numpy(dtype=value_dtype or SERIES_VALUE_DTYPE)
+        stations, station_codes = [station or ""], None
+        if "Station" in df:
+            station_column = df["Station"].astype("category")
+            stations = [str(name) for name in station_column.cat.categories] or stations
+            if len(stations) > 1:
+                station_codes = station_column.cat.codes.to_numpy(dtype=np.int16)
+        return cls(timestamps, values, stations, station_codes, None, utc_offset)
+
+    @classmethod
+    def concat(cls, series_list):
+        """One series of several (e.g. several stations); stations stay categorical"""
+        series_list = [series for series in series_list if series is not None]
+        if not series_list:
+            return cls.empty()
+        stations = []
+        for series in series_list:
+            stations.extend(name for name in series.stations if name not in stations)
+        station_codes = None
+        if len(stations) > 1:
+            station_codes = np.concatenate([
+                np.asarray([stations.index(name) for name in series.stations], dtype=np.int16)[series.codes()]
+                for series in series_list
+            ])
+        with_quality = any(series.quality is not None for series in series_list)
+        return cls(
+            np.concatenate([series.timestamps for series in series_list]),
+            np.concatenate([series.values for series in series_list]),
+            stations,
+            station_codes,
+            np.concatenate([
+                series.quality if series.quality is not None else np.zeros(len(series), np.uint8)
+                for series in series_list
+            ]) if with_quality else None,
+            # Empty parts (e.g. days without data) have no offset of their own
+            next((series.utc_offset for series in series_list if len(series)), series_list[0].utc_offset),
+        )
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __repr__(self):
+        return f"<TimeSeries {len(self)} points, stations={self.stations}, {self.nbytes} bytes>"
+
+    @property
+    def nbytes(self):
+        arrays = (self.timestamps, self.values, self.station_codes, self.quality)
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    @property
+    def tz(self):
+        if self.utc_offset is None:
+            return None
+        return timezone(timedelta(seconds=self.utc_offset))
+
+    def codes(self):
+        if self.station_codes is None:
+            return np.zeros(len(self), dtype=np.int16)
+        return self.station_codes
+
+    def take(self, indexer):
+        """Sub-series of the given positions / boolean mask"""
+        return TimeSeries(
+            self.timestamps[indexer],
+            self.values[indexer],
+            self.stations,
+            None if self.station_codes is None else self.station_codes[indexer],
+            None if self.quality is None else self.quality[indexer],
+            self.utc_offset,
+        )
+
+    def local_ns(self):
+        """Epoch ns shifted to the series' local wall clock (for day / hour arithmetic)"""
+        if self.utc_offset is None:
+            return self.timestamps
+        return self.timestamps + self.utc_offset * NS_PER_SEC
+
+    def local_days(self):
+        """Local day number (days since 1970-01-01, as datetime64[D]) per point"""
+        return (self.local_ns() // NS_PER_DAY).astype("datetime64[D]")
+
+    def timestamp_at(self, position):
+        """pd.Timestamp of one point, with the IoW offset (tz-aware like pd.to_datetime of the strings)"""
+        timestamp = pd.Timestamp(int(self.timestamps[position]), unit="ns")
+        if self.utc_offset is None:
+            return timestamp
+        return timestamp.tz_localize("UTC").tz_convert(self.tz)
+
+    def datetimes(self):
+        """DatetimeIndex with the IoW offset"""
+        index = pd.DatetimeIndex(self.timestamps.view("datetime64[ns]"))
+        if self.utc_offset is None:
+            return index
+        return index.tz_localize("UTC").tz_convert(self.tz)
+
+    def timestamp_strings(self):
+        """IoW style TimeStamp strings ("2024-07-01T00:00:00+08:00")"""
+        local = self.local_ns()
+        if not (local % NS_PER_SEC).any():
+            unit = "s"
+        elif not (local % 1_000_000).any():
+            unit = "ms"
+        else:
+            unit = "us"
+        text = np.datetime_as_string(local.view("datetime64[ns]"), unit=unit)
+        return np.char.add(text, offset_suffix(self.utc_offset)).astype(object)
+
+    def to_frame(self, iso_timestamps=False):
+        """TimeStamp (datetime64 with offset, or IoW strings), Value, Station (categorical)[, Quality]"""
+        frame = pd.DataFrame({
+            "TimeStamp": self.timestamp_strings() if iso_timestamps else self.datetimes(),
+            "Value": self.values,
+            "Station": pd.Categorical.from_codes(self.codes(), categories=self.stations),
+        })
+        if self.quality is not None:
+            frame["Quality"] = self.quality
+        return frame
+
+    def records(self):
+        """[{"TimeStamp": str, "Value": float[, "Quality": int]}] like the IoW DataPoints"""
+        columns = {"TimeStamp": self.timestamp_strings().tolist(), "Value": self.values.tolist()}
+        if self.quality is not None:
+            columns["Quality"] = self.quality.tolist()
+        return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def as_series(data, station=""):
+    """TimeSeries of a TimeSeries, a DataFrame (TimeStamp / Value columns) or None"""
+    if isinstance(data, TimeSeries):
+        return data
+    return TimeSeries.from_frame(data, station)
+
+
+def positive_runs(series, max_gap_min):
+    """
+    Runs of Value > 0 points whose consecutive timestamps are at most `max_gap_min` apart
+    (in series order): (positions of the positive points, run starts, run ends), where
+    starts / ends index into the positions.
+    """
+    positive = np.flatnonzero(series.values > 0)
+    if len(positive) == 0:
+        return positive, positive, positive
+    gaps = np.diff(series.timestamps[positive]) > max_gap_min * 60 * NS_PER_SEC
+    starts = np.concatenate([[0], np.flatnonzero(gaps) + 1])
+    ends = np.concatenate([starts[1:] - 1, [len(positive) - 1]])
+    return positive, starts, ends
+
+
+def run_bounds(series, max_gap_min):
+    """(n, 2) int64 [first, last] epoch ns of each `positive_runs` run"""
+    positive, starts, ends = positive_runs(series, max_gap_min)
+    return np.stack([series.timestamps[positive[starts]], series.timestamps[positive[ends]]], axis=1)
+
+
+def merge_runs(runs, max_gap_min):
+    """
+    Joins consecutive [first, last] runs whose gap is at most `max_gap_min`. Runs found with a gap
+    <= `max_gap_min` (e.g. day by day, see store/rollup.py) then give exactly the runs of
+    `positive_runs(series, max_gap_min)` over all their points.
+    """
+    runs = np.asarray(runs, dtype=np.int64).reshape(-1, 2)
+    if len(runs) == 0:
+        return runs
+    gaps = runs[1:, 0] - runs[:-1, 1] > max_gap_min * 60 * NS_PER_SEC
+    starts = np.concatenate([[0], np.flatnonzero(gaps) + 1])
+    ends = np.concatenate([starts[1:] - 1, [len(runs) - 1]])
+    return np.stack([runs[starts, 0], runs[ends, 1]], axis=1)
+
+
+# Aggregations / fill policies of `resample`
+RESAMPLE_AGGREGATIONS = ("min", "max", "mean", "sum", "count", "last")
+# none: only buckets with data, null: every bucket of the range (NaN), previous: carry the last bucket forward, zero: 0
+RESAMPLE_FILL_POLICIES = ("none", "null", "previous", "zero")
+RESAMPLE_MAX_BUCKETS = ENV.get('RESAMPLE_MAX_BUCKETS', default=500_000, cast=int)
+
+
+def bucket_ns(bucket):
+    """Bucket width in ns of "5min" / "1h" / "1d" ...; must divide a day or be whole days (local midnight aligned)"""
+    try:
+        width = int(pd.Timedelta(bucket).value)
+    except ValueError as e:
+        raise ValueError(f"Invalid bucket: {bucket}") from e
+    if width <= 0 or (NS_PER_DAY % width and width % NS_PER_DAY):
+        raise ValueError(f"Bucket must divide a day or be whole days: {bucket}")
+    return width
+
+
+def resample(series, bucket, aggregations=("mean",), fill="none", start=None, end=None, iso_timestamps=False):
+    """
+    DataFrame of TimeStamp (bucket start, local time like the series) + one column per aggregation
+    over the points of [start, end) (local wall clock, e.g. "2024-07-01"); NaN values are skipped.
+    """
+    width = bucket_ns(bucket)
+    unknown = [agg for agg in aggregations if agg not in RESAMPLE_AGGREGATIONS]
+    if unknown or not aggregations:
+        raise ValueError(f"Aggregations must be among {', '.join(RESAMPLE_AGGREGATIONS)}: {unknown}")
+    if fill not in RESAMPLE_FILL_POLICIES:
+        raise ValueError(f"Fill must be one of {', '.join(RESAMPLE_FILL_POLICIES)}: {fill}")
+
+    local = series.local_ns()
+    values = series.values.astype(np.float64, copy=False)
+    keep = ~np.isnan(values)
+    start_ns = None if start is None else pd.Timestamp(start).value
+    end_ns = None if end is None else pd.Timestamp(end).value
+    if start_ns is not None:
+        keep &= local >= start_ns
+    if end_ns is not None:
+        keep &= local < end_ns
+    local, values = local[keep], values[keep]
+    order = np.argsort(local, kind="stable")
+    local, values = local[order], values[order]
+
+    ids = local // width
+    bucket_ids, starts = np.unique(ids, return_index=True)
+    counts = np.diff(np.append(starts, len(ids)))
+    columns = {}
+    for agg in aggregations:
+        if agg == "count":
+            columns[agg] = counts
+        elif len(values) == 0:
+            columns[agg] = np.empty(0, np.float64)
+        elif agg == "min":
+            columns[agg] = np.minimum.reduceat(values, starts)
+        elif agg == "max":
+            columns[agg] = np.maximum.reduceat(values, starts)
+        elif agg == "sum":
+            columns[agg] = np.add.reduceat(values, starts)
+        elif agg == "mean":
+            columns[agg] = np.add.reduceat(values, starts) / counts
+        else:
+            columns[agg] = values[starts + counts - 1]
+
+    if fill != "none":
+        first_id = start_ns // width if start_ns is not None else (bucket_ids[0] if len(bucket_ids) else 0)
+        last_id = (end_ns - 1) // width if end_ns is not None else (bucket_ids[-1] if len(bucket_ids) else -1)
+        if last_id - first_id + 1 > RESAMPLE_MAX_BUCKETS:
+            raise ValueError(f"More than {RESAMPLE_MAX_BUCKETS} buckets, use a wider bucket")
+        all_ids = np.arange(first_id, last_id + 1, dtype=np.int64)
+        present = np.zeros(len(all_ids), dtype=bool)
+        present[bucket_ids - first_id] = True
+        # Position of the latest bucket with data at or before each bucket (-1: none yet)
+        previous = np.maximum.accumulate(np.where(present, np.arange(len(all_ids)), -1))
+        for agg, column in columns.items():
+            full = np.full(len(all_ids), 0 if agg == "count" else np.nan)
+            full[bucket_ids - first_id] = column
+            if agg == "count":
+                column = full.astype(np.int64)
+            elif fill == "zero":
+                column = np.where(present, full, 0.0)
+            elif fill == "previous":
+                column = np.where(previous >= 0, full[np.maximum(previous, 0)], np.nan)
+            else:
+                column = full
+            columns[agg] = column
+        bucket_ids = all_ids
+
+    # Bucket starts, rendered like the series' own timestamps
+    frame = pd.DataFrame({"TimeStamp": grid_timestamps(bucket_ids * width, series.utc_offset, iso_timestamps)})
+    for agg, column in columns.items():
+        frame[agg] = column
+    return frame
+
+
+# Directions of `align_to_grid` (like pandas.merge_asof)
+ALIGN_DIRECTIONS = ("backward", "forward", "nearest")
+
+
+def time_grid(start, end, every):
+    """Local-wall-clock epoch ns of [start, end) every `every` ("10min", "1h", ...; see `bucket_ns`)"""
+    width = bucket_ns(every)
+    start_ns, end_ns = pd.Timestamp(start).value, pd.Timestamp(end).value
+    first = -(-start_ns // width) * width
+    if end_ns <= first:
+        return np.empty(0, np.int64)
+    if (end_ns - 1 - first) // width + 1 > RESAMPLE_MAX_BUCKETS:
+        raise ValueError(f"More than {RESAMPLE_MAX_BUCKETS} grid rows, use a wider step")
+    return np.arange(first, end_ns, width, dtype=np.int64)
+
+
+def align_to_grid(series, grid, tolerance_ns, direction="backward"):
+    """
+    Value of `series` at each grid time (local epoch ns, see `time_grid`): the last point at or before it
+    (backward), the first at or after it (forward) or the closer of both (nearest, ties go backward),
+    if it is at most `tolerance_ns` away; NaN otherwise. NaN values are skipped.
+    """
+    if direction not in ALIGN_DIRECTIONS:
+        raise ValueError(f"Direction must be one of {', '.join(ALIGN_DIRECTIONS)}: {direction}")
+    values = series.values.astype(np.float64, copy=False)
+    valid = ~np.isnan(values)
+    local, values = series.local_ns()[valid], values[valid]
+    order = np.argsort(local, kind="stable")
+    local, values = local[order], values[order]
+    aligned = np.full(len(grid), np.nan)
+    if len(local) == 0:
+        return aligned
+
+    # Last point at or before (several points at one time: the last one, like merge_asof)
+    before = np.searchsorted(local, grid, side="right") - 1
+    before_gap = np.where(before >= 0, grid - local[np.maximum(before, 0)], np.iinfo(np.int64).max)
+    after = np.searchsorted(local, grid, side="left")
+    after_gap = np.where(after < len(local), local[np.minimum(after, len(local) - 1)] - grid, np.iinfo(np.int64).max)
+    if direction == "backward":
+        use_before = np.ones(len(grid), dtype=bool)
+    elif direction == "forward":
+        use_before = np.zeros(len(grid), dtype=bool)
+    else:
+        use_before = before_gap <= after_gap
+    gap = np.where(use_before, before_gap, after_gap)
+    position = np.where(use_before, before, after)
+    matched = gap <= tolerance_ns
+    aligned[matched] = values[position[matched]]
+    return aligned
+
+
+def grid_timestamps(grid, utc_offset, iso_timestamps=False):
+    """TimeStamp column of grid times (local epoch ns), rendered like a series with `utc_offset`"""
+    times = TimeSeries(grid - (utc_offset or 0) * NS_PER_SEC, np.zeros(len(grid)), utc_offset=utc_offset)
+    return times.timestamp_strings() if iso_timestamps else times.datetimes()
@@ -0,0 +1,133 @@
+# ingest/uploads.py
+"""
+Station / PQ list uploads, parsed in memory as a stream:
+
+    st_pq_file   st_uuid<TAB or ,>pq_uuid   (one PQ per line)
+    st_file      st_uuid                    (one station per line)
+
+BOM, CRLF, blank (or separator-only) lines, a header row and `#` comments are accepted. Lines are validated
+(UUID format), de-duplicated and grouped by st_uuid into an UploadPlan, so a report looks
+each station up once however many of its PQs are listed.
+"""
+from collections import OrderedDict
+from fastapi import HTTPException
+import codecs
+import re
+
+
+UUID_PATTERN = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+SEPARATOR = re.compile(r"\s*[\t,;]\s*")
+CHUNK_SIZE = 64 * 1024
+MAX_REJECTED_SHOWN = 20
+
+
+def iter_upload_lines(stream, chunk_size=CHUNK_SIZE):
+    """(line number, stripped text) of a binary stream, decoded incrementally as UTF-8 (BOM removed)"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    line_no = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        pending += decoder.decode(chunk, final=not chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line.strip()
+        if not chunk:
+            break
+    if pending.strip():
+        yield line_no + 1, pending.strip()
+
+
+class UploadPlan:
+    """Valid upload lines grouped by station, in upload order"""
+
+    def __init__(self, filename=None, with_pq=True):
+        self.filename = filename
+        self.with_pq = with_pq
+        self.stations = OrderedDict()  # st_uuid => [pq_uuid, ...]
+        self.lines = 0
+        self.duplicates = 0
+        self.rejected = []  # (line number, text, reason)
+
+    def add_line(self, line_no, text):
+        # Empty fields are kept, so columns keep their position (",<pq_uuid>" has no st_uuid)
+        fields = SEPARATOR.split(text)
+        if not any(fields):
+            # Separators only (an empty row of a spreadsheet export): skipped like a blank line
+            return
+        self.lines += 1
+        st_uuid = fields[0]
+        if not UUID_PATTERN.match(st_uuid):
+            # A header row ("st_uuid,pq_uuid") is skipped quietly
+            if not (line_no == 1 and "uuid" in text.lower()):
+                self.rejected.append((line_no, text, "invalid st_uuid"))
+            return
+        if not self.with_pq:
+            if st_uuid in self.stations:
+                self.duplicates += 1
+            else:
+                self.stations[st_uuid] = []
+            return
+
+        if len(fields) < 2:
+            self.rejected.append((line_no, text, "missing pq_uuid"))
+            return
+        pq_uuid = fields[1]
+        if not UUID_PATTERN.match(pq_uuid):
+            self.rejected.append((line_no, text, "invalid pq_uuid"))
+            return
+        pq_uuids = self.stations.setdefault(st_uuid, [])
+        if pq_uuid in pq_uuids:
+            self.duplicates += 1
+        else:
+            pq_uuids.append(pq_uuid)
+
+    def pairs(self):
+        """(st_uuid, pq_uuid), grouped by station"""
+        for st_uuid, pq_uuids in self.stations.items():
+            for pq_uuid in pq_uuids:
+                yield st_uuid, pq_uuid
+
+    def summary(self):
+        return {
+            "filename": self.filename,
+            "lines": self.lines,
+            "stations": len(self.stations),
+            "pairs": sum(len(pq_uuids) for pq_uuids in self.stations.values()),
+            "duplicates": self.duplicates,
+            "rejected": len(self.rejected),
+        }
+
+    def headers(self):
+        """Response headers describing what was used from the upload"""
+        summary = self.summary()
+        return {
+            "X-Upload-Stations": str(summary["stations"]),
+            "X-Upload-Pairs": str(summary["pairs"]),
+            "X-Upload-Duplicates": str(summary["duplicates"]),
+            "X-Upload-Rejected": str(summary["rejected"]),
+        }
+
+
+def parse_upload(upload, with_pq=True):
+    """
+    UploadPlan of an UploadFile (st_pq_file when `with_pq`, else st_file).
+    Raises 400 when no line is usable; otherwise invalid lines are skipped and logged.
+    """
+    plan = UploadPlan(upload.filename, with_pq)
+    for line_no, text in iter_upload_lines(upload.file):
+        if text and not text.startswith("#"):
+            plan.add_line(line_no, text)
+
+    rejected = [
+        {"line": line_no, "text": text, "reason": reason} for line_no, text, reason in plan.rejected[:MAX_REJECTED_SHOWN]
+    ]
+    if not plan.stations:
+        raise HTTPException(
+            status_code=400,
+            detail={"message": f"No valid line in {upload.filename}", "rejected": rejected},
+        )
+    if plan.rejected:
+        print(f"[upload] {upload.filename}: skipped {len(plan.rejected)} invalid lines, e.g. {rejected[:3]}")
+    return plan
@@ -0,0 +1,154 @@
+# jobs/avail_rate.py
+from datetime import datetime, timedelta
+from decouple import Config, RepositoryEnv
+from pymongo import ASCENDING, UpdateOne
+import glob
+import os
+
+from app.schemas import Item
+from app.routers.iow.latest_data import get_IoW_headers, get_Station_metadata, get_PhysicalQuantity_UUIDs
+from app.routers.iow.history_data import HISTORY_db, get_PhysicalQuantity_history_data
+from app.routers.iow.statistics_data import calculate_avail_rate
+from app.store.cache import CACHE
+from app.store.history_cache import latest_complete_day
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+PAYLOAD = {
+    "grant_type": ENV.get("API_GRANT_TYPE"),
+    "client_id": ENV.get("API_CLIENT_ID"),
+    "client_secret": ENV.get("API_CLIENT_SECRET"),
+}
+# Asia/Taipei; after HISTORY_CACHE_SETTLE_HOURS, so yesterday is complete (late uploads included)
+AVAIL_RATE_JOB_TIME = ENV.get('AVAIL_RATE_JOB_TIME', default='04:30')
+AVAIL_RATE_N_RECORDS_PER_DAY = ENV.get('AVAIL_RATE_N_RECORDS_PER_DAY', default=24, cast=int)
+AVAIL_RATE_BACKFILL_DAYS = ENV.get('AVAIL_RATE_BACKFILL_DAYS', default=7, cast=int)
+
+
+def ensure_avail_rate_index():
+    HISTORY_db.avail_rate.create_index([("date", ASCENDING), ("pq_uuid", ASCENDING)], name="date_pq")
+    HISTORY_db.avail_rate_days.create_index([("date", ASCENDING)], name="date", unique=True)
+
+
+def list_local_stations():
+    """All st_uuid in STATION_UUIDs/*_station_ID.txt (de-duplicated, file order)"""
+    st_uuids = []
+    for st_uuids_path in sorted(glob.glob(base_dir + "/STATION_UUIDs/*_station_ID.txt")):
+        with open(st_uuids_path, "r", encoding='utf-8') as f:
+            for row in f:
+                st_uuid = row.strip()
+                if st_uuid and st_uuid not in st_uuids:
+                    st_uuids.append(st_uuid)
+    return st_uuids
+
+
+def materialize_avail_rate(day, headers, N_records_per_day=AVAIL_RATE_N_RECORDS_PER_DAY, st_uuids=None):
+    """
+    Daily record counts & 日妥善率 of every PQ of `st_uuids` (default: every local station) for `day`
+    (YYYY-MM-DD). Stations with a failed lookup are recorded in `avail_rate_days` and retried by the next run.
+    """
+    operations = []
+    failed_stations = []
+    for st_uuid in (list_local_stations() if st_uuids is None else st_uuids):
+        try:
+            s_response = get_Station_metadata(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
+            st_name = s_response["Name"]
+            pq_uuid_list = get_PhysicalQuantity_UUIDs(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
+        except Exception as e:
+            print(f"[avail_rate] {st_uuid}: {e}")
+            failed_stations.append(st_uuid)
+            continue
+
+        for pq_uuid in pq_uuid_list or []:
+            item = Item(datetime_start=day, datetime_end=day, st_uuid=st_uuid, pq_uuid=pq_uuid)
+            try:
+                series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
+            except Exception as e:
+                print(f"[avail_rate] {st_name} {pq_uuid}: {e}")
+                if st_uuid not in failed_stations:
+                    failed_stations.append(st_uuid)
+                continue
+
+            # Same rule as `calculate_avail_rate` (the report endpoint)
+            df_cal = calculate_avail_rate(item, series, N_records_per_day) if series is not None else None
+            counts = 0
+            if df_cal is not None:
+                counts = int(df_cal.loc[df_cal["Date"] == day, "counts"].sum())
+            daily_avail_rate = min(counts / N_records_per_day * 100, 100)
+
+            date = datetime.strptime(day, "%Y-%m-%d")
+            operations.append(UpdateOne(
+                {"date": date, "pq_uuid": pq_uuid},
+                {"$set": {
+                    "date": date,
+                    "日期": day,
+                    "st_uuid": st_uuid,
+                    "st_name": st_name,
+                    "pq_uuid": pq_uuid,
+                    "counts": counts,
+                    "N_records_per_day": N_records_per_day,
+                    "日妥善率 (%)": daily_avail_rate,
+                }},
+                upsert=True
+            ))
+
+    if operations:
+        HISTORY_db.avail_rate.bulk_write(operations, ordered=False)
+    return {"date": day, "pq_count": len(operations), "failed_stations": failed_stations}
+
+
+def record_day(day, failed_stations):
+    """Completion of one day: only the stations still failing are retried"""
+    HISTORY_db.avail_rate_days.update_one(
+        {"date": datetime.strptime(day, "%Y-%m-%d")},
+        {"$set": {"日期": day, "complete": not failed_stations, "failed_stations": failed_stations}},
+        upsert=True
+    )
+
+
+def pending_days(last_day=None):
+    """
+    {day: st_uuids to (re)materialize, None = every station} of the AVAIL_RATE_BACKFILL_DAYS days
+    ending `last_day` (default: the latest complete day, Asia/Taipei) that are not complete
+    """
+    last_day = last_day or latest_complete_day()
+    first_day = last_day - timedelta(days=AVAIL_RATE_BACKFILL_DAYS - 1)
+    recorded = {
+        doc["date"].date(): doc
+        for doc in HISTORY_db.avail_rate_days.find({"date": {"$gte": datetime.combine(first_day, datetime.min.time())}})
+    }
+
+    days = {}
+    current_day = first_day
+    while current_day <= last_day:
+        doc = recorded.get(current_day)
+        if doc is None:
+            days[current_day.strftime("%Y-%m-%d")] = None
+        elif not doc.get("complete"):
+            days[current_day.strftime("%Y-%m-%d")] = doc.get("failed_stations") or None
+        current_day += timedelta(days=1)
+    return days
+
+
+def run_avail_rate_job():
+    # One worker at a time materializes (lease shared through the disk / shm cache backends).
+    # avail_rate_days records what is done, so the lease is released even after a failure:
+    # the next run picks up whatever is still pending.
+    lease_key = "lease:avail_rate"
+    if not CACHE.add(lease_key, os.getpid(), 12 * 3600):
+        print("[avail_rate] running in another worker")
+        return
+
+    try:
+        # Get IoW token
+        headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
+
+        ensure_avail_rate_index()
+        for day, st_uuids in pending_days().items():
+            stats = materialize_avail_rate(day, headers, st_uuids=st_uuids)
+            record_day(day, stats["failed_stations"])
+            print(f"[avail_rate] {stats}")
+    finally:
+        CACHE.delete(lease_key)
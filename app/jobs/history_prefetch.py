@@ -0,0 +1,182 @@
+# jobs/history_prefetch.py
+from datetime import datetime, timedelta
+from decouple import Config, RepositoryEnv
+import glob
+import time
+import os
+
+from app.schemas import Item
+from app.jobs.avail_rate import list_local_stations
+from app.jobs.scheduler import STOP_EVENT
+from app.routers.iow.latest_data import (
+    get_IoW_headers,
+    get_PhysicalQuantity_UUIDs,
+    read_flood_detention_pools,
+    read_rfd_flood_depth_pq,
+)
+from app.routers.iow.history_data import get_PhysicalQuantity_history_data
+from app.store.cache import CACHE
+from app.store.history_cache import (
+    HISTORY_CACHE_ENABLED, history_cache_usage, is_cached, latest_complete_day, purge_history_cache
+)
+from app.store.pump_window import list_pumps
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+PAYLOAD = {
+    "grant_type": ENV.get("API_GRANT_TYPE"),
+    "client_id": ENV.get("API_CLIENT_ID"),
+    "client_secret": ENV.get("API_CLIENT_SECRET"),
+}
+# Off-peak local time window (may cross midnight); runs outside it stop and resume the next night.
+# Starts after HISTORY_CACHE_SETTLE_HOURS, or yesterday is not complete yet and only older days are fetched
+HISTORY_PREFETCH_WINDOW = ENV.get('HISTORY_PREFETCH_WINDOW', default='03:00-07:00')
+HISTORY_PREFETCH_INTERVAL_MIN = ENV.get('HISTORY_PREFETCH_INTERVAL_MIN', default=15, cast=int)
+# Complete days kept prefetched (1 = yesterday only; more catches up after an outage)
+HISTORY_PREFETCH_DAYS = ENV.get('HISTORY_PREFETCH_DAYS', default=2, cast=int)
+HISTORY_PREFETCH_RATE = ENV.get('HISTORY_PREFETCH_RATE', default=2.0, cast=float)  # IoW calls per second
+HISTORY_PREFETCH_MAX_FAILURES = ENV.get('HISTORY_PREFETCH_MAX_FAILURES', default=20, cast=int)  # in a row
+# Also every PQ of the stations in STATION_UUIDs/*_station_ID.txt (one LatestData call per station)
+HISTORY_PREFETCH_STATION_PQS = ENV.get('HISTORY_PREFETCH_STATION_PQS', default=True, cast=bool)
+LAST_RUN_KEY = "history_prefetch:last_run"
+
+
+def in_prefetch_window(now=None):
+    now = (now or datetime.now()).strftime("%H:%M")
+    start, end = HISTORY_PREFETCH_WINDOW.split("-")
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+class Pacer:
+    """At most `rate` calls per second; `wait()` is False when the app is shutting down"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_at = time.monotonic()
+
+    def wait(self):
+        delay = self.next_at - time.monotonic()
+        if delay > 0 and STOP_EVENT.wait(delay):
+            return False
+        self.next_at = max(self.next_at, time.monotonic()) + self.interval
+        return not STOP_EVENT.is_set()
+
+
+def registered_pairs(headers, pacer=None):
+    """(st_uuid, pq_uuid) of Documents/STuuid_PQuuid_*.csv, pumps, 滯洪池, RFD 淹水深度 and the local stations"""
+    pairs = {}
+    for pairs_path in sorted(glob.glob(base_dir + "/Documents/STuuid_PQuuid_*.csv")):
+        with open(pairs_path, "r", encoding="utf-8-sig") as f:
+            for line in f:
+                line = line.strip().replace("\t", ",").split(",")
+                if len(line) >= 2 and line[0] and line[1]:
+                    pairs[(line[0], line[1])] = None
+    for pump in list_pumps():
+        if pump["has_history"]:
+            pairs[(pump["st_uuid"], pump["pq_uuid"])] = None
+    for pool in read_flood_detention_pools():
+        pairs[(pool["st_uuid"], pool["pq_uuid"])] = None
+    for st_uuid, pq_uuid in read_rfd_flood_depth_pq().items():
+        pairs[(st_uuid, pq_uuid)] = None
+
+    if HISTORY_PREFETCH_STATION_PQS:
+        for st_uuid in list_local_stations():
+            if pacer is not None and not pacer.wait():
+                break
+            try:
+                pq_uuid_list = get_PhysicalQuantity_UUIDs(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], max_retries=2)
+            except Exception as e:
+                print(f"[history_prefetch] {st_uuid}: {e}")
+                continue
+            for pq_uuid in pq_uuid_list or []:
+                pairs[(st_uuid, pq_uuid)] = None
+    return list(pairs)
+
+
+def prefetch_days(days=HISTORY_PREFETCH_DAYS):
+    """["YYYY-MM-DD", ...] of the last `days` complete (settled) days, oldest first"""
+    last_day = latest_complete_day()
+    return [(last_day - timedelta(days=n)).strftime("%Y-%m-%d") for n in reversed(range(days))]
+
+
+def all_cached_marker(day):
+    """A day whose registered PQs were all cached (skips listing the PQs again on later ticks)"""
+    return CACHE.get(f"history_prefetch:done:{day}") is not None
+
+
+def mark_all_cached(day):
+    CACHE.set(f"history_prefetch:done:{day}", True, (HISTORY_PREFETCH_DAYS + 1) * 86400)
+
+
+def run_history_prefetch(force=False):
+    """
+    Reads the raw data of the previous day(s) of every registered PQ into the local history cache.
+    PQ-days already cached are skipped, so a run stopped by failures / the window end / a restart
+    resumes where it stopped on the next tick.
+    """
+    if not HISTORY_CACHE_ENABLED or (not force and not in_prefetch_window()):
+        return
+    if not CACHE.add("lease:history_prefetch", os.getpid(), max(HISTORY_PREFETCH_INTERVAL_MIN * 60 - 5, 1)):
+        return
+
+    # Get IoW token
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
+    started = time.time()
+    pacer = Pacer(HISTORY_PREFETCH_RATE)
+    days = prefetch_days()
+    days_todo = [day for day in days if not all_cached_marker(day)]
+    pairs = registered_pairs(headers, pacer) if days_todo else []
+    stats = {
+        "started_at": started, "days": days, "pairs": len(pairs), "already_cached": 0,
+        "fetched": 0, "failed": 0, "points": 0, "stopped": None,
+    }
+
+    failures_in_a_row = 0
+    for day in days_todo:
+        for st_uuid, pq_uuid in pairs:
+            if is_cached(pq_uuid, day):
+                stats["already_cached"] += 1
+                continue
+            if not force and not in_prefetch_window():
+                stats["stopped"] = "window closed"
+                break
+            if not pacer.wait():
+                stats["stopped"] = "shutdown"
+                break
+            item = Item(datetime_start=day, datetime_end=day, st_uuid=st_uuid, pq_uuid=pq_uuid)
+            try:
+                series = get_PhysicalQuantity_history_data(
+                    headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, "", max_retries=2
+                )
+            except Exception as e:
+                print(f"[history_prefetch] {day} {pq_uuid}: {e}")
+                stats["failed"] += 1
+                failures_in_a_row += 1
+                if failures_in_a_row >= HISTORY_PREFETCH_MAX_FAILURES:
+                    stats["stopped"] = "upstream failing"
+                    break
+                continue
+            failures_in_a_row = 0
+            stats["fetched"] += 1
+            stats["points"] += len(series) if series is not None else 0
+        if stats["stopped"]:
+            break
+        if stats["failed"] == 0:
+            mark_all_cached(day)
+
+    stats["purged_days"] = purge_history_cache()
+    stats["duration_sec"] = round(time.time() - started, 1)
+    CACHE.set(LAST_RUN_KEY, stats, 7 * 86400)
+    print(f"[history_prefetch] {stats}")
+
+
+def prefetch_status():
+    return {
+        "window": HISTORY_PREFETCH_WINDOW,
+        "cache": history_cache_usage(),
+        "last_run": CACHE.get(LAST_RUN_KEY),
+    }
@@ -0,0 +1,81 @@
+# jobs/latest_snapshot.py
+from concurrent.futures import ThreadPoolExecutor
+from decouple import Config, RepositoryEnv
+import pandas as pd
+import time
+import os
+
+from app.jobs.avail_rate import list_local_stations
+from app.routers.iow.latest_data import get_IoW_headers, get_PhysicalQuantity_latest_data
+from app.store.cache import CACHE, CACHE_LATEST_TTL_SEC
+from app.store.latest import LATEST_SNAPSHOT, shared_key
+from app.upstream.ratelimit import map_in_context
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+PAYLOAD = {
+    "grant_type": ENV.get("API_GRANT_TYPE"),
+    "client_id": ENV.get("API_CLIENT_ID"),
+    "client_secret": ENV.get("API_CLIENT_SECRET"),
+}
+# One LatestData call per registered station (~590) per interval: ~5 IoW calls/s at 120 s (see README)
+LATEST_SNAPSHOT_INTERVAL_SEC = ENV.get('LATEST_SNAPSHOT_INTERVAL_SEC', default=120, cast=int)
+LATEST_SNAPSHOT_WORKERS = ENV.get('LATEST_SNAPSHOT_WORKERS', default=8, cast=int)
+
+
+def list_registered_stations():
+    """STATION_UUIDs/*_station_ID.txt + MPD_MPDCY_all_info.csv + 滯洪池 list"""
+    st_uuids = list_local_stations()
+
+    all_info_path = base_dir + "/STATION_UUIDs/MPD_MPDCY_all_info.csv"
+    if os.path.isfile(all_info_path):
+        for st_uuid in pd.read_csv(all_info_path, encoding='utf-8')["st_uuid"]:
+            if st_uuid not in st_uuids:
+                st_uuids.append(st_uuid)
+
+    pool_path = base_dir + "/STATION_UUIDs/滯洪池_stUUID_pqUUID_滯洪池底.txt"
+    if os.path.isfile(pool_path):
+        with open(pool_path, "r", encoding='utf-8') as f:
+            for row in f:
+                if row.strip():
+                    st_uuid = row.strip().split("\t")[2]
+                    if st_uuid not in st_uuids:
+                        st_uuids.append(st_uuid)
+    return st_uuids
+
+
+def poll_latest_snapshot():
+    # Get IoW token
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
+
+    def fetch_station(st_uuid):
+        pq_uuid_dict = get_PhysicalQuantity_latest_data(
+            st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], max_retries=2
+        )
+        if pq_uuid_dict is None:
+            return None
+        return {"pq": dict(pq_uuid_dict), "fetched_at": time.time()}
+
+    def poll_station(st_uuid):
+        # With several workers only the first poller of the interval calls IoW; the others read its copy
+        try:
+            entry = CACHE.get_or_set(shared_key(st_uuid), lambda: fetch_station(st_uuid), CACHE_LATEST_TTL_SEC)
+        except Exception as e:
+            print(f"[latest_snapshot] {st_uuid}: {e}")
+            return False
+        if entry is None:
+            return False
+        LATEST_SNAPSHOT.update_station(st_uuid, entry["pq"], entry["fetched_at"])
+        return True
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=LATEST_SNAPSHOT_WORKERS) as executor:
+        results = map_in_context(executor, poll_station, list_registered_stations())
+    LATEST_SNAPSHOT.last_poll = {
+        "started_at": started,
+        "duration_sec": round(time.time() - started, 1),
+        "stations": len(results),
+        "failed": results.count(False),
+    }
@@ -0,0 +1,96 @@
+# jobs/live_feed.py
+import time
+
+from app.jobs.latest_snapshot import poll_latest_snapshot
+from app.routers.iow.latest_data import read_flood_detention_pools, read_rfd_flood_depth_pq, calculate_flood_detention_pool
+from app.routers.iow.statistics_data import get_AIOT_headers, get_AIOT_devices
+from app.store.events import LIVE_EVENTS
+from app.store.latest import LATEST_SNAPSHOT
+
+
+LAST_SENT = {}  # (device_type, st_uuid) => compared values
+
+
+def build_live_events():
+    """Current state of pools / RFD / pumps; returns only what changed since the last call"""
+    events = []
+    devices = {}
+    try:
+        headers = get_AIOT_headers()
+        for device_type in ["RFD", "MPD", "MPDCY"]:
+            devices[device_type] = get_AIOT_devices(device_type, headers)
+    except Exception as e:
+        print(f"[live_feed] AIOT devices: {e}")
+
+    # 滯洪池 (水位 & 預估剩餘滯洪量)
+    for pool in read_flood_detention_pools():
+        snapshot = LATEST_SNAPSHOT.get_station(pool["st_uuid"])
+        if snapshot is None:
+            continue
+        data = calculate_flood_detention_pool(pool, snapshot[0])
+        if "TimeStamp" not in data:
+            continue
+        events.append({
+            "type": "flood_detention_pool",
+            "device_type": "POOL",
+            "st_uuid": pool["st_uuid"],
+            "st_name": pool["滯洪池名稱"],
+            "town": pool["鄉鎮"],
+            "data": data,
+            "compare": (data["即時水位(m)"], data["TimeStamp"]),
+        })
+
+    # RFD 淹水深度
+    rfd_towns = {st["_id"]: (st["name"], st["town"]) for st in devices.get("RFD", [])}
+    for st_uuid, pq_uuid in read_rfd_flood_depth_pq().items():
+        snapshot = LATEST_SNAPSHOT.get_station(st_uuid)
+        if snapshot is None or pq_uuid not in snapshot[0]:
+            continue
+        latest = snapshot[0][pq_uuid]
+        st_name, town = rfd_towns.get(st_uuid, (None, None))
+        events.append({
+            "type": "rfd_flood_depth",
+            "device_type": "RFD",
+            "st_uuid": st_uuid,
+            "st_name": st_name,
+            "town": town,
+            "data": {"pq_uuid": pq_uuid, "淹水深度": latest["Value"], "TimeStamp": latest["TimeStamp"]},
+            "compare": (latest["Value"], latest["TimeStamp"]),
+        })
+
+    # 抽水機 detailStatus: 1 (未出勤)、2 (出勤中)、3 (抽水中)、4 (運送中)、5 (異常)
+    for device_type in ["MPD", "MPDCY"]:
+        for st in devices.get(device_type, []):
+            events.append({
+                "type": "pump_status",
+                "device_type": device_type,
+                "st_uuid": st["_id"],
+                "st_name": st["name"],
+                "town": st["town"],
+                "data": {
+                    "detailStatus": st["detailStatus"],
+                    "lat": st["lat"],
+                    "lon": st["lon"],
+                    "location": st["county"] + st["town"] + st["village"],
+                },
+                "compare": (st["detailStatus"], st["lat"], st["lon"]),
+            })
+
+    changed = []
+    now = time.time()
+    for event in events:
+        key = (event["device_type"], event["st_uuid"])
+        compare = event.pop("compare")
+        if LAST_SENT.get(key) != compare:
+            LAST_SENT[key] = compare
+            event["published_at"] = now
+            changed.append(event)
+    return changed
+
+
+def poll_live_feed():
+    """Shared poller: refresh the latest snapshot, then push change events to every subscriber"""
+    poll_latest_snapshot()
+    changed = build_live_events()
+    if changed:
+        LIVE_EVENTS.publish(changed)
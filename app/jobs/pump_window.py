@@ -0,0 +1,71 @@
+# jobs/pump_window.py
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decouple import Config, RepositoryEnv
+import pytz
+import time
+import os
+
+from app.schemas import Metadata
+from app.routers.iow.latest_data import get_IoW_headers
+from app.routers.iow.history_data import get_PhysicalQuantity_history_data_within12hr
+from app.store.cache import CACHE
+from app.store.pump_window import PUMP_WINDOW, PUMP_WINDOW_INTERVAL_SEC, PUMP_WINDOW_RETAIN_HOURS, list_pumps
+from app.upstream.ratelimit import map_in_context
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+PAYLOAD = {
+    "grant_type": ENV.get("API_GRANT_TYPE"),
+    "client_id": ENV.get("API_CLIENT_ID"),
+    "client_secret": ENV.get("API_CLIENT_SECRET"),
+}
+PUMP_WINDOW_WORKERS = ENV.get('PUMP_WINDOW_WORKERS', default=8, cast=int)
+# Points uploaded late (up to this long after their TimeStamp) are still picked up
+PUMP_WINDOW_OVERLAP_MIN = ENV.get('PUMP_WINDOW_OVERLAP_MIN', default=10, cast=int)
+IOW_TIME_FORMAT = "%Y-%m-%dT%H.%M.%S"
+
+
+def poll_pump_window():
+    """Reads each pump PQ's points since its previous poll into PUMP_WINDOW (one worker per interval)"""
+    if not CACHE.add("lease:pump_window", os.getpid(), max(PUMP_WINDOW_INTERVAL_SEC - 5, 1)):
+        return
+
+    # Get IoW token
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
+    now = datetime.now(pytz.timezone('Asia/Taipei')).replace(microsecond=0)
+
+    def poll_pump(pump):
+        state = PUMP_WINDOW.get(pump["pq_uuid"])
+        since = now - timedelta(hours=PUMP_WINDOW_RETAIN_HOURS)
+        if state is not None:
+            since = max(since, datetime.fromtimestamp(state["synced_until"], now.tzinfo) - timedelta(minutes=PUMP_WINDOW_OVERLAP_MIN))
+        pump_item = Metadata(
+            st_uuid=pump["st_uuid"],
+            st_name=pump["st_name"],
+            pq_uuid=pump["pq_uuid"],
+            datetime_start=since.strftime(IOW_TIME_FORMAT),
+            datetime_end=now.strftime(IOW_TIME_FORMAT),
+        )
+        try:
+            series = get_PhysicalQuantity_history_data_within12hr(
+                headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], pump_item, pump["st_name"], max_retries=2
+            )
+        except Exception as e:
+            print(f"[pump_window] {pump['st_name']} {pump['pq_uuid']}: {e}")
+            return False
+        PUMP_WINDOW.update(pump["pq_uuid"], series, int(now.timestamp()))
+        return True
+
+    started = time.time()
+    pumps = [pump for pump in list_pumps() if pump["has_history"]]
+    with ThreadPoolExecutor(max_workers=PUMP_WINDOW_WORKERS) as executor:
+        results = map_in_context(executor, poll_pump, pumps)
+    PUMP_WINDOW.last_poll = {
+        "started_at": started,
+        "duration_sec": round(time.time() - started, 1),
+        "pumps": len(results),
+        "failed": results.count(False),
+    }
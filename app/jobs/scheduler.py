@@ -0,0 +1,66 @@
+# jobs/scheduler.py
+import threading
+import time
+from datetime import datetime, timedelta
+import pytz
+
+from app.upstream.ratelimit import upstream_caller
+
+
+STOP_EVENT = threading.Event()
+JOB_THREADS = []
+
+
+def seconds_until(run_at: str):
+    """Seconds from now until the next `HH:MM` Asia/Taipei (not the server's time zone)."""
+    hour, minute = map(int, run_at.split(":"))
+    now = datetime.now(pytz.timezone('Asia/Taipei'))
+    next_run = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+def _run_safely(name, fn, priority):
+    started = time.monotonic()
+    try:
+        with upstream_caller(priority, f"job:{name}"):
+            fn()
+    except Exception as e:
+        print(f"[job:{name}] failed: {e}")
+    else:
+        print(f"[job:{name}] finished in {time.monotonic() - started:.1f} s")
+
+
+def start_daily_job(name, run_at, fn, priority="prefetch"):
+    """Run `fn` once a day at `run_at` (HH:MM, Asia/Taipei) in a daemon thread; upstream calls in class `priority`."""
+    def loop():
+        while not STOP_EVENT.wait(seconds_until(run_at)):
+            _run_safely(name, fn, priority)
+
+    thread = threading.Thread(target=loop, name=f"job:{name}", daemon=True)
+    thread.start()
+    JOB_THREADS.append(thread)
+    return thread
+
+
+def start_interval_job(name, interval_sec, fn, run_immediately=True, priority="prefetch"):
+    """Run `fn` every `interval_sec` seconds in a daemon thread; upstream calls in class `priority`."""
+    def loop():
+        if run_immediately:
+            _run_safely(name, fn, priority)
+        while not STOP_EVENT.wait(interval_sec):
+            _run_safely(name, fn, priority)
+
+    thread = threading.Thread(target=loop, name=f"job:{name}", daemon=True)
+    thread.start()
+    JOB_THREADS.append(thread)
+    return thread
+
+
+def stop_all_jobs(timeout=5):
+    STOP_EVENT.set()
+    for thread in JOB_THREADS:
+        thread.join(timeout=timeout)
+    JOB_THREADS.clear()
+    STOP_EVENT.clear()
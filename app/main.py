@@ -1,12 +1,113 @@
-from fastapi import FastAPI, Depends
+# Imported first: registers the MongoDB command listener before any MongoClient is created
+from app.monitoring.metrics import HTTP_REQUEST_LATENCY, render_metrics
+
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Request, Security
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.security.utils import get_authorization_scheme_param
+from starlette.concurrency import run_in_threadpool
+import uuid
+import time
 
 # from app.internal import admin
-from app.auth.rbac import get_current_active_user
-from app.routers.iow import history_data, latest_data, latest_data_from_db, statistics_data
+from app.auth.rbac import get_current_active_user, get_current_user, is_admin_token
+from app.monitoring.profiling import PROFILE_SESSION, PROFILES, ProfileSession, profile_requested
+from app.routers.iow import history_data, latest_data, latest_data_from_db, statistics_data, live_feed
 from app.routers.account import account
+from app.routers.admin import profiles
+from app.jobs.scheduler import start_daily_job, start_interval_job, stop_all_jobs
+from app.jobs.avail_rate import AVAIL_RATE_JOB_TIME, run_avail_rate_job
+from app.jobs.history_prefetch import HISTORY_PREFETCH_INTERVAL_MIN, prefetch_status, run_history_prefetch
+from app.jobs.latest_snapshot import LATEST_SNAPSHOT_INTERVAL_SEC
+from app.jobs.live_feed import poll_live_feed
+from app.jobs.pump_window import poll_pump_window
+from app.store.cache import CACHE
+from app.store.latest import LATEST_SNAPSHOT
+from app.store.pump_window import PUMP_WINDOW, PUMP_WINDOW_INTERVAL_SEC
+from app.store.scratch import SCRATCH_PURGE_INTERVAL_SEC, run_scratch_purge
+from app.upstream.client import UPSTREAMS
+from app.upstream.ratelimit import upstream_caller
+from app.upstream.resilience import UpstreamUnavailable
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background jobs
+    start_daily_job("avail_rate", AVAIL_RATE_JOB_TIME, run_avail_rate_job)
+    start_interval_job("latest_snapshot", LATEST_SNAPSHOT_INTERVAL_SEC, poll_live_feed)
+    start_interval_job("scratch_purge", SCRATCH_PURGE_INTERVAL_SEC, run_scratch_purge)
+    start_interval_job("pump_window", PUMP_WINDOW_INTERVAL_SEC, poll_pump_window)
+    start_interval_job("history_prefetch", HISTORY_PREFETCH_INTERVAL_MIN * 60, run_history_prefetch)
+    yield
+    stop_all_jobs()
+
+
+app = FastAPI(lifespan=lifespan)
+# Upstream calls of these routes go before the report / download ones (see upstream/ratelimit.py)
+INTERACTIVE_PATH_PREFIXES = (
+    "/iow/latest/",
+    "/iow/latest_from_db/",
+    "/iow/live/",
+    "/iow/history/query/",
+    "/iow/statistics/nearest_available_pumps",
+    "/account/",
+)
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_LATENCY.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=status,
+        )
 
 
-app = FastAPI()
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    # Off unless asked for (`X-Profile: 1` or `?profile=1`) by an admin
+    if not profile_requested(request):
+        return await call_next(request)
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if scheme.lower() != "bearer" or not await run_in_threadpool(is_admin_token, token):
+        return JSONResponse(status_code=403, content={"detail": "Profiling requires the admin scope"})
+
+    session = ProfileSession(request.method, request.url.path, str(request.query_params))
+    context_token = PROFILE_SESSION.set(session)
+    session.start()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        session.stop()
+        PROFILE_SESSION.reset(context_token)
+        PROFILES.save(session, status)
+    response.headers["X-Profile-Id"] = session.id
+    return response
+
+
+@app.middleware("http")
+async def tag_upstream_caller(request: Request, call_next):
+    # Each request is its own job: concurrent reports share the report class round-robin
+    priority = "interactive" if request.url.path.startswith(INTERACTIVE_PATH_PREFIXES) else "report"
+    with upstream_caller(priority, f"{request.url.path}#{uuid.uuid4().hex[:8]}"):
+        return await call_next(request)
+
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailable):
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={"detail": f"Upstream unavailable ({exc})"}, headers=headers)
 
 
 app.include_router(
@@ -21,6 +122,12 @@ app.include_router(
     tags=["詮釋資料 & 非即時資料 (from DB)"],
 )
 
+app.include_router(
+    live_feed.router,
+    prefix="/iow/live",
+    tags=["即時推播 (SSE / WebSocket)"],
+)
+
 app.include_router(
     history_data.router,
     prefix="/iow/history",
@@ -41,6 +148,13 @@ app.include_router(
     tags=["帳戶管理"]
 )
 
+app.include_router(
+    profiles.router,
+    prefix="/admin/profiles",
+    tags=["admin"],
+    dependencies=[Security(get_current_user, scopes=["admin"])],
+)
+
 # app.include_router(
 #     admin.router,
 #     prefix="/admin",
@@ -52,3 +166,33 @@ app.include_router(
 @app.get("/")
 def root():
     return {"message": "Welcome to get data by yourself!"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/upstream_status")
+def upstream_status():
+    return [guard.status() for guard in UPSTREAMS.values()]
+
+
+@app.get("/latest_snapshot_status")
+def latest_snapshot_status():
+    return LATEST_SNAPSHOT.status()
+
+
+@app.get("/pump_window_status")
+def pump_window_status():
+    return PUMP_WINDOW.status()
+
+
+@app.get("/history_prefetch_status")
+def history_prefetch_status():
+    return prefetch_status()
+
+
+@app.get("/cache_status")
+def cache_status():
+    return CACHE.stats()
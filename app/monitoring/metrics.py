@@ -0,0 +1,206 @@
+# monitoring/metrics.py
+"""Prometheus text-format metrics kept in process (no external service)"""
+from pymongo import monitoring
+import threading
+import os
+import re
+
+from app.monitoring.profiling import record_time
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+UUID_PATTERN = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect  # callable => {label values tuple: value}, evaluated at scrape time
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        if self.collect is not None:
+            try:
+                values = self.collect()
+            except Exception as e:
+                print(f"Metric {self.name} collect failed: {e}")
+                values = {}
+            with self._lock:
+                self._values = dict(values)
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self):
+        with self._lock:
+            items = [(key, dict(state, buckets=list(state["buckets"]))) for key, state in self._values.items()]
+        lines = self.header()
+        for key, state in items:
+            for bound, count in zip(self.buckets, state["buckets"]):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {state['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+REGISTRY = []
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def endpoint_label(path):
+    """e.g. api/Station/Get/{uuid} => Station/Get, api/v1/devices/MPD => devices/MPD"""
+    segments = []
+    for segment in path.split("?")[0].strip("/").split("/"):
+        if segment in ("api", "v1", "v3") or UUID_PATTERN.match(segment) or segment[:1].isdigit():
+            continue
+        segments.append(segment)
+    return "/".join(segments[:2])
+
+
+# HTTP
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Latency of API routes", ["method", "route", "status"]
+)
+
+# Upstream (IoW / AIOT)
+UPSTREAM_CALLS = Counter("upstream_requests_total", "Upstream calls", ["upstream", "endpoint", "status"])
+UPSTREAM_LATENCY = Histogram("upstream_request_duration_seconds", "Upstream call latency", ["upstream", "endpoint"])
+UPSTREAM_RETRIES = Counter("upstream_retries_total", "Retries after a failed upstream call", ["endpoint"])
+TOKEN_REFRESHES = Counter("upstream_token_refreshes_total", "Token requests", ["upstream"])
+UPSTREAM_QUEUE_DEPTH = Gauge("upstream_queue_depth", "Calls waiting for a rate-limit token", ["upstream", "priority"])
+UPSTREAM_QUEUE_WAIT = Histogram(
+    "upstream_queue_wait_seconds", "Wait for a rate-limit token", ["upstream", "priority"]
+)
+
+# Cache / store
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups", ["cache", "result"])
+
+# Reports
+REPORT_ROWS = Counter("report_rows_total", "Rows produced per report", ["report"])
+
+# MongoDB
+MONGO_COMMAND_LATENCY = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ["command", "status"]
+)
+
+
+def observe_report_rows(report, df):
+    REPORT_ROWS.inc(0 if df is None else len(df), report=report)
+
+
+def temp_dir_usage():
+    temp_folder_path = os.getcwd() + "/temp/"
+    total_bytes = 0
+    total_files = 0
+    for root, _, files in os.walk(temp_folder_path):
+        for file_name in files:
+            try:
+                total_bytes += os.path.getsize(os.path.join(root, file_name))
+                total_files += 1
+            except OSError:
+                pass
+    return {("bytes",): total_bytes, ("files",): total_files}
+
+
+TEMP_DIR_USAGE = Gauge("temp_dir_usage", "Size of the temp/ folder", ["unit"], collect=temp_dir_usage)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name, status="ok")
+        record_time("mongo", event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMAND_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name, status="error")
+        record_time("mongo", event.duration_micros / 1e6)
+
+
+# Applies to every MongoClient created after this import (see app/main.py)
+monitoring.register(MongoCommandListener())
@@ -0,0 +1,266 @@
+# monitoring/profiling.py
+"""Opt-in per-request sampling profiler (admin only, see app/main.py)"""
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from decouple import Config, RepositoryEnv
+from fastapi.routing import APIRoute
+import functools
+import inspect
+import threading
+import time
+import uuid
+import sys
+import os
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+PROFILE_SAMPLE_INTERVAL_MS = ENV.get('PROFILE_SAMPLE_INTERVAL_MS', default=5, cast=int)
+PROFILE_MAX_STORED = ENV.get('PROFILE_MAX_STORED', default=50, cast=int)
+PROFILE_MAX_STACK_DEPTH = 128
+
+# Set only while a profiled request is running; None otherwise
+PROFILE_SESSION = ContextVar("profile_session", default=None)
+
+
+def profile_requested(request):
+    """`X-Profile: 1` header or `?profile=1`"""
+    flag = request.headers.get("X-Profile") or request.query_params.get("profile")
+    return flag is not None and flag.lower() in ("1", "true", "yes")
+
+
+def frame_label(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(base_dir):
+        filename = filename[len(base_dir) + 1:]
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename})"
+
+
+def collapse_stack(frame):
+    """root;...;leaf (flamegraph.pl / speedscope collapsed format)"""
+    labels = []
+    while frame is not None and len(labels) < PROFILE_MAX_STACK_DEPTH:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def union_seconds(intervals):
+    """Length of the union of (start, end) intervals"""
+    total = 0.0
+    covered_until = None
+    for start, end in sorted(intervals):
+        if covered_until is None or start > covered_until:
+            total += end - start
+            covered_until = end
+        elif end > covered_until:
+            total += end - covered_until
+            covered_until = end
+    return total
+
+
+class ProfileSession:
+    """
+    Samples the threads running one request (the endpoint's and its map_in_context workers) and
+    records the (start, end) of the upstream / MongoDB / serialization time of each of them.
+    """
+
+    def __init__(self, method, path, query, interval_ms=PROFILE_SAMPLE_INTERVAL_MS):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.query = query
+        self.interval = max(interval_ms, 1) / 1000
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.thread_ids = Counter()  # thread id => attach depth
+        self.samples = Counter()
+        self.sample_count = 0
+        self.intervals = {"upstream_io": [], "mongo": [], "serialization": []}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started = None
+        self.wall_sec = None
+
+    def attach(self, thread_id=None):
+        with self._lock:
+            self.thread_ids[thread_id or threading.get_ident()] += 1
+
+    def detach(self, thread_id=None):
+        thread_id = thread_id or threading.get_ident()
+        with self._lock:
+            self.thread_ids[thread_id] -= 1
+            if self.thread_ids[thread_id] <= 0:
+                del self.thread_ids[thread_id]
+
+    def add_time(self, category, seconds):
+        """`seconds` that ended now"""
+        end = time.perf_counter()
+        with self._lock:
+            self.intervals.setdefault(category, []).append((end - seconds, end))
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._sampler = threading.Thread(target=self._run, name=f"profiler-{self.id[:8]}", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join(timeout=1)
+        self.wall_sec = time.perf_counter() - self._started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                thread_ids = list(self.thread_ids)
+            if not thread_ids:
+                continue
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.samples[collapse_stack(frame)] += 1
+                    self.sample_count += 1
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+    def breakdown(self):
+        """
+        Wall-clock seconds per category: the union over threads, so parallel upstream calls of a
+        fan-out route count once. `compute` is the wall time not covered by any category.
+        """
+        wall = self.wall_sec or 0.0
+        with self._lock:
+            intervals = {category: list(spans) for category, spans in self.intervals.items()}
+        timings = {category: round(union_seconds(spans), 4) for category, spans in intervals.items()}
+        waiting = union_seconds([span for spans in intervals.values() for span in spans])
+        timings["compute"] = round(max(wall - waiting, 0.0), 4)
+        return timings
+
+    def thread_time(self):
+        """Seconds per category summed over threads (exceeds the wall time when calls overlap)"""
+        with self._lock:
+            return {category: round(sum((end - start for start, end in spans), 0.0), 4) for category, spans in self.intervals.items()}
+
+    def summary(self, status=None):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "query": self.query,
+            "status": status,
+            "started_at": self.started_at,
+            "wall_sec": round(self.wall_sec or 0.0, 4),
+            "breakdown_sec": self.breakdown(),
+            "thread_time_sec": self.thread_time(),
+            "sample_interval_ms": round(self.interval * 1000, 2),
+            "samples": self.sample_count,
+        }
+
+
+class ProfileStore:
+    """Last `max_items` finished profiles, in memory"""
+
+    def __init__(self, max_items=PROFILE_MAX_STORED):
+        self.max_items = max_items
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def save(self, session, status):
+        profile = session.summary(status)
+        profile["collapsed"] = session.collapsed()
+        with self._lock:
+            self._profiles[session.id] = profile
+            while len(self._profiles) > self.max_items:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [{k: v for k, v in profile.items() if k != "collapsed"} for profile in reversed(profiles)]
+
+
+PROFILES = ProfileStore()
+
+
+@contextmanager
+def profile_timer(category):
+    """Adds the block's wall time to `category` of the current profile (no-op when not profiling)"""
+    session = PROFILE_SESSION.get()
+    if session is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        session.add_time(category, time.perf_counter() - started)
+
+
+def record_time(category, seconds):
+    session = PROFILE_SESSION.get()
+    if session is not None:
+        session.add_time(category, seconds)
+
+
+def run_attached(fn, *args):
+    """`fn(*args)` with the current thread sampled by the current profile (if any); for worker threads"""
+    session = PROFILE_SESSION.get()
+    if session is None:
+        return fn(*args)
+    session.attach()
+    try:
+        return fn(*args)
+    finally:
+        session.detach()
+
+
+def profiled_endpoint(endpoint):
+    """Registers the thread running `endpoint` with the current profile (if any)"""
+    if getattr(endpoint, "profiled", False):
+        # include_router() rebuilds the route with the already wrapped endpoint
+        return endpoint
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def wrapper(*args, **kwargs):
+            session = PROFILE_SESSION.get()
+            if session is None:
+                return await endpoint(*args, **kwargs)
+            session.attach()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                session.detach()
+    else:
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            session = PROFILE_SESSION.get()
+            if session is None:
+                return endpoint(*args, **kwargs)
+            session.attach()
+            try:
+                return endpoint(*args, **kwargs)
+            finally:
+                session.detach()
+    wrapper.profiled = True
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    """APIRouter(route_class=ProfiledRoute): endpoints can be sampled with `X-Profile: 1`"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, profiled_endpoint(endpoint), **kwargs)
@@ -0,0 +1,31 @@
+"""Profiling API (admin)"""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from app.monitoring.profiling import PROFILES
+
+
+router = APIRouter()
+
+
+@router.get("/")
+def list_profiles():
+    return PROFILES.list()
+
+
+@router.get("/{profile_id}")
+def get_profile(profile_id: str):
+    profile = PROFILES.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return {k: v for k, v in profile.items() if k != "collapsed"}
+
+
+@router.get("/{profile_id}/collapsed", response_class=PlainTextResponse)
+def get_profile_collapsed_stacks(profile_id: str):
+    # flamegraph.pl / speedscope input: "frame;frame;frame count"
+    profile = PROFILES.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(profile["collapsed"])
@@ -0,0 +1,73 @@
+# routers/http_cache.py
+"""
+Conditional GET: strong ETag over the JSON body, `If-None-Match` (or `If-Modified-Since`) => 304,
+and `Cache-Control: private, max-age` for as long as the data stays fresh, so the client can answer
+repeated polls. `private`: the GET routes take IoW credentials in the query string, so shared caches
+must neither store these URLs nor hand the response to another client.
+"""
+from email.utils import formatdate, parsedate_to_datetime
+from decouple import Config, RepositoryEnv
+import hashlib
+import json
+import os
+
+from fastapi import Request, Response
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+# Station / PQ metadata rarely changes; clients revalidate (cheap 304) after this
+HTTP_METADATA_MAX_AGE_SEC = ENV.get('HTTP_METADATA_MAX_AGE_SEC', default=300, cast=int)
+
+
+def json_body(data):
+    """Same bytes as FastAPI's JSONResponse"""
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def strong_etag(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison, as If-None-Match requires (a `W/` prefix is ignored)"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def not_modified_since(if_modified_since, last_modified):
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    return int(last_modified) <= since
+
+
+def conditional_json(request: Request, data, max_age, last_modified=None, age=None):
+    """
+    200 with `data` as JSON, or 304 when the client's copy is current. `last_modified` (epoch sec)
+    adds `Last-Modified`; `age` (sec since the data was fetched) adds `Age`, which caches deduct
+    from `max_age`.
+    """
+    body = json_body(data)
+    etag = strong_etag(body)
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={max(int(max_age), 0)}"}
+    if last_modified is not None:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    if age is not None:
+        headers["Age"] = str(max(int(age), 0))
+
+    # If-Modified-Since only counts without If-None-Match
+    if_none_match = request.headers.get("If-None-Match")
+    if_modified_since = request.headers.get("If-Modified-Since")
+    if if_none_match is not None:
+        not_modified = etag_matches(if_none_match, etag)
+    elif if_modified_since is not None and last_modified is not None:
+        not_modified = not_modified_since(if_modified_since, last_modified)
+    else:
+        not_modified = False
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
@@ -1,25 +1,38 @@
 """History Data API"""
 
 from decouple import Config, RepositoryEnv
-from typing import Annotated
+from typing import Annotated, List, Optional
 from datetime import datetime, timedelta
 from pymongo import MongoClient
+import numpy as np
 import pandas as pd
 import requests
 import zipfile
+import base64
+import json
 import string
 import random
 import time
 import os
 
-from fastapi import APIRouter, Body, File, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Body, Depends, File, HTTPException, UploadFile, Query
+from fastapi.responses import FileResponse, StreamingResponse
 
-from app.schemas import Item
-from app.routers.iow.latest_data import get_Station_metadata, write_file
+from app.schemas import Item, parse_and_format_date
+from app.ingest.uploads import parse_upload
+from app.ingest.series import TimeSeries, RESAMPLE_AGGREGATIONS, RESAMPLE_FILL_POLICIES, resample
+from app.routers.iow.latest_data import get_IoW_headers, get_Station_metadata, write_file
+from app.store.rollup import update_rollups
+from app.store.history_cache import HISTORY_CACHE_ENABLED, day_range, is_complete, load_day, store_days
+from app.upstream.client import iow_request
+from app.upstream.stream import iter_json_array
+from app.upstream.resilience import retry_delay
+from app.monitoring.metrics import CACHE_REQUESTS, observe_report_rows
+from app.monitoring.profiling import ProfiledRoute, profile_timer
+from app.store.scratch import scratch_dir
 
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 
 # Load environment variables
 base_dir = os.getcwd()
@@ -39,37 +52,46 @@ HISTORY_dbClient = MongoClient(
 )
 HISTORY_db = HISTORY_dbClient.iow
 
+# Download format => file extension (see `write_file`)
+FILE_FORMATS = {'csv': 'csv', 'parquet': 'parquet', 'arrow': 'arrows', 'feather': 'feather'}
+
+
+def get_avail_rate_from_DB(pq_uuid, datetime_start, datetime_end):
+    format_datetime_start = datetime.strptime(datetime_start, '%Y-%m-%d')
+    format_datetime_end = datetime.strptime(datetime_end, '%Y-%m-%d') + timedelta(hours=23, minutes=59, seconds=59)
+    return list(HISTORY_db.avail_rate.find(
+        {
+            "pq_uuid": pq_uuid,
+            "date": {
+                "$gte": format_datetime_start,
+                "$lte": format_datetime_end
+            }
+        },
+        {
+            "_id": 0
+        }
+    ).sort("date", 1))
+
 
 def get_PhysicalQuantity_history_data_within12hr(
     headers, client_id, client_secret, item, st_name, max_retries=5, delay=4
 ):
-    All_pq_Dict = dict()
-    All_pq_Dict[item.pq_uuid] = []
-
     pq_history_API = f'TimeSeriesData/ReadRawData/{item.pq_uuid}/{item.datetime_start}/{item.datetime_end}/true/480'
     for attempt in range(max_retries):
         try:
-            pq_history_response = requests.get(f'https://iapi.wra.gov.tw/v3/api/{pq_history_API}', headers=headers, timeout=5)
-            pq_history_response.raise_for_status()
-            pq_history_response = pq_history_response.json()
-
-            history = pq_history_response["DataPoints"]
-            for h in history:
-                All_pq_Dict[item.pq_uuid].append(h)
-            df = pd.DataFrame.from_dict(All_pq_Dict[item.pq_uuid])
-            df['Station'] = st_name
-            return df
+            pq_history_response = iow_request("get", f'api/{pq_history_API}', headers=headers, timeout=5, stream=True)
+            with pq_history_response:
+                pq_history_response.raise_for_status()
+                return TimeSeries.from_points(iter_json_array(pq_history_response, "DataPoints"), st_name)
 
         except requests.exceptions.RequestException as e:
             print(f"Request failed (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:  # Retry if not the last attempt
-                print(f"【 No.{attempt + 1} 】 Retrying in {delay} seconds...")
-                time.sleep(delay)
+                wait_sec = retry_delay(e, delay)
+                print(f"【 No.{attempt + 1} 】 Retrying in {wait_sec} seconds...")
+                time.sleep(wait_sec)
                 # Get IoW token
-                PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-                response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-                token = response["access_token"]
-                headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+                headers = get_IoW_headers(client_id, client_secret, refresh=True)
             else:
                 raise
     return None
@@ -78,56 +100,154 @@ def get_PhysicalQuantity_history_data_within12hr(
 def get_PhysicalQuantity_history_data(
     headers, client_id, client_secret, item, st_name, max_retries=5, delay=4
 ):
-    All_pq_Dict = dict()
-    All_pq_Dict[item.pq_uuid] = []
+    """
+    Raw data of the whole days [item.datetime_start, item.datetime_end]: complete days come from the
+    local history cache (app/store/history_cache.py), only the missing days are read from IoW
+    (one ReadRawData call from the first to the last missing day) and then cached.
+    """
+    if not HISTORY_CACHE_ENABLED:
+        return fetch_PhysicalQuantity_history_data(headers, client_id, client_secret, item, st_name, max_retries, delay)
+    days = day_range(item.datetime_start, item.datetime_end)
+    cached = {day: load_day(item.pq_uuid, day, st_name) for day in days if is_complete(day)}
+    missing = [day for day in days if cached.get(day) is None]
+    if not missing:
+        CACHE_REQUESTS.inc(cache="history", result="hit")
+        return TimeSeries.concat([cached[day] for day in days])
+
+    CACHE_REQUESTS.inc(cache="history", result="partial" if len(missing) < len(days) else "miss")
+    fetch_item = item.model_copy(update={"datetime_start": missing[0], "datetime_end": missing[-1]})
+    fetched = fetch_PhysicalQuantity_history_data(headers, client_id, client_secret, fetch_item, st_name, max_retries, delay)
+    if fetched is None:
+        return None
+    fetched_days = day_range(missing[0], missing[-1])
+    try:
+        store_days(item.pq_uuid, fetched_days, fetched)
+    except OSError as e:
+        print(f"History cache write failed ({item.pq_uuid}): {e}")
+    before = [cached[day] for day in days if day < missing[0]]
+    after = [cached[day] for day in days if day > missing[-1]]
+    if not before and not after:
+        return fetched
+    return TimeSeries.concat(before + [fetched] + after)
+
 
+def fetch_PhysicalQuantity_history_data(
+    headers, client_id, client_secret, item, st_name, max_retries=5, delay=4
+):
     pq_history_API = 'TimeSeriesData/ReadRawData/' + \
         f'{item.pq_uuid}/{item.datetime_start}T00.00.00/{item.datetime_end}T23.59.59/true/480'
     for attempt in range(max_retries):
         try:
-            pq_history_response = requests.get(f'https://iapi.wra.gov.tw/v3/api/{pq_history_API}', headers=headers, timeout=5)
-            pq_history_response.raise_for_status()
-            pq_history_response = pq_history_response.json()
-
-            history = pq_history_response["DataPoints"]
-            for h in history:
-                All_pq_Dict[item.pq_uuid].append(h)
-            df = pd.DataFrame.from_dict(All_pq_Dict[item.pq_uuid])
-            df['Station'] = st_name
-            return df
+            # DataPoints are parsed while the body downloads (memory bounded by STREAM_CHUNK_KB / SERIES_BATCH_SIZE)
+            pq_history_response = iow_request("get", f'api/{pq_history_API}', headers=headers, timeout=5, stream=True)
+            with pq_history_response:
+                pq_history_response.raise_for_status()
+                series = TimeSeries.from_points(iter_json_array(pq_history_response, "DataPoints"), st_name)
+
+            # Whole days were fetched => refresh hourly / daily rollups
+            try:
+                update_rollups(item.pq_uuid, series, item.datetime_start, item.datetime_end)
+            except Exception as e:
+                print(f"Rollup update failed ({item.pq_uuid}): {e}")
+            return series
 
         except requests.exceptions.RequestException as e:
             print(f"Request failed (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:  # Retry if not the last attempt
-                print(f"【 No.{attempt + 1} 】 Retrying in {delay} seconds...")
-                time.sleep(delay)
+                wait_sec = retry_delay(e, delay)
+                print(f"【 No.{attempt + 1} 】 Retrying in {wait_sec} seconds...")
+                time.sleep(wait_sec)
                 # Get IoW token
-                PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-                response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-                token = response["access_token"]
-                headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+                headers = get_IoW_headers(client_id, client_secret, refresh=True)
             else:
                 raise
     return None
 
 
-def compress(file_names):
+def write_history_file(series, st_name, pq_uuid, file_format, folder=None):
+    f_name = f'{st_name}_{pq_uuid}.{FILE_FORMATS[file_format]}'
+    # CSV keeps the IoW TimeStamp strings; columnar formats get typed columns
+    df = series.to_frame(iso_timestamps=file_format == 'csv')
+    return write_file(df, f_name, folder), f_name
+
+
+def encode_cursor(timestamp, skip):
+    cursor = json.dumps({"ts": timestamp, "skip": skip}).encode("utf-8")
+    return base64.urlsafe_b64encode(cursor).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return pd.Timestamp(data["ts"]), int(data["skip"])
+    except Exception as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor") from e
+
+
+def get_history_page(headers, pq_uuid, datetime_start, datetime_end, limit, cursor=None):
+    """
+    Newest-first page of raw data points of [datetime_start, datetime_end] (YYYY-MM-DD),
+    fetched day by day through `get_PhysicalQuantity_history_data`.
+    Cursor: last returned TimeStamp + how many points sharing that TimeStamp were already returned.
+    """
+    first_day = datetime.strptime(datetime_start, "%Y-%m-%d").date()
+    day = datetime.strptime(datetime_end, "%Y-%m-%d").date()
+    before, skip = decode_cursor(cursor) if cursor else (None, 0)
+    if before is not None:
+        day = min(day, before.tz_convert("Asia/Taipei").date() if before.tzinfo else before.date())
+
+    points = []
+    while day >= first_day and len(points) <= limit:
+        item = Item(
+            datetime_start=day.strftime("%Y-%m-%d"),
+            datetime_end=day.strftime("%Y-%m-%d"),
+            st_uuid="",
+            pq_uuid=pq_uuid,
+        )
+        series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, "")
+        if series is not None and len(series) > 0:
+            series = series.take(np.argsort(-series.timestamps, kind="stable"))
+            if before is not None:
+                series = series.take(np.concatenate([
+                    np.flatnonzero(series.timestamps == before.value)[skip:],
+                    np.flatnonzero(series.timestamps < before.value),
+                ]))
+            for timestamp, point in zip(series.datetimes(), series.records()):
+                point["_ts"] = timestamp
+                points.append(point)
+        day -= timedelta(days=1)
+
+    page = points[:limit]
+    next_cursor = None
+    if len(points) > limit:
+        last_ts = page[-1]["_ts"]
+        same_ts = sum(1 for point in page if point["_ts"] == last_ts)
+        if before is not None and last_ts == before:
+            same_ts += skip
+        next_cursor = encode_cursor(last_ts.isoformat(), same_ts)
+    for point in page:
+        del point["_ts"]
+    return page, next_cursor
+
+
+def compress(file_names, folder=None):
     # create the zip file first parameter path/name, second mode
-    temp_folder_path = base_dir + "/temp/"
+    temp_folder_path = folder or base_dir + "/temp/"
     random_string = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
     f_name = f'DATA_{random_string}.zip'
     zip_filepath = os.path.join(temp_folder_path, f_name)
     try:
-        for file_name in file_names:
-            with zipfile.ZipFile(zip_filepath, mode='a') as zf:
-                zf.write(file_name)
+        with profile_timer("serialization"):
+            for file_name in file_names:
+                with zipfile.ZipFile(zip_filepath, mode='a') as zf:
+                    zf.write(file_name, os.path.basename(file_name))
     except FileNotFoundError:
         print("An error occurred")
     return zip_filepath, f_name
 
 
 @router.post("/download/single_station/raw_data", response_class=FileResponse)
-async def download_single_station_raw_data(
+def download_single_station_raw_data(
     item: Annotated[
         Item, Body(
             examples=[{
@@ -137,80 +257,141 @@ async def download_single_station_raw_data(
                 "pq_uuid": "",
             }],
         )
-    ]
+    ],
+    file_format: str = Query('csv', alias='format', enum=list(FILE_FORMATS)),
+    scratch: str = Depends(scratch_dir),
 ):
     # Get IoW token
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
 
     # API
     s_response = get_Station_metadata(item.st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
     st_name = s_response['Name']
 
-    df = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
-    f_name = f'{st_name}_{item.pq_uuid}.csv'
-    f_path = write_file(df, f_name)
+    series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
+    observe_report_rows("raw_data", series)
+    f_path, f_name = write_history_file(series, st_name, item.pq_uuid, file_format, scratch)
     return FileResponse(f_path, media_type='application/octet-stream', filename=f_name)
 
 
+@router.post("/download/single_station/resampled", response_class=FileResponse)
+def download_single_station_resampled_data(
+    item: Annotated[
+        Item, Body(
+            examples=[{
+                "datetime_start": "2024-07-01",
+                "datetime_end": "2024-07-31",
+                "st_uuid": "",
+                "pq_uuid": "",
+            }],
+        )
+    ],
+    bucket: str = Query('1h', description="Bucket width, e.g. 5min / 10min / 1h / 1d (Asia/Taipei aligned)"),
+    agg: List[str] = Query(['mean'], description=" / ".join(RESAMPLE_AGGREGATIONS)),
+    fill: str = Query('none', enum=list(RESAMPLE_FILL_POLICIES)),
+    file_format: str = Query('csv', alias='format', enum=list(FILE_FORMATS)),
+    scratch: str = Depends(scratch_dir),
+):
+    """Raw data of [datetime_start, datetime_end] aggregated per bucket (one row per bucket instead of per point)"""
+    aggregations = [name.strip() for value in agg for name in value.split(",") if name.strip()]
+    try:
+        # Validates the parameters before anything is fetched
+        resample(TimeSeries.empty(), bucket, aggregations, fill)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    # Get IoW token
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
+
+    # API
+    s_response = get_Station_metadata(item.st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
+    st_name = s_response['Name']
+
+    series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
+    range_end = datetime.strptime(item.datetime_end, "%Y-%m-%d") + timedelta(days=1)
+    try:
+        df = resample(
+            series, bucket, aggregations, fill, item.datetime_start, range_end, iso_timestamps=file_format == 'csv'
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+    observe_report_rows("resampled", df)
+
+    f_name = f'{st_name}_{item.pq_uuid}_{bucket}.{FILE_FORMATS[file_format]}'
+    f_path = write_file(df, f_name, scratch)
+    return FileResponse(
+        f_path, media_type='application/octet-stream', filename=f_name, headers={"X-Raw-Points": str(len(series))}
+    )
+
+
 @router.post("/download/multiple_stations/raw_data", response_class=FileResponse)
-async def download_multiple_stations_raw_data(
+def download_multiple_stations_raw_data(
     client_id: str,
     client_secret: str,
     datetime_start: str,
     datetime_end: str,
-    st_pq_file: UploadFile = File(...)
+    file_format: str = Query('csv', alias='format', enum=list(FILE_FORMATS)),
+    st_pq_file: UploadFile = File(...),
+    scratch: str = Depends(scratch_dir)
 ):
     # Get IoW token
-    PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
-
-    # Write txt file to temp folder
-    try:
-        temp_folder_path = base_dir + "/temp/"
-        if not os.path.exists(temp_folder_path):
-            os.makedirs(temp_folder_path)
-        with open(temp_folder_path + st_pq_file.filename, 'wb') as f:
-            f.write(st_pq_file.file.read())
-    except Exception as e:
-        return {"message": f"There was an error uploading the file. {str(e)}"}
+    headers = get_IoW_headers(client_id, client_secret)
 
-    # Read txt file (One line, one station)
-    with open(temp_folder_path + st_pq_file.filename, 'r', encoding='utf-8') as f:
-        content = f.readlines()
+    # One station, one or more PQs
+    plan = parse_upload(st_pq_file)
 
     file_names = []
-    for line in content:
-        line = line.replace("\n", "").replace("\t", ",")
-        line = line.split(",")
-        st_uuid = line[0]
-        pq_uuid = line[1]
-
+    for st_uuid, pq_uuids in plan.stations.items():
         # API
         s_response = get_Station_metadata(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
         st_name = s_response['Name']
 
-        item = Item(
-            datetime_start=datetime_start,
-            datetime_end=datetime_end,
-            st_uuid=st_uuid,
-            pq_uuid=pq_uuid
-        )
-        df = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
-        f_name = f'{st_name}_{pq_uuid}.csv'
-        f_path = write_file(df, f_name)
-        file_names.append(f_path)
-    zip_filepath, f_name = compress(file_names)
-    return FileResponse(zip_filepath, media_type='application/octet-stream', filename=f_name)
+        for pq_uuid in pq_uuids:
+            item = Item(
+                datetime_start=datetime_start,
+                datetime_end=datetime_end,
+                st_uuid=st_uuid,
+                pq_uuid=pq_uuid
+            )
+            series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
+            observe_report_rows("raw_data", series)
+            f_path, f_name = write_history_file(series, st_name, pq_uuid, file_format, scratch)
+            file_names.append(f_path)
+    zip_filepath, f_name = compress(file_names, scratch)
+    return FileResponse(zip_filepath, media_type='application/octet-stream', filename=f_name, headers=plan.headers())
+
+
+@router.get("/query/raw_data")
+def query_raw_data(
+    pq_uuid: str,
+    datetime_start: str,
+    datetime_end: str,
+    limit: int = Query(1000, ge=1, le=10000),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = Query(None, description="e.g. TimeStamp,Value"),
+):
+    """NDJSON page (newest first); the continuation cursor is returned in the `X-Next-Cursor` header"""
+    datetime_start = parse_and_format_date(datetime_start)[:10]
+    datetime_end = parse_and_format_date(datetime_end)[:10]
+
+    # Get IoW token
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
+
+    page, next_cursor = get_history_page(headers, pq_uuid, datetime_start, datetime_end, limit, cursor)
+    if fields:
+        projection = [field.strip() for field in fields.split(",") if field.strip()]
+        page = [{field: point.get(field) for field in projection} for point in page]
+
+    response_headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    lines = (json.dumps(point, ensure_ascii=False, default=str) + "\n" for point in page)
+    return StreamingResponse(lines, media_type="application/x-ndjson", headers=response_headers)
 
 
 @router.post("/report/avail_rate_daily", response_class=FileResponse)
-async def 日妥善率歷史報表(
+def 日妥善率歷史報表(
     datetime_start: str,
     datetime_end: str,
+    scratch: str = Depends(scratch_dir),
 ):
     format_datetime_start = datetime.strptime(datetime_start, '%Y-%m-%d') + timedelta(hours=0, minutes=0, seconds=0)
     format_datetime_end = datetime.strptime(datetime_end, '%Y-%m-%d') + timedelta(hours=23, minutes=59, seconds=59)
@@ -221,11 +402,12 @@ async def 日妥善率歷史報表(
                 "$lte": format_datetime_end
             }
         },
+        # The report's columns; the avail_rate job also stores 日期, st_uuid, st_name, counts, N_records_per_day
         {
-            "_id": 0, "date": 0
+            "_id": 0, "pq_uuid": 1, "日妥善率 (%)": 1
         }
     ))
     df = pd.DataFrame.from_dict(data)
     f_name = f'日妥善率歷史報表_{datetime_start}_{datetime_end}.csv'
-    f_path = write_file(df, f_name)
+    f_path = write_file(df, f_name, scratch)
     return FileResponse(f_path, media_type="application/octet-stream", filename=f_name)
@@ -1,27 +1,56 @@
 """Latest Data API"""
 
 from collections import defaultdict
+from decouple import Config, RepositoryEnv
+from typing import List, Optional
+import pyarrow as pa
 import pandas as pd
 import requests
 import json
 import time
 import os
 
-from fastapi import APIRouter, File, UploadFile, Query
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile, Query
 from fastapi.responses import FileResponse
 
+from app.ingest.uploads import parse_upload
+from app.routers.http_cache import HTTP_METADATA_MAX_AGE_SEC, conditional_json
+from app.store.cache import CACHE, CACHE_LATEST_TTL_SEC, CACHE_METADATA_TTL_SEC, CACHE_TOKEN_TTL_SEC, key_digest
+from app.store.latest import LATEST_SNAPSHOT, parse_cursor
+from app.store.scratch import scratch_dir
+from app.upstream.client import iow_get_coalesced, iow_request
+from app.upstream.resilience import retry_delay
+from app.monitoring.metrics import CACHE_REQUESTS
+from app.monitoring.profiling import profile_timer
+
 router = APIRouter()
 base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+# st_uuid,pq_uuid (淹水深度) of every RFD station
+RFD_FLOOD_DEPTH_FILE = ENV.get(
+    'RFD_FLOOD_DEPTH_FILE', default=base_dir + "/Documents/STuuid_PQuuid_RFD_ALL_245_淹.csv"
+)
 
 
 def get_Station_metadata(
     st_uuid, headers, client_id, client_secret, max_retries=5, delay=4
+):
+    """Station/Get, cached for CACHE_METADATA_TTL_SEC"""
+    return CACHE.get_or_set(
+        f"metadata:station:{st_uuid}",
+        lambda: fetch_Station_metadata(st_uuid, headers, client_id, client_secret, max_retries, delay),
+        CACHE_METADATA_TTL_SEC,
+    )
+
+
+def fetch_Station_metadata(
+    st_uuid, headers, client_id, client_secret, max_retries=5, delay=4
 ):
     s_API = f'Station/Get/{st_uuid}'
 
     for attempt in range(max_retries):
         try:
-            s_response = requests.get(f'https://iapi.wra.gov.tw/v3/api/{s_API}', headers=headers, timeout=5)
+            s_response = iow_get_coalesced(f'api/{s_API}', headers=headers, timeout=5)
             s_response.raise_for_status()
             s_response = s_response.json()
 
@@ -34,13 +63,11 @@ def get_Station_metadata(
         except requests.exceptions.RequestException as e:
             print(f"Request failed (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:  # Retry if not the last attempt
-                print(f"【 No.{attempt + 1} 】 Retrying in {delay} seconds...")
-                time.sleep(delay)
+                wait_sec = retry_delay(e, delay)
+                print(f"【 No.{attempt + 1} 】 Retrying in {wait_sec} seconds...")
+                time.sleep(wait_sec)
                 # Get IoW token
-                PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-                response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-                token = response["access_token"]
-                headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+                headers = get_IoW_headers(client_id, client_secret, refresh=True)
                 continue
     return None
 
@@ -52,7 +79,7 @@ def get_PhysicalQuantity_UUIDs(
 
     for attempt in range(max_retries):
         try:
-            pq_response = requests.get(f'https://iapi.wra.gov.tw/v3/api/{pq_API}', headers=headers, timeout=5)
+            pq_response = iow_get_coalesced(f'api/{pq_API}', headers=headers, timeout=5)
             pq_response.raise_for_status()
             pq_response = pq_response.json()
 
@@ -65,13 +92,11 @@ def get_PhysicalQuantity_UUIDs(
         except requests.exceptions.RequestException as e:
             print(f"Request failed (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:  # Retry if not the last attempt
-                print(f"【 No.{attempt + 1} 】 Retrying in {delay} seconds...")
-                time.sleep(delay)
+                wait_sec = retry_delay(e, delay)
+                print(f"【 No.{attempt + 1} 】 Retrying in {wait_sec} seconds...")
+                time.sleep(wait_sec)
                 # Get IoW token
-                PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-                response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-                token = response["access_token"]
-                headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+                headers = get_IoW_headers(client_id, client_secret, refresh=True)
             else:
                 raise
     return None
@@ -84,7 +109,7 @@ def get_PhysicalQuantity_latest_data(
 
     for attempt in range(max_retries):
         try:
-            pq_response = requests.get(f'https://iapi.wra.gov.tw/v3/api/{pq_API}', headers=headers, timeout=5)
+            pq_response = iow_get_coalesced(f'api/{pq_API}', headers=headers, timeout=5)
             pq_response.raise_for_status()
             pq_response = pq_response.json()
 
@@ -98,13 +123,11 @@ def get_PhysicalQuantity_latest_data(
         except requests.exceptions.RequestException as e:
             print(f"Request failed (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:  # Retry if not the last attempt
-                print(f"【 No.{attempt + 1} 】 Retrying in {delay} seconds...")
-                time.sleep(delay)
+                wait_sec = retry_delay(e, delay)
+                print(f"【 No.{attempt + 1} 】 Retrying in {wait_sec} seconds...")
+                time.sleep(wait_sec)
                 # Get IoW token
-                PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-                response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-                token = response["access_token"]
-                headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+                headers = get_IoW_headers(client_id, client_secret, refresh=True)
             else:
                 raise
     return None
@@ -112,14 +135,23 @@ def get_PhysicalQuantity_latest_data(
 
 def get_PhysicalQuantity_metadata(
     pq_uuid, headers, client_id, client_secret, max_retries=5, delay=4
+):
+    """PhysicalQuantity/Get, cached for CACHE_METADATA_TTL_SEC"""
+    return CACHE.get_or_set(
+        f"metadata:pq:{pq_uuid}",
+        lambda: fetch_PhysicalQuantity_metadata(pq_uuid, headers, client_id, client_secret, max_retries, delay),
+        CACHE_METADATA_TTL_SEC,
+    )
+
+
+def fetch_PhysicalQuantity_metadata(
+    pq_uuid, headers, client_id, client_secret, max_retries=5, delay=4
 ):
     pq_metadata_API = f'PhysicalQuantity/Get/{pq_uuid}'
 
     for attempt in range(max_retries):
         try:
-            pq_metadata_response = requests.get(
-                f'https://iapi.wra.gov.tw/v3/api/{pq_metadata_API}', headers=headers, timeout=5
-            )
+            pq_metadata_response = iow_get_coalesced(f'api/{pq_metadata_API}', headers=headers, timeout=5)
             pq_metadata_response.raise_for_status()
             pq_metadata_response = pq_metadata_response.json()
 
@@ -132,57 +164,189 @@ def get_PhysicalQuantity_metadata(
         except requests.exceptions.RequestException as e:
             print(f"Request failed (attempt {attempt + 1}/{max_retries}): {e}")
             if attempt < max_retries - 1:  # Retry if not the last attempt
-                print(f"【 No.{attempt + 1} 】 Retrying in {delay} seconds...")
-                time.sleep(delay)
+                wait_sec = retry_delay(e, delay)
+                print(f"【 No.{attempt + 1} 】 Retrying in {wait_sec} seconds...")
+                time.sleep(wait_sec)
                 # Get IoW token
-                PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-                response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-                token = response["access_token"]
-                headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+                headers = get_IoW_headers(client_id, client_secret, refresh=True)
             else:
                 raise
     return None
 
 
-def write_file(data, filename):
+def write_file(data, filename, folder=None):
     file_type = filename.split(".")[-1]
-    temp_folder_path = base_dir + "/temp/"
+    temp_folder_path = folder or base_dir + "/temp/"
     if not os.path.exists(temp_folder_path):
         os.makedirs(temp_folder_path)
     output_file = os.path.join(temp_folder_path, filename)
-    if file_type == 'json':
-        with open(output_file, 'w', encoding="utf-8") as fp:
-            json.dump(data, fp, indent=4, ensure_ascii=False)
-    elif file_type == 'csv':
-        data.to_csv(output_file, encoding='utf-8-sig', index=False)
+    with profile_timer("serialization"):
+        if file_type == 'json':
+            with open(output_file, 'w', encoding="utf-8") as fp:
+                json.dump(data, fp, indent=4, ensure_ascii=False)
+        elif file_type == 'csv':
+            data.to_csv(output_file, encoding='utf-8-sig', index=False)
+        elif file_type == 'parquet':
+            data.to_parquet(output_file, compression='zstd', index=False)
+        elif file_type == 'feather':
+            data.reset_index(drop=True).to_feather(output_file, compression='zstd')
+        elif file_type == 'arrows':
+            # Arrow IPC stream
+            table = pa.Table.from_pandas(data, preserve_index=False)
+            with pa.OSFile(output_file, 'wb') as sink:
+                with pa.ipc.new_stream(sink, table.schema) as writer:
+                    writer.write_table(table)
     return output_file
 
 
-@router.post("/pq_uuid_list/{st_uuid}")
-async def lookup_physical_quantity_list(
-    client_id: str, client_secret: str, st_uuid: str
-):
-    # Get IoW token
-    PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+def get_IoW_headers(client_id, client_secret, refresh=False):
+    """
+    Request headers with an IoW token, shared by the workers for CACHE_TOKEN_TTL_SEC;
+    `refresh` (after a failed call) drops the cached token first.
+    """
+    key = f"token:iow:{key_digest(client_id + ':' + client_secret)}"
+    if refresh:
+        CACHE.delete(key)
+
+    def fetch():
+        # Get IoW token
+        PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
+        response = iow_request("post", "oauth2/token", data=PAYLOAD, timeout=5).json()
+        token = response["access_token"]
+        return {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+
+    return dict(CACHE.get_or_set(key, fetch, CACHE_TOKEN_TTL_SEC))
+
+
+def get_latest_data_cached(st_uuid, headers, client_id, client_secret, fresh=False):
+    """
+    (pq_uuid_dict, age in seconds) from the background snapshot (app/jobs/latest_snapshot.py)
+    or the copy another worker shared; calls IoW LatestData when `fresh` or the station
+    has not been polled yet.
+    """
+    snapshot = None if fresh else LATEST_SNAPSHOT.get_station(st_uuid) or LATEST_SNAPSHOT.load_shared(st_uuid)
+    if snapshot is not None:
+        CACHE_REQUESTS.inc(cache="latest_snapshot", result="hit")
+        pq_uuid_dict, fetched_at = snapshot
+        return pq_uuid_dict, LATEST_SNAPSHOT.age(fetched_at)
+
+    CACHE_REQUESTS.inc(cache="latest_snapshot", result="bypass" if fresh else "miss")
+    pq_uuid_dict = get_PhysicalQuantity_latest_data(st_uuid, headers, client_id, client_secret)
+    if pq_uuid_dict is not None:
+        LATEST_SNAPSHOT.update_station(st_uuid, pq_uuid_dict, share=True)
+    return pq_uuid_dict or {}, 0.0
+
+
+def read_flood_detention_pools():
+    st_uuids_path = base_dir + "/STATION_UUIDs/滯洪池_stUUID_pqUUID_滯洪池底.txt"
+    pools = []
+    with open(st_uuids_path, "r", encoding='utf-8') as f:
+        for row in f:
+            row = row.strip()
+            if not row:
+                continue
+            st_name, town, st_uuid, pq_uuid, pool_depth, levee_height, flood_detention_volume = row.split("\t")
+            pool_depth, levee_height, flood_detention_volume = map(float, [pool_depth, levee_height, flood_detention_volume])
+            pools.append({
+                "st_uuid": st_uuid,
+                "滯洪池名稱": st_name,
+                "鄉鎮": town,
+                "pq_uuid": pq_uuid,
+                "滯洪池底(m)": pool_depth,
+                "堤頂高": levee_height,
+                "滯洪量(m3)": flood_detention_volume
+            })
+    return pools
+
+
+def read_rfd_flood_depth_pq():
+    rfd_pq = {}
+    if os.path.isfile(RFD_FLOOD_DEPTH_FILE):
+        with open(RFD_FLOOD_DEPTH_FILE, "r", encoding="utf-8-sig") as f:
+            for line in f:
+                line = line.strip().replace("\t", ",").split(",")
+                if len(line) >= 2:
+                    rfd_pq[line[0]] = line[1]
+    return rfd_pq
+
+
+def calculate_flood_detention_pool(pool, pq_uuid_dict):
+    data = {key: value for key, value in pool.items() if key != "st_uuid"}
+    if pool["pq_uuid"] in pq_uuid_dict:
+        water_level = pq_uuid_dict[pool["pq_uuid"]]["Value"]
+        data["即時水位(m)"] = water_level
+        data["TimeStamp"] = pq_uuid_dict[pool["pq_uuid"]]["TimeStamp"]
+
+        # 公式： ((堤頂高 - 即時水位)/(堤頂高 - 滯洪池底))*滯洪量*0.7
+        estimated_remaining_flood_detention_volume = (
+            (pool["堤頂高"] - water_level) / (pool["堤頂高"] - pool["滯洪池底(m)"]) * pool["滯洪量(m3)"] * 0.7
+        )
+        data["預估剩餘滯洪量(m3)"] = round(estimated_remaining_flood_detention_volume, 1)
+    return data
+
+
+def physical_quantity_list(client_id, client_secret, st_uuid, fresh=False):
+    """({st_metadata, pq_list}, snapshot age in seconds)"""
+    headers = get_IoW_headers(client_id, client_secret)
 
     # API
     s_response = get_Station_metadata(st_uuid, headers, client_id, client_secret)
-    pq_uuid_list = get_PhysicalQuantity_UUIDs(st_uuid, headers, client_id, client_secret)
-    return {"st_metadata": s_response, "pq_list": pq_uuid_list}
+    pq_uuid_dict, age = get_latest_data_cached(st_uuid, headers, client_id, client_secret, fresh)
+    return {"st_metadata": s_response, "pq_list": list(pq_uuid_dict)}, age
 
 
-@router.post("/st_metadata/{st_uuid}")
-async def lookup_station_metadata(
-    client_id: str, client_secret: str, st_uuid: str
+@router.post("/pq_uuid_list/{st_uuid}")
+def lookup_physical_quantity_list(
+    client_id: str, client_secret: str, st_uuid: str, fresh: bool = False
+):
+    data, age = physical_quantity_list(client_id, client_secret, st_uuid, fresh)
+    return {**data, "snapshot_age_sec": age}
+
+
+@router.get("/pq_uuid_list/{st_uuid}")
+def lookup_physical_quantity_list_cacheable(
+    request: Request, client_id: str, client_secret: str, st_uuid: str
 ):
+    """Cacheable variant: the snapshot age goes to the `Age` header; fresh until the snapshot expires"""
+    data, age = physical_quantity_list(client_id, client_secret, st_uuid)
+    return conditional_json(request, data, CACHE_LATEST_TTL_SEC, last_modified=time.time() - age, age=age)
+
+
+@router.get("/changes")
+def latest_changes(
+    client_id: str,
+    client_secret: str,
+    since: Optional[str] = Query(None, description="cursor of the previous call, or a time (e.g. 2024-07-01T12:00:00+08:00)"),
+    st_uuid: Optional[List[str]] = Query(None, description="only these stations (default: every polled station)"),
+):
+    """
+    Latest values that changed since the previous poll, from the background snapshot (no IoW call).
+    With a cursor: PQs whose Value / TimeStamp changed plus removed PQs; without one (or a cursor of
+    a restarted / other worker, `full` = true): every PQ. With a time: PQs with a newer TimeStamp.
+    Pass the returned `cursor` as `since` next time.
+    """
+    # Same IoW credentials as every other route (the token is cached, so no IoW call per poll)
+    get_IoW_headers(client_id, client_secret)
+
+    if since is None or parse_cursor(since) is not None:
+        changed, removed, cursor, full = LATEST_SNAPSHOT.changes_since(since, st_uuid)
+        return {"cursor": cursor, "full": full, "changed": changed, "removed": removed}
+
+    try:
+        since_time = pd.Timestamp(since)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="since: expected a cursor or an ISO 8601 time") from e
+    if since_time.tzinfo is None:
+        since_time = since_time.tz_localize("Asia/Taipei")
+    changed, _, cursor, _ = LATEST_SNAPSHOT.changes_since(None, st_uuid)
+    timestamps = pd.to_datetime([row.get("TimeStamp") for row in changed], utc=True, format="ISO8601", errors="coerce")
+    changed = [row for row, newer in zip(changed, timestamps > since_time) if newer]
+    return {"cursor": cursor, "full": False, "changed": changed, "removed": []}
+
+
+def station_metadata(client_id, client_secret, st_uuid):
     # Get IoW token
-    PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    headers = get_IoW_headers(client_id, client_secret)
 
     # API
     s_response = get_Station_metadata(st_uuid, headers, client_id, client_secret)
@@ -195,50 +359,50 @@ async def lookup_station_metadata(
     return {"st_metadata": s_response, "pq_list": pq_uuid_list, "pq_metadata": pq_metadata}
 
 
+@router.post("/st_metadata/{st_uuid}")
+def lookup_station_metadata(
+    client_id: str, client_secret: str, st_uuid: str
+):
+    return station_metadata(client_id, client_secret, st_uuid)
+
+
+@router.get("/st_metadata/{st_uuid}")
+def lookup_station_metadata_cacheable(
+    request: Request, client_id: str, client_secret: str, st_uuid: str
+):
+    """Cacheable variant (ETag / 304, see routers/http_cache.py)"""
+    return conditional_json(request, station_metadata(client_id, client_secret, st_uuid), HTTP_METADATA_MAX_AGE_SEC)
+
+
 @router.post("/st_pq_relation/", response_class=FileResponse)
-async def download_station_and_physical_quantity_relation(client_id: str, client_secret: str, st_file: UploadFile = File(...)):
+def download_station_and_physical_quantity_relation(
+    client_id: str, client_secret: str, st_file: UploadFile = File(...), scratch: str = Depends(scratch_dir)
+):
     # Get IoW token
-    PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    headers = get_IoW_headers(client_id, client_secret)
 
-    # Write txt file to temp folder
-    try:
-        temp_folder_path = base_dir + "/temp/"
-        if not os.path.exists(temp_folder_path):
-            os.makedirs(temp_folder_path)
-        with open(temp_folder_path + st_file.filename, 'wb') as f:
-            f.write(st_file.file.read())
-    except Exception as e:
-        return {"message": f"There was an error uploading the file. {str(e)}"}
-
-    # Read txt file (One line, one station)
-    with open(temp_folder_path + st_file.filename, 'r', encoding='utf-8') as f:
-        content = f.readlines()
+    # One line, one station (duplicates are looked up once)
+    plan = parse_upload(st_file, with_pq=False)
 
     data = {}
-    for st_uuid in content:
-        st_uuid = st_uuid.replace("\n", "")
+    for st_uuid in plan.stations:
         pq_list = get_PhysicalQuantity_UUIDs(st_uuid, headers, client_id, client_secret)
         data[st_uuid] = pq_list
 
     # Write json file
     f_name = '監測站_物理量_UUID對應.json'
-    f_path = write_file(data, f_name)
-    return FileResponse(f_path, media_type='application/octet-stream', filename=f_name)
+    f_path = write_file(data, f_name, scratch)
+    return FileResponse(f_path, media_type='application/octet-stream', filename=f_name, headers=plan.headers())
 
 
 @router.post("/get_latest_table")
-async def 監測站與物理量UUID對應表(
+def 監測站與物理量UUID對應表(
     client_id: str, client_secret: str,
-    device_type: str = Query('RFD', enum=['RFD', 'MPD', 'MPDCY'])
+    device_type: str = Query('RFD', enum=['RFD', 'MPD', 'MPDCY']),
+    scratch: str = Depends(scratch_dir)
 ):
     # Get IoW token
-    PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    headers = get_IoW_headers(client_id, client_secret)
 
     st_uuids_path = base_dir + "/STATION_UUIDs/" + f'{device_type}_station_ID.txt'
     with open(st_uuids_path, "r", encoding='utf-8') as f:
@@ -296,54 +460,24 @@ async def 監測站與物理量UUID對應表(
         merge_df = merge_df[new_columns]
 
     f_name = f'{device_type}_最新監測站與物理量UUID對應表.csv'
-    f_path = write_file(merge_df, f_name)
+    f_path = write_file(merge_df, f_name, scratch)
     return FileResponse(f_path, media_type='application/octet-stream', filename=f_name)
 
 
 @router.post("/get_flood_detention_pool")
-async def 滯洪池即時水位(
-    client_id: str, client_secret: str
+def 滯洪池即時水位(
+    client_id: str, client_secret: str, fresh: bool = False, scratch: str = Depends(scratch_dir)
 ):
-    # Get IoW token
-    PAYLOAD = {"grant_type": "client_credentials", "client_id": client_id, "client_secret": client_secret}
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    # Credentials are checked on every request (cached token); the snapshot only supplies the data
+    headers = get_IoW_headers(client_id, client_secret)
 
-    st_uuids_path = base_dir + "/STATION_UUIDs/滯洪池_stUUID_pqUUID_滯洪池底.txt"
-    with open(st_uuids_path, "r", encoding='utf-8') as f:
-        st_uuids_list = f.readlines()
-
-    FLOOD_DETENTION_POOL = defaultdict(dict)
     merge_list = []
-
-    for row in st_uuids_list:
-        row = row.strip()
-        st_name, town, st_uuid, pq_uuid, pool_depth, levee_height, flood_detention_volume = row.split("\t")
-        pool_depth, levee_height, flood_detention_volume = map(float, [pool_depth, levee_height, flood_detention_volume])
-
-        FLOOD_DETENTION_POOL[st_uuid].update({
-            "滯洪池名稱": st_name,
-            "鄉鎮": town,
-            "pq_uuid": pq_uuid,
-            "滯洪池底(m)": pool_depth,
-            "堤頂高": levee_height,
-            "滯洪量(m3)": flood_detention_volume
-        })
-
-        # API
-        pq_uuid_dict = get_PhysicalQuantity_latest_data(st_uuid, headers, client_id, client_secret)
-        if pq_uuid in pq_uuid_dict:
-            water_level = pq_uuid_dict[pq_uuid]["Value"]
-            FLOOD_DETENTION_POOL[st_uuid]["即時水位(m)"] = water_level
-            FLOOD_DETENTION_POOL[st_uuid]["TimeStamp"] = pq_uuid_dict[pq_uuid]["TimeStamp"]
-
-            # 公式： ((堤頂高 - 即時水位)/(堤頂高 - 滯洪池底))*滯洪量*0.7
-            estimated_remaining_flood_detention_volume = (
-                (levee_height - water_level) / (levee_height - pool_depth) * flood_detention_volume * 0.7
-            )
-            FLOOD_DETENTION_POOL[st_uuid]["預估剩餘滯洪量(m3)"] = round(estimated_remaining_flood_detention_volume, 1)
-        merge_list.append(FLOOD_DETENTION_POOL[st_uuid])
+    max_age = 0.0
+    for pool in read_flood_detention_pools():
+        # Background snapshot (IoW only when `fresh` or not polled yet)
+        pq_uuid_dict, age = get_latest_data_cached(pool["st_uuid"], headers, client_id, client_secret, fresh)
+        max_age = max(max_age, age)
+        merge_list.append(calculate_flood_detention_pool(pool, pq_uuid_dict))
 
     merge_df = pd.DataFrame(merge_list)
     merge_df = merge_df[
@@ -351,5 +485,7 @@ async def 滯洪池即時水位(
     ]
 
     f_name = '滯洪池_即時水位報表.csv'
-    f_path = write_file(merge_df, f_name)
-    return FileResponse(f_path, media_type='application/octet-stream', filename=f_name)
+    f_path = write_file(merge_df, f_name, scratch)
+    return FileResponse(
+        f_path, media_type='application/octet-stream', filename=f_name, headers={"X-Snapshot-Age-Sec": str(max_age)}
+    )
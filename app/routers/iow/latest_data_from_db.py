@@ -6,10 +6,13 @@ from decouple import Config, RepositoryEnv
 from pymongo import MongoClient
 from bson import json_util
 
-from fastapi import APIRouter, File, UploadFile
+from fastapi import APIRouter, Depends, File, Request, UploadFile
 from fastapi.responses import FileResponse
 
+from app.ingest.uploads import parse_upload
+from app.routers.http_cache import HTTP_METADATA_MAX_AGE_SEC, conditional_json
 from app.routers.iow.latest_data import write_file
+from app.store.scratch import scratch_dir
 
 
 router = APIRouter()
@@ -34,6 +37,12 @@ def get_Station_metadata_from_DB(st_uuid):
     return s_response
 
 
+def get_Stations_metadata_from_DB(st_uuids):
+    s_response = list(db.stations.find({"st_uuid": {"$in": st_uuids}}, {"_id": 0}))
+    s_response = json.loads(json_util.dumps(s_response, indent=4))
+    return s_response
+
+
 def get_PhysicalQuantity_metadata_from_DB(pq_uuid):
     pq_metadata_response = list(db.stations.find(
         {"pq": {"$elemMatch": {"pq_id": pq_uuid}}}, {"_id": 0}
@@ -47,34 +56,34 @@ async def lookup_station_metadata(st_uuid: str):
     return get_Station_metadata_from_DB(st_uuid)
 
 
+@router.get("/st_metadata/{st_uuid}")
+def lookup_station_metadata_cacheable(request: Request, st_uuid: str):
+    """Cacheable variant (ETag / 304, see routers/http_cache.py)"""
+    return conditional_json(request, get_Station_metadata_from_DB(st_uuid), HTTP_METADATA_MAX_AGE_SEC)
+
+
 @router.post("/pq_metadata/{pq_uuid}")
 async def lookup_physical_quantity_metadata(pq_uuid: str):
     return get_PhysicalQuantity_metadata_from_DB(pq_uuid)
 
 
+@router.get("/pq_metadata/{pq_uuid}")
+def lookup_physical_quantity_metadata_cacheable(request: Request, pq_uuid: str):
+    """Cacheable variant (ETag / 304, see routers/http_cache.py)"""
+    return conditional_json(request, get_PhysicalQuantity_metadata_from_DB(pq_uuid), HTTP_METADATA_MAX_AGE_SEC)
+
+
 @router.post("/st_pq_relation/", response_class=FileResponse)
-async def download_station_and_physical_quantity_relation(st_file: UploadFile = File(...)):
-    # Write txt file to temp folder
-    try:
-        temp_folder_path = base_dir + "/temp/"
-        if not os.path.exists(temp_folder_path):
-            os.makedirs(temp_folder_path)
-        with open(temp_folder_path + st_file.filename, 'wb') as f:
-            f.write(st_file.file.read())
-    except Exception as e:
-        return {"message": f"There was an error uploading the file. {str(e)}"}
-
-    # Read txt file (One line, one station)
-    with open(temp_folder_path + st_file.filename, 'r', encoding='utf-8') as f:
-        content = f.readlines()
-
-    data = {}
-    for st_uuid in content:
-        st_uuid = st_uuid.replace("\n", "")
-        pq_list = get_Station_metadata_from_DB(st_uuid)
-        data[st_uuid] = pq_list
+def download_station_and_physical_quantity_relation(st_file: UploadFile = File(...), scratch: str = Depends(scratch_dir)):
+    # One line, one station (duplicates are looked up once)
+    plan = parse_upload(st_file, with_pq=False)
+
+    # One query for every station of the upload
+    data = {st_uuid: [] for st_uuid in plan.stations}
+    for st in get_Stations_metadata_from_DB(list(plan.stations)):
+        data[st["st_uuid"]].append(st)
 
     # Write json file
     f_name = '監測站_物理量_UUID對應.json'
-    f_path = write_file(data, f_name)
-    return FileResponse(f_path, media_type='application/octet-stream', filename=f_name)
+    f_path = write_file(data, f_name, scratch)
+    return FileResponse(f_path, media_type='application/octet-stream', filename=f_name, headers=plan.headers())
@@ -0,0 +1,74 @@
+"""Live Feed API (SSE & WebSocket)"""
+
+from typing import List, Optional
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.auth.rbac import get_current_active_user, is_active_staff_token
+from app.store.events import LIVE_EVENTS
+
+
+router = APIRouter()
+KEEPALIVE_SEC = 15
+
+
+@router.get("/stream", dependencies=[Depends(get_current_active_user)])
+async def live_event_stream(
+    request: Request,
+    st_uuid: Optional[List[str]] = Query(None),
+    device_type: Optional[List[str]] = Query(None, description="POOL / RFD / MPD / MPDCY"),
+    town: Optional[List[str]] = Query(None),
+):
+    """Server-Sent Events: current state first, then every change"""
+    subscriber = LIVE_EVENTS.subscribe(
+        asyncio.get_running_loop(), st_uuids=st_uuid, device_types=device_type, towns=town
+    )
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=KEEPALIVE_SEC)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            LIVE_EVENTS.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+@router.websocket("/ws")
+async def live_event_websocket(
+    websocket: WebSocket,
+    st_uuid: Optional[List[str]] = Query(None),
+    device_type: Optional[List[str]] = Query(None),
+    town: Optional[List[str]] = Query(None),
+    token: Optional[str] = Query(None, description="Access token (browsers cannot set headers on a WebSocket)"),
+):
+    """Same events as /stream; the access token comes from `Authorization: Bearer` or `?token=`"""
+    scheme, _, bearer = websocket.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and bearer:
+        token = bearer
+    if not await run_in_threadpool(is_active_staff_token, token):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscriber = LIVE_EVENTS.subscribe(
+        asyncio.get_running_loop(), st_uuids=st_uuid, device_types=device_type, towns=town
+    )
+    try:
+        while True:
+            event = await subscriber.queue.get()
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        LIVE_EVENTS.unsubscribe(subscriber)
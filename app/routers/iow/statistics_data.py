@@ -1,25 +1,50 @@
 """Statistical Data API"""
 
+from concurrent.futures import ThreadPoolExecutor
 import os
 import pytz
-import requests
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta, time
+from typing import List, Optional
 from decouple import Config, RepositoryEnv
 
-from fastapi import APIRouter, File, UploadFile
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, Query
 from fastapi.responses import FileResponse
 
-from app.schemas import Item, Metadata
-from app.routers.iow.latest_data import get_Station_metadata, write_file, get_PhysicalQuantity_latest_data
+from app.schemas import Item, Metadata, parse_and_format_date
+from app.routers.iow.latest_data import (
+    get_IoW_headers,
+    get_Station_metadata,
+    write_file,
+    get_latest_data_cached,
+    read_flood_detention_pools,
+    read_rfd_flood_depth_pq,
+)
 from app.routers.iow.history_data import (
     get_PhysicalQuantity_history_data,
     get_PhysicalQuantity_history_data_within12hr,
-    compress
+    get_avail_rate_from_DB,
+    compress,
+    FILE_FORMATS,
+)
+from app.store.rollup import ROLLUP_POSITIVE_MAX_GAP_MIN, compute_rollups, get_rollups
+from app.upstream.client import aiot_request
+from app.upstream.ratelimit import map_in_context
+from app.monitoring.metrics import observe_report_rows
+from app.monitoring.profiling import ProfiledRoute
+from app.ingest.uploads import parse_upload
+from app.ingest.series import (
+    ALIGN_DIRECTIONS, TimeSeries, align_to_grid, as_series, grid_timestamps, merge_runs, positive_runs, run_bounds, time_grid
 )
+from app.store.cache import CACHE, CACHE_DEVICES_TTL_SEC, CACHE_REPORT_TTL_SEC, CACHE_TOKEN_TTL_SEC, key_digest
+from app.store.history_cache import latest_complete_day
+from app.store.scratch import scratch_dir
+from app.store.pump_window import PUMP_WINDOW, PUMP_WINDOW_MAX_AGE_SEC, list_pumps, window_flags
+from app.store.pump_index import PumpIndex, dispatchable_pumps
 
 
-router = APIRouter()
+router = APIRouter(route_class=ProfiledRoute)
 base_dir = os.getcwd()
 
 # Settings
@@ -30,41 +55,74 @@ PAYLOAD = {
     "client_secret": ENV.get("API_CLIENT_SECRET"),
 }
 
+# Aligned matrix: concurrent history fetches, columns per request
+MATRIX_WORKERS = ENV.get('MATRIX_WORKERS', default=8, cast=int)
+MATRIX_MAX_SERIES = ENV.get('MATRIX_MAX_SERIES', default=500, cast=int)
+MATRIX_PRESETS = ("flood_detention_pools", "rfd_flood_depth")
+
 # Get IoW token
-response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-token = response["access_token"]
-headers = {"Accept": "application/json", "Authorization": "Bearer %s" % token}
+headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
 
 
-def get_country_town_village():
-    # Get aiot token
-    AIOT_token_url = "https://api.floodsolution.aiot.ing/auth/v1/login"
-    body = {
-        "username": ENV.get('AIOT_username'),
-        "password": ENV.get('AIOT_password')
-    }
-    AIOT_token = requests.post(AIOT_token_url, json=body, timeout=5).json()["token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {AIOT_token}"}
+def get_AIOT_headers():
+    def fetch():
+        # Get aiot token
+        AIOT_token_url = "auth/v1/login"
+        body = {
+            "username": ENV.get('AIOT_username'),
+            "password": ENV.get('AIOT_password')
+        }
+        AIOT_token = aiot_request("post", AIOT_token_url, json=body, timeout=5).json()["token"]
+        return {"Accept": "application/json", "Authorization": f"Bearer {AIOT_token}"}
+
+    return dict(CACHE.get_or_set("token:aiot", fetch, CACHE_TOKEN_TTL_SEC))
+
+
+def get_AIOT_devices(device_type, headers):
+    """device_type: RFD / MPD / MPDCY (cached for CACHE_DEVICES_TTL_SEC, detailStatus changes often)"""
+    def fetch():
+        aiot_data = aiot_request("get", f"api/v1/devices/{device_type}", headers=headers, timeout=5).json()
+        return aiot_data["data"]
 
-    RFD_url = "https://api.floodsolution.aiot.ing/api/v1/devices/RFD"
-    RFD_aiot_data = requests.get(RFD_url, headers=headers, timeout=5).json()
-    RFD_aiot_data = RFD_aiot_data["data"]
+    return CACHE.get_or_set(f"aiot:devices:{device_type}", fetch, CACHE_DEVICES_TTL_SEC)
 
-    MPD_url = "https://api.floodsolution.aiot.ing/api/v1/devices/MPD"
-    MPD_aiot_data = requests.get(MPD_url, headers=headers, timeout=5).json()
-    MPD_aiot_data = MPD_aiot_data["data"]
 
-    MPDCY_url = "https://api.floodsolution.aiot.ing/api/v1/devices/MPDCY"
-    MPDCY_aiot_data = requests.get(MPDCY_url, headers=headers, timeout=5).json()
-    MPDCY_aiot_data = MPDCY_aiot_data["data"]
+def get_pump_index(headers):
+    """PumpIndex of the dispatchable MPD / MPDCY pumps, rebuilt when the device lists are refetched"""
+    def build():
+        pumps = dispatchable_pumps(get_AIOT_devices("MPD", headers), get_AIOT_devices("MPDCY", headers))
+        return PumpIndex(pumps.values())
+
+    return CACHE.get_or_set("aiot:pump_index", build, CACHE_DEVICES_TTL_SEC)
+
+
+def cached_report_result(report, item, params, compute):
+    """
+    Per-station result of `report` for `item` (Metadata / Item) and `params`, shared by the workers for
+    CACHE_REPORT_TTL_SEC. Ranges reaching past the latest complete day (e.g. an ongoing flood day) still
+    change, so they are always computed.
+    """
+    if item.datetime_end[:10] > latest_complete_day().strftime("%Y-%m-%d"):
+        return compute()
+    key = f"report:{report}:{key_digest(repr((sorted(item.model_dump().items()), params)))}"
+    return CACHE.get_or_set(key, compute, CACHE_REPORT_TTL_SEC)
+
+
+def matrix_preset_pairs(preset, towns=None):
+    """[(st_uuid, pq_uuid)] of 滯洪池 水位 (flood_detention_pools) or RFD 淹水深度 (rfd_flood_depth), optionally of some 鄉鎮"""
+    if preset == "flood_detention_pools":
+        return [(pool["st_uuid"], pool["pq_uuid"]) for pool in read_flood_detention_pools() if not towns or pool["鄉鎮"] in towns]
+    rfd_towns = {st["_id"]: st["town"] for st in get_AIOT_devices("RFD", get_AIOT_headers())} if towns else {}
+    return [(st_uuid, pq_uuid) for st_uuid, pq_uuid in read_rfd_flood_depth_pq().items() if not towns or rfd_towns.get(st_uuid) in towns]
+
+
+def get_country_town_village():
+    headers = get_AIOT_headers()
 
     st_location_dict = dict()
-    for st in RFD_aiot_data:
-        st_location_dict[st["_id"]] = st["county"] + st["town"] + st["village"]
-    for st in MPD_aiot_data:
-        st_location_dict[st["_id"]] = st["county"] + st["town"] + st["village"]
-    for st in MPDCY_aiot_data:
-        st_location_dict[st["_id"]] = st["county"] + st["town"] + st["village"]
+    for device_type in ["RFD", "MPD", "MPDCY"]:
+        for st in get_AIOT_devices(device_type, headers):
+            st_location_dict[st["_id"]] = st["county"] + st["town"] + st["village"]
     return st_location_dict
 
 
@@ -97,8 +155,8 @@ def get_date_list(start_time, end_time):
     return date_list
 
 
-def transform_avail_pump(pump, df, data_time):
-    if "Value" not in df:
+def avail_pump_row(pump, has_data, pumped, data_time):
+    if not has_data:
         if data_time < pump.datetime_start:
             return {
                 "st_uuid": pump.st_uuid,
@@ -122,7 +180,7 @@ def transform_avail_pump(pump, df, data_time):
                 "是否可被調度": "Y"
             }
 
-    if (df["Value"] > 0).any():
+    if pumped:
         return {
             "st_uuid": pump.st_uuid,
             "pq_uuid": pump.pq_uuid,
@@ -146,10 +204,16 @@ def transform_avail_pump(pump, df, data_time):
         }
 
 
+def transform_avail_pump(pump, df, data_time):
+    series = as_series(df, pump.st_name)
+    return avail_pump_row(pump, len(series) > 0, bool((series.values > 0).any()), data_time)
+
+
 def calculate_pump_runtime(
     pump, df, pump_interval_N_min
 ):
-    if "Value" not in df:
+    series = as_series(df, pump.st_name)
+    if len(series) == 0:
         return pd.DataFrame([
             {
                 "st_uuid": pump.st_uuid,
@@ -164,32 +228,19 @@ def calculate_pump_runtime(
             }
         ])
 
-    # Initialize variables to track groups
-    df["TimeStamp"] = pd.to_datetime(df["TimeStamp"], format="ISO8601")
-    filtered_data = df[df["Value"] > 0].reset_index(drop=True)
+    # Group consecutive positive points within N mins interval
+    return pump_runtime_rows(pump, run_bounds(series, pump_interval_N_min), series.utc_offset)
 
-    groups = []
-    current_group = []
-    prev_timestamp = None
-
-    # Group consecutive timestamps within N mins interval
-    for i, row in filtered_data.iterrows():
-        if (prev_timestamp is None) or (row["TimeStamp"] - prev_timestamp <= timedelta(minutes=pump_interval_N_min)):
-            current_group.append(row)
-        else:
-            if current_group:
-                groups.append(current_group)
-            current_group = [row]
-        prev_timestamp = row["TimeStamp"]
 
-    if current_group:
-        groups.append(current_group)
+def pump_runtime_rows(pump, runs, utc_offset):
+    """Rows of `calculate_pump_runtime` of pumping runs ([first, last] epoch ns)"""
+    bounds = TimeSeries(runs.ravel(), np.zeros(runs.size), utc_offset=utc_offset)
 
     # Sum values in each group
     group_sums = []
-    for group in groups:
-        start_time = group[0]["TimeStamp"]
-        end_time = group[-1]["TimeStamp"]
+    for run in range(len(runs)):
+        start_time = bounds.timestamp_at(2 * run)
+        end_time = bounds.timestamp_at(2 * run + 1)
 
         # Handle cases where group spans multiple days
         if start_time.date() != end_time.date():
@@ -252,35 +303,63 @@ def calculate_pump_runtime(
     return pd.DataFrame(group_sums)
 
 
-def calculate_avail_rate(item, df, N_records_per_day):
+def summarize_avail_rate(item, df_cal, N_records_per_day):
+    """df_cal: one row per day with columns ["Date", "counts"]"""
     start_date = datetime.strptime(item.datetime_end, "%Y-%m-%d")
     end_date = datetime.strptime(item.datetime_start, "%Y-%m-%d")
     duration_in_days = (start_date - end_date).days + 1
-    if "TimeStamp" in df.columns:
-        df["Date"] = pd.to_datetime(df.TimeStamp, format="mixed").dt.strftime("%Y-%m-%d")
-        df["DateTime"] = pd.to_datetime(df.TimeStamp, format="mixed").dt.strftime("%Y-%m-%d %H:%M")
-        df_cal = df.groupby(["Date"]).size().reset_index(name="counts")
-        print(df_cal)
 
-        # 日妥善率 (%)     = [N (筆/天)]   除以   [24 (預期一天應該要有24筆，RULE_DayFrequency)]  乘以 [100 %]
-        daily_avg_field_name = f'日妥善率 (%) = counts / {N_records_per_day}'
-        df_cal[daily_avg_field_name] = df_cal["counts"] / N_records_per_day * 100
-        df_cal[daily_avg_field_name] = df_cal[daily_avg_field_name].apply(
+    # 日妥善率 (%)     = [N (筆/天)]   除以   [24 (預期一天應該要有24筆，RULE_DayFrequency)]  乘以 [100 %]
+    daily_avg_field_name = f'日妥善率 (%) = counts / {N_records_per_day}'
+    df_cal[daily_avg_field_name] = df_cal["counts"] / N_records_per_day * 100
+    df_cal[daily_avg_field_name] = df_cal[daily_avg_field_name].apply(
+        lambda x: 100 if x >= 100 else x
+    )
+
+    if duration_in_days >= 28:
+        # 月平均妥善率 (%) = [每天筆數相加] 除以   [30*24 (預期30天應該要有30*24筆)]           乘以 [100 %]
+        monthly_avg_field_name = f'月平均妥善率 (%) = sum(日妥善率) / ({duration_in_days}天 * 100)'
+        df_cal[monthly_avg_field_name] = sum(df_cal[daily_avg_field_name]) / (duration_in_days * 100) * 100
+        df_cal[monthly_avg_field_name] = df_cal[monthly_avg_field_name].apply(
             lambda x: 100 if x >= 100 else x
         )
+    return df_cal
 
-        if duration_in_days >= 28:
-            # 月平均妥善率 (%) = [每天筆數相加] 除以   [30*24 (預期30天應該要有30*24筆)]           乘以 [100 %]
-            monthly_avg_field_name = f'月平均妥善率 (%) = sum(日妥善率) / ({duration_in_days}天 * 100)'
-            df_cal[monthly_avg_field_name] = sum(df_cal[daily_avg_field_name]) / (duration_in_days * 100) * 100
-            df_cal[monthly_avg_field_name] = df_cal[monthly_avg_field_name].apply(
-                lambda x: 100 if x >= 100 else x
-            )
-        return df_cal
+
+def calculate_avail_rate(item, df, N_records_per_day):
+    series = as_series(df)
+    if len(series) > 0:
+        days, counts = np.unique(series.local_days(), return_counts=True)
+        df_cal = pd.DataFrame({"Date": np.datetime_as_string(days).astype(object), "counts": counts.astype(np.int64)})
+        print(df_cal)
+        return summarize_avail_rate(item, df_cal, N_records_per_day)
+
+
+def get_precomputed_avail_rate(item):
+    """
+    Daily counts of `item.pq_uuid` from the `avail_rate` table (see app/jobs/avail_rate.py).
+    Returns (st_name, df_cal) only when every day of the range has been materialized, else None.
+    """
+    docs = [
+        doc for doc in get_avail_rate_from_DB(item.pq_uuid, item.datetime_start, item.datetime_end)
+        if "日期" in doc and "counts" in doc
+    ]
+    duration_in_days = (
+        datetime.strptime(item.datetime_end, "%Y-%m-%d") - datetime.strptime(item.datetime_start, "%Y-%m-%d")
+    ).days + 1
+    if len({doc["日期"] for doc in docs}) < duration_in_days:
+        return None
+
+    df_cal = pd.DataFrame(
+        [{"Date": doc["日期"], "counts": doc["counts"]} for doc in docs if doc["counts"] > 0],
+        columns=["Date", "counts"]
+    )
+    return docs[0]["st_name"], df_cal
 
 
 def calculate_max_flood_height(pump, df, flood_height_interval_N_min):
-    if "Value" not in df:
+    series = as_series(df, pump.st_name)
+    if len(series) == 0:
         group_sums = []
         group_sums.append(
             {
@@ -298,46 +377,27 @@ def calculate_max_flood_height(pump, df, flood_height_interval_N_min):
         result_df = pd.DataFrame(group_sums)
         return result_df
 
-    # Initialize variables to track groups
-    groups = []
-    current_group = []
-    prev_timestamp = None
-    df["TimeStamp"] = pd.to_datetime(df["TimeStamp"], format="ISO8601")
-    filtered_data = df[df["Value"] > 0].reset_index(drop=True)
-
-    # Group consecutive timestamps within 3 mins interval
-    for i, row in filtered_data.iterrows():
-        if (prev_timestamp is None) or (row["TimeStamp"] - prev_timestamp <= timedelta(minutes=flood_height_interval_N_min)):
-            current_group.append(row)
-        else:
-            if current_group:
-                groups.append(current_group)
-            current_group = [row]
-        prev_timestamp = row["TimeStamp"]
-
-    if current_group:
-        groups.append(current_group)
+    # Group consecutive positive points within N mins interval
+    positive, starts, ends = positive_runs(series, flood_height_interval_N_min)
+    max_values = np.maximum.reduceat(series.values[positive], starts) if len(positive) else []
 
-    # Sum values in each group
     group_sums = []
-    for group in groups:
-        max_values = max(item["Value"] for item in group)
-        if max_values > 0:
-            group_sums.append(
-                {
-                    "st_uuid": pump.st_uuid,
-                    "pq_uuid": pump.pq_uuid,
-                    "水位站編號": pump.st_name,
-                    "所在地點": pump.location,
-                    "所屬單位": pump.institution,
-                    "淹水區間 (Start_TimeStamp)": group[0]["TimeStamp"],
-                    "淹水區間 (End_TimeStamp)": group[-1]["TimeStamp"],
-                    "最大淹水高度(公分)": max_values,
-                    "淹水持續時間(分鐘)": (
-                        group[-1]["TimeStamp"] - group[0]["TimeStamp"]
-                    ),
-                }
-            )
+    for first, last, max_value in zip(positive[starts], positive[ends], max_values):
+        start_time = series.timestamp_at(first)
+        end_time = series.timestamp_at(last)
+        group_sums.append(
+            {
+                "st_uuid": pump.st_uuid,
+                "pq_uuid": pump.pq_uuid,
+                "水位站編號": pump.st_name,
+                "所在地點": pump.location,
+                "所屬單位": pump.institution,
+                "淹水區間 (Start_TimeStamp)": start_time,
+                "淹水區間 (End_TimeStamp)": end_time,
+                "最大淹水高度(公分)": max_value,
+                "淹水持續時間(分鐘)": end_time - start_time,
+            }
+        )
 
     if group_sums == []:
         group_sums.append(
@@ -357,6 +417,78 @@ def calculate_max_flood_height(pump, df, flood_height_interval_N_min):
     return result_df
 
 
+def summarize_max_flood_height(rfd, df_rollup, granularity):
+    """最大淹水高度 per hourly / daily bucket (from rollups)"""
+    base = {
+        "st_uuid": rfd.st_uuid,
+        "pq_uuid": rfd.pq_uuid,
+        "水位站編號": rfd.st_name,
+        "所在地點": rfd.location,
+        "所屬單位": rfd.institution,
+    }
+    if df_rollup.shape[0] == 0:
+        return pd.DataFrame([{
+            **base,
+            "統計時段": "",
+            "最大淹水高度(公分)": "",
+            "淹水持續時間(分鐘)": "此時間區間無歷史資料",
+        }])
+
+    flooded = df_rollup[df_rollup["max"] > 0]
+    if flooded.shape[0] == 0:
+        return pd.DataFrame([{
+            **base,
+            "統計時段": "",
+            "最大淹水高度(公分)": "",
+            "淹水持續時間(分鐘)": "此時間區間無淹水",
+        }])
+
+    bucket_format = "%Y-%m-%d %H:00" if granularity == "hourly" else "%Y-%m-%d"
+    return pd.DataFrame([
+        {
+            **base,
+            "統計時段": row["bucket"].strftime(bucket_format),
+            "最大淹水高度(公分)": row["max"],
+            "淹水持續時間(分鐘)": round(row["positive_seconds"] / 60, 1),
+        }
+        for row in flooded.to_dict("records")
+    ])
+
+
+def summarize_pump_daily(pump, df_rollup, pump_interval_N_min):
+    """
+    `calculate_pump_runtime` from daily rollups: the runs stored per day (found with
+    ROLLUP_POSITIVE_MAX_GAP_MIN) joined again with the request's gap give the same runs
+    """
+    runs = [run for day_runs in df_rollup["runs"] for run in day_runs]
+    utc_offset = next((offset for offset in df_rollup["utc_offset"] if pd.notna(offset)), None)
+    return pump_runtime_rows(
+        pump, merge_runs(runs, pump_interval_N_min), None if utc_offset is None else int(utc_offset)
+    )
+
+
+def get_rollups_or_fetch(headers, item, st_name, granularity):
+    """Buckets from the rollup store; falls back to raw data (which also refreshes the store)"""
+    df_rollup = get_rollups(item.pq_uuid, granularity, item.datetime_start, item.datetime_end)
+    if df_rollup is None:
+        series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
+        df_rollup = compute_rollups(series, granularity)
+    return df_rollup
+
+
+def get_rollup_daily_counts(item):
+    """Daily counts (["Date", "counts"]) from the rollup store, None when the range is not covered"""
+    df_rollup = get_rollups(item.pq_uuid, "daily", item.datetime_start, item.datetime_end)
+    if df_rollup is None:
+        return None
+    if df_rollup.shape[0] == 0:
+        return pd.DataFrame(columns=["Date", "counts"])
+    return pd.DataFrame({
+        "Date": pd.to_datetime(df_rollup["bucket"]).dt.strftime("%Y-%m-%d"),
+        "counts": df_rollup["count"],
+    })
+
+
 def calculate_opsUnits_pumpingVol(concat_df):
     # Group by Date
     concat_df["日期"] = pd.to_datetime(
@@ -374,58 +506,46 @@ def calculate_opsUnits_pumpingVol(concat_df):
 
 
 @router.post("/report/pump_runtime", response_class=FileResponse)
-async def 抽水區間報表(
+def 抽水區間報表(
     datetime_start: str,
     datetime_end: str,
     pump_interval_N_min: int = 10,
-    st_pq_file: UploadFile = File(...)
+    st_pq_file: UploadFile = File(...),
+    scratch: str = Depends(scratch_dir)
 ):
     # Get IoW token
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
 
-    # Write txt file to temp folder
-    try:
-        temp_folder_path = base_dir + "/temp/"
-        if not os.path.exists(temp_folder_path):
-            os.makedirs(temp_folder_path)
-        with open(temp_folder_path + st_pq_file.filename, "wb") as f:
-            f.write(st_pq_file.file.read())
-    except Exception as e:
-        return {"message": f"There was an error uploading the file. {str(e)}"}
-
-    # Read txt file (One line, one station)
-    with open(temp_folder_path + st_pq_file.filename, "r", encoding="utf-8") as f:
-        content = f.readlines()
+    # One station, one or more PQs
+    plan = parse_upload(st_pq_file)
 
     file_names = []
     st_location_dict = get_country_town_village()
-    for line in content:
-        line = line.replace("\n", "").replace("\t", ",")
-        line = line.split(",")
-        st_uuid = line[0]
-        pq_uuid = line[1]
-
+    for st_uuid, pq_uuids in plan.stations.items():
         # API
         s_response = get_Station_metadata(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
         st_name = s_response["Name"]
 
-        pump_item = Metadata(
-            st_uuid=st_uuid,
-            st_name=st_name,
-            pq_uuid=pq_uuid,
-            location=st_location_dict[st_uuid],
-            institution=s_response["JsonProperties"]["MetaData"]["Institution"],
-            datetime_start=datetime_start,
-            datetime_end=datetime_end,
-        )
-        df = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], pump_item, st_name)
-        result_df = calculate_pump_runtime(pump_item, df, pump_interval_N_min)
-        f_name = f'{st_name}_{pq_uuid}.csv'
-        f_path = write_file(result_df, f_name)
-        if result_df.shape[0] > 0:
-            file_names.append(f_path)
+        for pq_uuid in pq_uuids:
+            pump_item = Metadata(
+                st_uuid=st_uuid,
+                st_name=st_name,
+                pq_uuid=pq_uuid,
+                location=st_location_dict[st_uuid],
+                institution=s_response["JsonProperties"]["MetaData"]["Institution"],
+                datetime_start=datetime_start,
+                datetime_end=datetime_end,
+            )
+
+            def compute():
+                series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], pump_item, st_name)
+                return calculate_pump_runtime(pump_item, series, pump_interval_N_min)
+
+            result_df = cached_report_result("pump_runtime", pump_item, pump_interval_N_min, compute)
+            f_name = f'{st_name}_{pq_uuid}.csv'
+            f_path = write_file(result_df, f_name, scratch)
+            if result_df.shape[0] > 0:
+                file_names.append(f_path)
 
     pd_list = []
     for f_st_pump_runtime in file_names:
@@ -433,54 +553,68 @@ async def 抽水區間報表(
         pd_list.append(df_st_pump_runtime)
     concat_df = pd.concat(pd_list)
     f_name = "合併_抽水區間報表.csv"
-    f_path = write_file(concat_df, f_name)
-    return FileResponse(f_path, media_type="application/octet-stream", filename=f_name)
+    observe_report_rows("pump_runtime", concat_df)
+    f_path = write_file(concat_df, f_name, scratch)
+    return FileResponse(f_path, media_type="application/octet-stream", filename=f_name, headers=plan.headers())
 
 
 @router.post("/report/avail_rate", response_class=FileResponse)
-async def 日和月平均妥善率報表(
+def 日和月平均妥善率報表(
     datetime_start: str,
     datetime_end: str,
     N_records_per_day: int = 24,
-    st_pq_file: UploadFile = File(...)
+    st_pq_file: UploadFile = File(...),
+    scratch: str = Depends(scratch_dir)
 ):
-    # Write txt file to temp folder
-    try:
-        temp_folder_path = base_dir + "/temp/"
-        if not os.path.exists(temp_folder_path):
-            os.makedirs(temp_folder_path)
-        with open(temp_folder_path + st_pq_file.filename, "wb") as f:
-            f.write(st_pq_file.file.read())
-    except Exception as e:
-        return {"message": f"There was an error uploading the file. {str(e)}"}
-
-    # Read txt file (One line, one station & one physical quantity)
-    with open(temp_folder_path + st_pq_file.filename, "r", encoding="utf-8") as f:
-        content = f.readlines()
+    # One station, one or more PQs
+    plan = parse_upload(st_pq_file)
+    temp_folder_path = scratch
+    if not os.path.exists(temp_folder_path):
+        os.makedirs(temp_folder_path)
 
     file_names = []
-    for line in content:
-        line = line.replace("\n", "").replace("\t", ",")
-        line = line.split(",")
-        st_uuid = line[0]
-        pq_uuid = line[1]
-
-        # API
-        s_response = get_Station_metadata(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
-        st_name = s_response["Name"]
-
+    st_names = {}  # st_uuid => Name, looked up once per station
+    for st_uuid, pq_uuid in plan.pairs():
         item = Item(
             datetime_start=datetime_start,
             datetime_end=datetime_end,
             st_uuid=st_uuid,
             pq_uuid=pq_uuid,
         )
-        df = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
+
+        # Precomputed daily counts (avail_rate table), else daily rollups
+        precomputed = get_precomputed_avail_rate(item)
+        if precomputed is not None:
+            st_name, df_cal = precomputed
+        else:
+            # API
+            if st_uuid not in st_names:
+                s_response = get_Station_metadata(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
+                st_names[st_uuid] = s_response["Name"]
+            st_name = st_names[st_uuid]
+            df_cal = get_rollup_daily_counts(item)
+
+        if df_cal is not None:
+            if df_cal.shape[0] > 0:
+                result_df = summarize_avail_rate(item, df_cal, N_records_per_day)
+                f_name = f'{st_name}_妥善率_summary.csv'
+                observe_report_rows("avail_rate", result_df)
+                f_path = write_file(result_df, f_name, scratch)
+                file_names.append(f_path)
+            else:
+                with open(temp_folder_path + "無歷史資料的監測站_AvailRate_report.txt", "a", encoding="utf-8") as f:
+                    f.write(f'{st_name}\t{st_uuid}\n')
+            continue
+
+        # Raw data
+        series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
         try:
-            df = df[["TimeStamp", "Value"]]
-            result_df = calculate_avail_rate(item, df, N_records_per_day)
+            if len(series) == 0:
+                raise ValueError("No history data")
+            result_df = calculate_avail_rate(item, series, N_records_per_day)
             f_name = f'{st_name}_妥善率_summary.csv'
-            f_path = write_file(result_df, f_name)
+            observe_report_rows("avail_rate", result_df)
+            f_path = write_file(result_df, f_name, scratch)
             if result_df.shape[0] > 0:
                 file_names.append(f_path)
         except Exception:
@@ -491,66 +625,58 @@ async def 日和月平均妥善率報表(
         file_names.append(temp_folder_path + "無歷史資料的監測站_AvailRate_report.txt")
 
     if len(file_names) > 0:
-        zip_filepath, f_name = compress(file_names)
-        return FileResponse(zip_filepath, media_type="application/octet-stream", filename=f_name)
+        zip_filepath, f_name = compress(file_names, scratch)
+        return FileResponse(zip_filepath, media_type="application/octet-stream", filename=f_name, headers=plan.headers())
     else:
         result = {"msg": "NO DATA TO DOWNLOAD"}
         return result
 
 
 @router.post("/report/max_flood_height", response_class=FileResponse)
-async def 最大淹水高度區間報表(
+def 最大淹水高度區間報表(
     datetime_start: str,
     datetime_end: str,
     flood_height_interval_N_min: int = 8,
-    st_pq_file: UploadFile = File(...)
+    granularity: str = Query('event', enum=['event', 'hourly', 'daily']),
+    st_pq_file: UploadFile = File(...),
+    scratch: str = Depends(scratch_dir)
 ):
     # Get IoW token
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
 
-    # Write txt file to temp folder
-    try:
-        temp_folder_path = base_dir + "/temp/"
-        if not os.path.exists(temp_folder_path):
-            os.makedirs(temp_folder_path)
-        with open(temp_folder_path + st_pq_file.filename, "wb") as f:
-            f.write(st_pq_file.file.read())
-    except Exception as e:
-        return {"message": f"There was an error uploading the file. {str(e)}"}
-
-    # Read txt file (One line, one station)
-    with open(temp_folder_path + st_pq_file.filename, "r", encoding="utf-8") as f:
-        content = f.readlines()
+    # One station, one or more PQs
+    plan = parse_upload(st_pq_file)
 
     file_names = []
     st_location_dict = get_country_town_village()
-    for line in content:
-        line = line.replace("\n", "").replace("\t", ",")
-        line = line.split(",")
-        st_uuid = line[0]
-        pq_uuid = line[1]
-
+    for st_uuid, pq_uuids in plan.stations.items():
         # API
         s_response = get_Station_metadata(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
         st_name = s_response["Name"]
 
-        rfd_item = Metadata(
-            st_uuid=st_uuid,
-            st_name=st_name,
-            pq_uuid=pq_uuid,
-            location=st_location_dict[st_uuid],
-            institution=s_response["JsonProperties"]["MetaData"]["Institution"],
-            datetime_start=datetime_start,
-            datetime_end=datetime_end,
-        )
-        df = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], rfd_item, st_name)
-        result_df = calculate_max_flood_height(rfd_item, df, flood_height_interval_N_min)
-        f_name = f'{st_name}_{pq_uuid}.csv'
-        f_path = write_file(result_df, f_name)
-        if result_df.shape[0] > 0:
-            file_names.append(f_path)
+        for pq_uuid in pq_uuids:
+            rfd_item = Metadata(
+                st_uuid=st_uuid,
+                st_name=st_name,
+                pq_uuid=pq_uuid,
+                location=st_location_dict[st_uuid],
+                institution=s_response["JsonProperties"]["MetaData"]["Institution"],
+                datetime_start=datetime_start,
+                datetime_end=datetime_end,
+            )
+            if granularity == 'event':
+                def compute():
+                    series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], rfd_item, st_name)
+                    return calculate_max_flood_height(rfd_item, series, flood_height_interval_N_min)
+
+                result_df = cached_report_result("max_flood_height", rfd_item, flood_height_interval_N_min, compute)
+            else:
+                df_rollup = get_rollups_or_fetch(headers, rfd_item, st_name, granularity)
+                result_df = summarize_max_flood_height(rfd_item, df_rollup, granularity)
+            f_name = f'{st_name}_{pq_uuid}.csv'
+            f_path = write_file(result_df, f_name, scratch)
+            if result_df.shape[0] > 0:
+                file_names.append(f_path)
 
     pd_list = []
     for f_st_max_flood_height in file_names:
@@ -558,65 +684,71 @@ async def 最大淹水高度區間報表(
         pd_list.append(df_st_max_flood_height)
     concat_df = pd.concat(pd_list)
     f_name = "合併_最大淹水高度區間報表.csv"
-    f_path = write_file(concat_df, f_name)
-    return FileResponse(f_path, media_type="application/octet-stream", filename=f_name)
+    observe_report_rows("max_flood_height", concat_df)
+    f_path = write_file(concat_df, f_name, scratch)
+    return FileResponse(f_path, media_type="application/octet-stream", filename=f_name, headers=plan.headers())
 
 
 @router.post("/report/operating_units_and_pumping_volumes", response_class=FileResponse)
-async def 運轉台數與抽水量的即時報表(
+def 運轉台數與抽水量的即時報表(
     datetime_start: str,
     datetime_end: str,
     pump_interval_N_min: int = 10,
-    st_pq_file: UploadFile = File(...)
+    use_rollup: bool = False,
+    st_pq_file: UploadFile = File(...),
+    scratch: str = Depends(scratch_dir)
 ):
+    if use_rollup and pump_interval_N_min < ROLLUP_POSITIVE_MAX_GAP_MIN:
+        # Stored runs are already joined across gaps up to ROLLUP_POSITIVE_MAX_GAP_MIN
+        raise HTTPException(
+            status_code=422,
+            detail=f"use_rollup requires pump_interval_N_min >= {ROLLUP_POSITIVE_MAX_GAP_MIN} (ROLLUP_POSITIVE_MAX_GAP_MIN)"
+        )
+
     # Get IoW token
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
 
-    # Write txt file to temp folder
-    try:
-        temp_folder_path = base_dir + "/temp/"
-        if not os.path.exists(temp_folder_path):
-            os.makedirs(temp_folder_path)
-        with open(temp_folder_path + st_pq_file.filename, "wb") as f:
-            f.write(st_pq_file.file.read())
-    except Exception as e:
-        return {"message": f"There was an error uploading the file. {str(e)}"}
-
-    # Read txt file (One line, one station)
-    with open(temp_folder_path + st_pq_file.filename, "r", encoding="utf-8") as f:
-        content = f.readlines()
+    # One station, one or more PQs
+    plan = parse_upload(st_pq_file)
+    temp_folder_path = scratch
+    if not os.path.exists(temp_folder_path):
+        os.makedirs(temp_folder_path)
 
     file_names = []
-    for line in content:
-        line = line.replace("\n", "").replace("\t", ",")
-        line = line.split(",")
-        st_uuid = line[0]
-        pq_uuid = line[1]
-
+    for st_uuid, pq_uuids in plan.stations.items():
         # API
         s_response = get_Station_metadata(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])
         st_name = s_response["Name"]
 
-        pump_item = Metadata(
-            st_uuid=st_uuid,
-            st_name=st_name,
-            pq_uuid=pq_uuid,
-            datetime_start=datetime_start,
-            datetime_end=datetime_end,
-        )
-        df = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], pump_item, st_name)
-        try:
-            df = df[["TimeStamp", "Value"]]
-            result_df = calculate_pump_runtime(pump_item, df, pump_interval_N_min)
-            f_name = f'{st_name}_{pq_uuid}.csv'
-            f_path = write_file(result_df, f_name)
-            if result_df.shape[0] > 0:
-                file_names.append(f_path)
-        except Exception:
-            with open(temp_folder_path + "無歷史資料的監測站_OperatingUnits_and_PumpingVolumes_report.txt", "a", encoding="utf-8") as f_out:
-                f_out.write(f'{st_name}\t{st_uuid}\n')
+        for pq_uuid in pq_uuids:
+            pump_item = Metadata(
+                st_uuid=st_uuid,
+                st_name=st_name,
+                pq_uuid=pq_uuid,
+                datetime_start=datetime_start,
+                datetime_end=datetime_end,
+            )
+            if use_rollup:
+                # Daily rollups: pumping runs per day, joined with pump_interval_N_min
+                df_rollup = get_rollups_or_fetch(headers, pump_item, st_name, "daily")
+            else:
+                series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], pump_item, st_name)
+            try:
+                if use_rollup:
+                    if df_rollup.shape[0] == 0:
+                        raise ValueError("No history data")
+                    result_df = summarize_pump_daily(pump_item, df_rollup, pump_interval_N_min)
+                else:
+                    if len(series) == 0:
+                        raise ValueError("No history data")
+                    result_df = calculate_pump_runtime(pump_item, series, pump_interval_N_min)
+                f_name = f'{st_name}_{pq_uuid}.csv'
+                f_path = write_file(result_df, f_name, scratch)
+                if result_df.shape[0] > 0:
+                    file_names.append(f_path)
+            except Exception:
+                with open(temp_folder_path + "無歷史資料的監測站_OperatingUnits_and_PumpingVolumes_report.txt", "a", encoding="utf-8") as f_out:
+                    f_out.write(f'{st_name}\t{st_uuid}\n')
 
     pd_list = []
     for f_st_pump_runtime in file_names:
@@ -625,122 +757,186 @@ async def 運轉台數與抽水量的即時報表(
     concat_df = pd.concat(pd_list)
     result_df = calculate_opsUnits_pumpingVol(concat_df)
     f_name = "MPD_MPDCY_移動式抽水機_運轉台數及抽水量報表.csv"
-    f_path = write_file(result_df, f_name)
+    observe_report_rows("operating_units_and_pumping_volumes", result_df)
+    f_path = write_file(result_df, f_name, scratch)
     file_names.append(f_path)
 
     if os.path.isfile(temp_folder_path + "無歷史資料的監測站_OperatingUnits_and_PumpingVolumes_report.txt"):
         file_names.append(temp_folder_path + "無歷史資料的監測站_OperatingUnits_and_PumpingVolumes_report.txt")
 
     if len(file_names) > 0:
-        zip_filepath, f_name = compress(file_names)
-        return FileResponse(zip_filepath, media_type="application/octet-stream", filename=f_name)
+        zip_filepath, f_name = compress(file_names, scratch)
+        return FileResponse(zip_filepath, media_type="application/octet-stream", filename=f_name, headers=plan.headers())
     else:
         result = {"msg": "NO DATA TO DOWNLOAD"}
         return result
 
 
-@router.post("/report/available_pumps", response_class=FileResponse)
-async def 可調度抽水機的即時報表():
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+@router.post("/report/aligned_matrix", response_class=FileResponse)
+def 多測站時間對齊矩陣(
+    datetime_start: str,
+    datetime_end: str,
+    every: str = Query('10min', description="Grid step, e.g. 1min / 10min / 1h (Asia/Taipei aligned)"),
+    tolerance: str = Query('5min', description="Max distance between a grid time and the point used for it"),
+    direction: str = Query('backward', enum=list(ALIGN_DIRECTIONS)),
+    preset: Optional[str] = Query(None, enum=list(MATRIX_PRESETS)),
+    town: Optional[List[str]] = Query(None, description="鄉鎮 filter of the preset"),
+    file_format: str = Query('csv', alias='format', enum=list(FILE_FORMATS)),
+    st_pq_file: Optional[UploadFile] = File(None),
+    scratch: str = Depends(scratch_dir),
+):
+    """
+    One wide table: TimeStamp on a common grid + one column per PQ (`{st_name}_{pq_uuid}`), each value
+    taken as-of the grid time within `tolerance`. PQs come from `st_pq_file` or a preset list.
+    """
+    datetime_start = parse_and_format_date(datetime_start)[:10]
+    datetime_end = parse_and_format_date(datetime_end)[:10]
+    try:
+        grid = time_grid(datetime_start, datetime.strptime(datetime_end, "%Y-%m-%d") + timedelta(days=1), every)
+        tolerance_ns = pd.Timedelta(tolerance).value
+        if direction not in ALIGN_DIRECTIONS:
+            raise ValueError(f"Direction must be one of {', '.join(ALIGN_DIRECTIONS)}: {direction}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+    response_headers = {}
+    if st_pq_file is not None:
+        plan = parse_upload(st_pq_file)
+        pairs = [(st_uuid, pq_uuid) for st_uuid, pq_uuids in plan.stations.items() for pq_uuid in pq_uuids]
+        response_headers = plan.headers()
+    elif preset in MATRIX_PRESETS:
+        pairs = matrix_preset_pairs(preset, town)
+    else:
+        raise HTTPException(status_code=400, detail="st_pq_file or preset is required")
+    if not pairs or len(pairs) > MATRIX_MAX_SERIES:
+        raise HTTPException(status_code=400, detail=f"1 .. {MATRIX_MAX_SERIES} PQs are supported, got {len(pairs)}")
 
-    # Get aiot token
-    AIOT_token_url = "https://api.floodsolution.aiot.ing/auth/v1/login"
-    body = {
-        "username": ENV.get('AIOT_username'),
-        "password": ENV.get('AIOT_password')
-    }
-    AIOT_token = requests.post(AIOT_token_url, json=body, timeout=5).json()["token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {AIOT_token}"}
+    # Get IoW token
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
+
+    def aligned_column(pair):
+        # Only the aligned column is kept, the fetched series is released here
+        st_uuid, pq_uuid = pair
+        st_name = get_Station_metadata(st_uuid, headers, PAYLOAD["client_id"], PAYLOAD["client_secret"])["Name"]
+        item = Item(datetime_start=datetime_start, datetime_end=datetime_end, st_uuid=st_uuid, pq_uuid=pq_uuid)
+        series = get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, st_name)
+        return f"{st_name}_{pq_uuid}", align_to_grid(series, grid, tolerance_ns, direction), series.utc_offset
+
+    with ThreadPoolExecutor(max_workers=MATRIX_WORKERS) as executor:
+        columns = map_in_context(executor, aligned_column, pairs)
+    utc_offset = next((offset for _, _, offset in columns if offset is not None), None)
+    matrix_df = pd.concat([
+        pd.DataFrame({"TimeStamp": grid_timestamps(grid, utc_offset, iso_timestamps=file_format == 'csv')}),
+        pd.DataFrame({name: values for name, values, _ in columns}),
+    ], axis=1)
+
+    f_name = f'對齊矩陣_{every}_{datetime_start}_{datetime_end}.{FILE_FORMATS[file_format]}'
+    observe_report_rows("aligned_matrix", matrix_df)
+    f_path = write_file(matrix_df, f_name, scratch)
+    return FileResponse(
+        f_path, media_type="application/octet-stream", filename=f_name,
+        headers={**response_headers, "X-Matrix-Columns": str(len(columns)), "X-Matrix-Rows": str(len(grid))}
+    )
 
-    MPD_url = "https://api.floodsolution.aiot.ing/api/v1/devices/MPD"
-    MPD_aiot_data = requests.get(MPD_url, headers=headers, timeout=5).json()
-    MPD_aiot_data = MPD_aiot_data["data"]
 
-    MPDCY_url = "https://api.floodsolution.aiot.ing/api/v1/devices/MPDCY"
-    MPDCY_aiot_data = requests.get(MPDCY_url, headers=headers, timeout=5).json()
-    MPDCY_aiot_data = MPDCY_aiot_data["data"]
+@router.post("/report/available_pumps", response_class=FileResponse)
+def 可調度抽水機的即時報表(scratch: str = Depends(scratch_dir)):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    st_dict = {}
-    for st in MPD_aiot_data:
-        # 1 (未出勤)、2 (出勤中)、3 (抽水中)、4 (運送中)、5 (異常)
-        if (st["detailStatus"] == 1) or (st["detailStatus"] == 2):
-            st_dict[st["_id"]] = {
-                "st_name": st["name"],
-                "st_uuid": st["_id"],
-                "lat": st["lat"],
-                "lon": st["lon"],
-                "location": st["county"] + st["town"] + st["village"],
-                "dev_type": st["type"],
-            }
-    for st in MPDCY_aiot_data:
-        if (st["detailStatus"] == 1) or (st["detailStatus"] == 2):
-            st_dict[st["_id"]] = {
-                "st_name": st["name"],
-                "st_uuid": st["_id"],
-                "lat": st["lat"],
-                "lon": st["lon"],
-                "location": st["county"] + st["town"] + st["village"],
-                "dev_type": st["type"],
-            }
+    headers = get_AIOT_headers()
+    MPD_aiot_data = get_AIOT_devices("MPD", headers)
+    MPDCY_aiot_data = get_AIOT_devices("MPDCY", headers)
+
+    st_dict = dispatchable_pumps(MPD_aiot_data, MPDCY_aiot_data)
 
     df = pd.DataFrame.from_dict(st_dict, orient="index")
     f_name = f'可調度的抽水機報表_{now}.csv'
-    f_path = write_file(df, f_name)
+    observe_report_rows("available_pumps", df)
+    f_path = write_file(df, f_name, scratch)
     return FileResponse(f_path, media_type="application/octet-stream", filename=f_name)
 
 
+@router.post("/nearest_available_pumps")
+def 最近的可調度抽水機(
+    lat: Optional[float] = None,
+    lon: Optional[float] = None,
+    rfd_st_uuid: Optional[str] = None,
+    k: int = Query(5, ge=1, le=100),
+    max_km: Optional[float] = Query(None, gt=0),
+):
+    """
+    k nearest dispatchable pumps (detailStatus 1 / 2) to (lat, lon) or to the RFD station `rfd_st_uuid`,
+    with great-circle distances; answered from the pump grid index (app/store/pump_index.py).
+    """
+    headers = get_AIOT_headers()
+    if rfd_st_uuid is not None:
+        rfd = next((st for st in get_AIOT_devices("RFD", headers) if st["_id"] == rfd_st_uuid), None)
+        if rfd is None:
+            raise HTTPException(status_code=404, detail=f"RFD station {rfd_st_uuid} not found")
+        origin = {"st_uuid": rfd["_id"], "st_name": rfd["name"], "lat": rfd["lat"], "lon": rfd["lon"]}
+    elif lat is not None and lon is not None:
+        origin = {"lat": lat, "lon": lon}
+    else:
+        raise HTTPException(status_code=400, detail="lat and lon, or rfd_st_uuid, are required")
+
+    pump_index = get_pump_index(headers)
+    nearest = pump_index.nearest(origin["lat"], origin["lon"], k, max_km)
+    return {
+        "origin": origin,
+        "indexed_pumps": len(pump_index),
+        "pumps": [{**pump, "distance_km": round(distance, 3)} for pump, distance in nearest],
+    }
+
+
 @router.post("/report/available_pumps_within12hr", response_class=FileResponse)
-async def 十二小時內無抽水紀錄_可調度抽水機的即時報表():
+def 十二小時內無抽水紀錄_可調度抽水機的即時報表(fresh: bool = False, scratch: str = Depends(scratch_dir)):
+    """
+    Reads the rolling per-pump state kept by the `pump_window` job (app/jobs/pump_window.py);
+    pumps without a recent state (and every pump with `fresh=true`) are fetched from IoW.
+    """
     now = datetime.now()
-    start_time = pytz.timezone('Asia/Taipei').localize(
-        datetime.combine(now - timedelta(days=1), time(now.hour, 0, 0))
-    ).strftime("%Y-%m-%dT%H.00.00")
-    end_time = datetime.now().strftime("%Y-%m-%dT%H.00.00")
-
-    # STATION_UUIDs (get from local)
-    st_uuids_path = base_dir + "/STATION_UUIDs/MPD_MPDCY_all_info.csv"  #
-    df = pd.read_csv(st_uuids_path, encoding='utf-8')
+    window_start = pytz.timezone('Asia/Taipei').localize(datetime.combine(now - timedelta(days=1), time(now.hour, 0, 0)))
+    window_end = pytz.timezone('Asia/Taipei').localize(datetime.combine(now, time(now.hour, 0, 0)))
+    start_time = window_start.strftime("%Y-%m-%dT%H.00.00")
+    end_time = window_end.strftime("%Y-%m-%dT%H.00.00")
+    stale_before = now.timestamp() - PUMP_WINDOW_MAX_AGE_SEC
 
     # Get IoW token
-    response = requests.post("https://iapi.wra.gov.tw/v3/oauth2/token", data=PAYLOAD, timeout=5).json()
-    token = response["access_token"]
-    headers = {"Accept": "application/json", "Authorization": f"Bearer {token}"}
+    headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
 
     st_dict = {}
-    for index, row in df.iterrows():
-        if (pd.isna(row['抽水量']) == True) and (pd.isna(row['出水量']) == True):
-            data = {"Station": row['st_name']}
-            df = pd.DataFrame(data, index=[0])
-            pq_uuid = row['經度']
-            pump_item = Metadata(
-                st_uuid=row['st_uuid'],
-                st_name=row['st_name'],
-                pq_uuid=pq_uuid,
-                datetime_start=start_time,
-                datetime_end=end_time,
-            )
+    max_age = 0.0
+    window_age = 0.0
+    for pump in list_pumps():
+        pump_item = Metadata(
+            st_uuid=pump["st_uuid"],
+            st_name=pump["st_name"],
+            pq_uuid=pump["pq_uuid"],
+            datetime_start=start_time,
+            datetime_end=end_time,
+        )
+        state = None if fresh or not pump["has_history"] else PUMP_WINDOW.get(pump["pq_uuid"])
+        if not pump["has_history"]:
+            has_data, pumped = False, False
+        elif state is not None and state["synced_until"] >= stale_before:
+            has_data, pumped = window_flags(state, window_start.timestamp(), window_end.timestamp())
+            window_age = max(window_age, now.timestamp() - state["synced_until"])
         else:
-            if pd.isna(row['抽水量']) == False:
-                pq_uuid = row['抽水量']
-            elif pd.isna(row['出水量']) == False:
-                pq_uuid = row['出水量']
-            pump_item = Metadata(
-                st_uuid=row['st_uuid'],
-                st_name=row['st_name'],
-                pq_uuid=pq_uuid,
-                datetime_start=start_time,
-                datetime_end=end_time,
-            )
-            df = get_PhysicalQuantity_history_data_within12hr(
-                headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], pump_item, row['st_name']
+            series = get_PhysicalQuantity_history_data_within12hr(
+                headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], pump_item, pump["st_name"]
             )
-        pq_uuid_dict = get_PhysicalQuantity_latest_data(
-            row['st_uuid'], headers, PAYLOAD["client_id"], PAYLOAD["client_secret"]
+            has_data, pumped = len(series) > 0, bool((series.values > 0).any())
+        pq_uuid_dict, age = get_latest_data_cached(
+            pump["st_uuid"], headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], fresh
         )
-        data_time = pq_uuid_dict[pq_uuid]["TimeStamp"].replace("+08:00", "")
-        result_dict = transform_avail_pump(pump_item, df, data_time)
-        st_dict[row['st_uuid']] = result_dict
+        max_age = max(max_age, age)
+        data_time = pq_uuid_dict[pump["pq_uuid"]]["TimeStamp"].replace("+08:00", "")
+        st_dict[pump["st_uuid"]] = avail_pump_row(pump_item, has_data, pumped, data_time)
     avail_pump_df = pd.DataFrame.from_dict(st_dict, orient="index")
     f_name = f'十二小時內無抽水紀錄_可調度的抽水機報表_{now}.csv'
-    f_path = write_file(avail_pump_df, f_name)
-    return FileResponse(f_path, media_type="application/octet-stream", filename=f_name)
+    observe_report_rows("available_pumps_within12hr", avail_pump_df)
+    f_path = write_file(avail_pump_df, f_name, scratch)
+    return FileResponse(
+        f_path, media_type="application/octet-stream", filename=f_name,
+        headers={"X-Snapshot-Age-Sec": str(max_age), "X-Pump-Window-Age-Sec": str(round(window_age, 1))}
+    )
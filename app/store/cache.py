@@ -0,0 +1,477 @@
+# store/cache.py
+"""
+Cache for tokens, metadata, latest snapshots and report results (CACHE_BACKEND):
+
+    memory  in-process LRU; every worker keeps its own copy (default, single process)
+    disk    SQLite file under CACHE_DIR, shared by every worker process on the host
+    shm     fixed-size hash table in a shared memory segment, shared by every worker on the host
+
+    value = CACHE.get_or_set("metadata:station:<st_uuid>", fetch, ttl=3600)
+
+get_or_set() runs `fn` once per key: concurrent callers in the same process share the
+call (SingleFlight) and, with the disk / shm backends, callers in other workers wait on a
+per-key file lock and then read the stored value, so N workers do not make N upstream calls.
+Values are pickled by the disk / shm backends; the memory backend stores the object itself,
+so cached values must be treated as read-only. None is never cached.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
+from decouple import Config, RepositoryEnv
+import threading
+import hashlib
+import sqlite3
+import pickle
+import struct
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks, each worker may compute the same key once
+    fcntl = None
+
+from app.monitoring.metrics import CACHE_REQUESTS
+from app.upstream.singleflight import SingleFlight
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+CACHE_BACKEND = ENV.get('CACHE_BACKEND', default="memory")
+CACHE_DIR = ENV.get('CACHE_DIR', default=base_dir + "/cache/")
+CACHE_MAX_ENTRIES = ENV.get('CACHE_MAX_ENTRIES', default=4096, cast=int)
+CACHE_DISK_MAX_MB = ENV.get('CACHE_DISK_MAX_MB', default=512, cast=int)
+CACHE_SHM_NAME = ENV.get('CACHE_SHM_NAME', default="fastapi_iow_cache")
+CACHE_SHM_SLOTS = ENV.get('CACHE_SHM_SLOTS', default=4096, cast=int)
+CACHE_SHM_SLOT_KB = ENV.get('CACHE_SHM_SLOT_KB', default=64, cast=int)
+CACHE_LOCK_TIMEOUT_SEC = ENV.get('CACHE_LOCK_TIMEOUT_SEC', default=30, cast=float)
+# TTLs of the cached kinds
+CACHE_TOKEN_TTL_SEC = ENV.get('CACHE_TOKEN_TTL_SEC', default=1800, cast=int)
+CACHE_METADATA_TTL_SEC = ENV.get('CACHE_METADATA_TTL_SEC', default=3600, cast=int)
+CACHE_DEVICES_TTL_SEC = ENV.get('CACHE_DEVICES_TTL_SEC', default=30, cast=int)
+CACHE_LATEST_TTL_SEC = ENV.get('CACHE_LATEST_TTL_SEC', default=50, cast=int)  # keep below LATEST_SNAPSHOT_INTERVAL_SEC
+CACHE_REPORT_TTL_SEC = ENV.get('CACHE_REPORT_TTL_SEC', default=600, cast=int)
+
+_MISSING = object()
+LOCK_STRIPES = 1024
+
+
+def cache_kind(key):
+    """Metrics label: "metadata:station:<uuid>" -> "metadata" """
+    return key.split(":", 1)[0]
+
+
+def key_digest(text):
+    """Short stable digest for keys built from secrets or long parameters"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class BaseCache:
+    backend = None
+
+    def __init__(self):
+        self._flights = SingleFlight()
+        self._held = threading.local()  # lock stripes held by the current thread
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None):
+        """Stores `value` only when `key` is absent; True when stored (a lease across workers)"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        return {"backend": self.backend}
+
+    @contextmanager
+    def key_lock(self, key):
+        """Cross-process lock of `key`'s stripe; gives up after CACHE_LOCK_TIMEOUT_SEC (the lock is only an optimization)"""
+        if fcntl is None or self.backend == "memory":
+            yield
+            return
+        stripe = int(key_digest(key), 16) % LOCK_STRIPES
+        held = getattr(self._held, "stripes", None)
+        if held is None:
+            held = self._held.stripes = set()
+        if stripe in held:  # nested get_or_set on a key of the same stripe
+            yield
+            return
+
+        lock_dir = os.path.join(CACHE_DIR, "locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"{stripe}.lock"), "a+b") as f:
+            deadline = time.monotonic() + CACHE_LOCK_TIMEOUT_SEC
+            locked = False
+            while True:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    locked = True
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        break
+                    time.sleep(0.02)
+            held.add(stripe)
+            try:
+                yield
+            finally:
+                held.discard(stripe)
+                if locked:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_or_set(self, key, fn, ttl=None):
+        kind = cache_kind(key)
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            CACHE_REQUESTS.inc(cache=kind, result="hit")
+            return value
+
+        def load():
+            with self.key_lock(key):
+                # Another worker may have stored it while we waited for the lock
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    CACHE_REQUESTS.inc(cache=kind, result="shared")
+                    return value
+                CACHE_REQUESTS.inc(cache=kind, result="miss")
+                value = fn()
+                if value is not None:
+                    self.set(key, value, ttl)
+                return value
+
+        return self._flights.do(key, load)
+
+
+class MemoryCache(BaseCache):
+    """LRU of at most `max_entries` keys, in this process only"""
+
+    backend = "memory"
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key => (expires_at or None, value)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def _store(self, key, value, ttl):
+        self._entries[key] = (time.time() + ttl if ttl else None, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > time.time()):
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._entries)
+        return {"backend": self.backend, "entries": entries, "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+class DiskCache(BaseCache):
+    """
+    SQLite (WAL) file shared by the worker processes of one host; least recently used
+    rows are evicted once the values exceed `max_mb`.
+    """
+
+    backend = "disk"
+
+    def __init__(self, path=None, max_mb=CACHE_DISK_MAX_MB):
+        super().__init__()
+        self.path = path or os.path.join(CACHE_DIR, "cache.sqlite3")
+        self.max_bytes = max_mb * 2 ** 20
+        self._local = threading.local()
+        self._writes = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB, size INTEGER, expires_at REAL, accessed_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, default=None):
+        conn = self._connect()
+        row = conn.execute("SELECT value, expires_at, accessed_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return default
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, now))
+            return default
+        if now - accessed_at > 10:  # keep LRU order without a write per read
+            conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return pickle.loads(value)
+
+    def _row(self, key, value, ttl):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        return key, blob, len(blob), now + ttl if ttl else None, now
+
+    def set(self, key, value, ttl=None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            self._row(key, value, ttl),
+        )
+        self._after_write()
+
+    def add(self, key, value, ttl=None):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM cache WHERE key = ? AND expires_at <= ?", (key, time.time()))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                self._row(key, value, ttl),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache")
+
+    def _after_write(self):
+        self._writes += 1
+        if self._writes % 50 == 0:
+            self.evict()
+
+    def evict(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        for key, size in conn.execute("SELECT key, size FROM cache ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            total -= size
+            removed += 1
+        return removed
+
+    def stats(self):
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        return {"backend": self.backend, "path": self.path, "entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+
+class SharedMemoryCache(BaseCache):
+    """
+    Open-addressing hash table in a named shared memory segment: `slots` fixed-size slots,
+    a key lives in one of PROBES slots after its hash (the least recently used one is
+    replaced when all are taken). Values larger than a slot are not cached.
+    The first worker creates the segment; it outlives the workers (CACHE_SHM_NAME).
+    """
+
+    backend = "shm"
+    MAGIC = b"IOWCACHE"
+    HEADER = struct.Struct("<8sII")       # magic, slots, slot size
+    SLOT_HEADER = struct.Struct("<QddHI")  # key hash (0 = empty), expires_at (0 = never), accessed_at, key len, value len
+    PROBES = 16
+
+    def __init__(self, name=CACHE_SHM_NAME, slots=CACHE_SHM_SLOTS, slot_kb=CACHE_SHM_SLOT_KB):
+        super().__init__()
+        self.name = name
+        slot_size = slot_kb * 1024
+        size = self.HEADER.size + slots * slot_size
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.HEADER.pack_into(self._shm.buf, 0, self.MAGIC, slots, slot_size)
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+        # Keep the segment when this worker exits (the resource tracker would unlink it)
+        try:
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+        except Exception:
+            pass
+
+        magic, self.slots, self.slot_size = self.HEADER.unpack_from(self._shm.buf, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"Shared memory segment {name} is not a cache segment")
+        self._lock = threading.Lock()
+        self._lock_file = None
+        if fcntl is not None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self._lock_file = open(os.path.join(CACHE_DIR, f"{name}.lock"), "a+b")
+        self.skipped = 0  # values too large for a slot
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self._lock_file is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if self._lock_file is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _offset(self, index):
+        return self.HEADER.size + index * self.slot_size
+
+    def _hash(self, key_bytes):
+        return int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), "little") or 1
+
+    def _probe(self, key_hash):
+        start = key_hash % self.slots
+        return [(start + i) % self.slots for i in range(min(self.PROBES, self.slots))]
+
+    def _find(self, key_bytes, key_hash):
+        """(slot index holding the key or None, header of that slot)"""
+        buf = self._shm.buf
+        for index in self._probe(key_hash):
+            offset = self._offset(index)
+            header = self.SLOT_HEADER.unpack_from(buf, offset)
+            if header[0] != key_hash or header[3] != len(key_bytes):
+                continue
+            key_start = offset + self.SLOT_HEADER.size
+            if bytes(buf[key_start:key_start + header[3]]) == key_bytes:
+                return index, header
+        return None, None
+
+    def get(self, key, default=None):
+        key_bytes = key.encode("utf-8")
+        key_hash = self._hash(key_bytes)
+        with self._locked():
+            index, header = self._find(key_bytes, key_hash)
+            if index is None:
+                return default
+            _, expires_at, _, key_len, value_len = header
+            offset = self._offset(index)
+            now = time.time()
+            if expires_at and expires_at <= now:
+                self.SLOT_HEADER.pack_into(self._shm.buf, offset, 0, 0, 0, 0, 0)
+                return default
+            self.SLOT_HEADER.pack_into(self._shm.buf, offset, key_hash, expires_at, now, key_len, value_len)
+            value_start = offset + self.SLOT_HEADER.size + key_len
+            blob = bytes(self._shm.buf[value_start:value_start + value_len])
+        return pickle.loads(blob)
+
+    def _write(self, key, value, ttl, only_if_absent):
+        key_bytes = key.encode("utf-8")
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if self.SLOT_HEADER.size + len(key_bytes) + len(blob) > self.slot_size:
+            self.skipped += 1
+            return False
+        key_hash = self._hash(key_bytes)
+        now = time.time()
+        buf = self._shm.buf
+        with self._locked():
+            index, header = self._find(key_bytes, key_hash)
+            if index is not None and only_if_absent and not (header[1] and header[1] <= now):
+                return False
+            if index is None:
+                # Empty or expired slot, else the least recently used one
+                candidates = []
+                for probe_index in self._probe(key_hash):
+                    slot_hash, expires_at, accessed_at, _, _ = self.SLOT_HEADER.unpack_from(buf, self._offset(probe_index))
+                    free = slot_hash == 0 or (expires_at and expires_at <= now)
+                    candidates.append((not free, accessed_at, probe_index))
+                index = min(candidates)[2]
+            offset = self._offset(index)
+            start = offset + self.SLOT_HEADER.size
+            buf[start:start + len(key_bytes)] = key_bytes
+            buf[start + len(key_bytes):start + len(key_bytes) + len(blob)] = blob
+            self.SLOT_HEADER.pack_into(buf, offset, key_hash, now + ttl if ttl else 0, now, len(key_bytes), len(blob))
+        return True
+
+    def set(self, key, value, ttl=None):
+        self._write(key, value, ttl, only_if_absent=False)
+
+    def add(self, key, value, ttl=None):
+        return self._write(key, value, ttl, only_if_absent=True)
+
+    def delete(self, key):
+        key_bytes = key.encode("utf-8")
+        with self._locked():
+            index, _ = self._find(key_bytes, self._hash(key_bytes))
+            if index is not None:
+                self.SLOT_HEADER.pack_into(self._shm.buf, self._offset(index), 0, 0, 0, 0, 0)
+
+    def clear(self):
+        with self._locked():
+            for index in range(self.slots):
+                self.SLOT_HEADER.pack_into(self._shm.buf, self._offset(index), 0, 0, 0, 0, 0)
+
+    def stats(self):
+        now = time.time()
+        entries = 0
+        with self._locked():
+            for index in range(self.slots):
+                key_hash, expires_at, _, _, _ = self.SLOT_HEADER.unpack_from(self._shm.buf, self._offset(index))
+                if key_hash and not (expires_at and expires_at <= now):
+                    entries += 1
+        return {
+            "backend": self.backend, "name": self.name, "entries": entries, "slots": self.slots,
+            "slot_bytes": self.slot_size, "skipped_too_large": self.skipped,
+        }
+
+
+def make_cache(backend=CACHE_BACKEND):
+    if backend == "memory":
+        return MemoryCache()
+    if backend == "disk":
+        return DiskCache()
+    if backend == "shm":
+        return SharedMemoryCache()
+    raise ValueError(f"Unknown CACHE_BACKEND {backend} (memory / disk / shm)")
+
+
+CACHE = make_cache()
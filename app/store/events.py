@@ -0,0 +1,70 @@
+# store/events.py
+import asyncio
+import threading
+
+
+class Subscriber:
+    """One SSE / WebSocket client; events are delivered on its own event loop"""
+
+    def __init__(self, loop, st_uuids=None, device_types=None, towns=None, queue_size=1000):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.st_uuids = set(st_uuids or [])
+        self.device_types = set(device_types or [])
+        self.towns = set(towns or [])
+        self.dropped = 0
+
+    def matches(self, event):
+        if self.st_uuids and event["st_uuid"] not in self.st_uuids:
+            return False
+        if self.device_types and event["device_type"] not in self.device_types:
+            return False
+        if self.towns and event.get("town") not in self.towns:
+            return False
+        return True
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Slow client: drop instead of blocking the shared poller
+            self.dropped += 1
+
+
+class EventHub:
+    """Fan-out of change events from the shared poller to every subscriber"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self.state = {}  # (device_type, st_uuid) => latest event
+
+    def subscribe(self, loop, **filters):
+        subscriber = Subscriber(loop, **filters)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            current = [event for event in self.state.values() if subscriber.matches(event)]
+        for event in current:
+            subscriber.put(event)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, events):
+        with self._lock:
+            for event in events:
+                self.state[(event["device_type"], event["st_uuid"])] = event
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            for event in events:
+                if subscriber.matches(event):
+                    subscriber.loop.call_soon_threadsafe(subscriber.put, event)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+LIVE_EVENTS = EventHub()
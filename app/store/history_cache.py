@@ -0,0 +1,133 @@
+# store/history_cache.py
+"""
+Local copy of the raw history of complete days: HISTORY_CACHE_DIR/{YYYY-MM-DD}/{pq_uuid}.npz
+(the TimeSeries arrays, compressed). Written by every whole-day history fetch and by the
+history_prefetch job; `get_PhysicalQuantity_history_data` only asks IoW for the days missing here.
+Days are complete HISTORY_CACHE_SETTLE_HOURS after their end (Asia/Taipei), so late IoW uploads
+are in before a day is frozen; today and yesterday until then are never stored.
+"""
+from datetime import datetime, timedelta
+from decouple import Config, RepositoryEnv
+import numpy as np
+import pytz
+import shutil
+import uuid
+import os
+
+from app.ingest.series import TimeSeries
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+HISTORY_CACHE_ENABLED = ENV.get('HISTORY_CACHE_ENABLED', default=True, cast=bool)
+HISTORY_CACHE_DIR = ENV.get('HISTORY_CACHE_DIR', default=base_dir + "/history_cache/")
+# Days older than this are removed by the prefetch job (monthly reports read the previous ~31 days)
+HISTORY_CACHE_RETAIN_DAYS = ENV.get('HISTORY_CACHE_RETAIN_DAYS', default=62, cast=int)
+# Hours after midnight before the previous day may be stored (IoW stations upload late points)
+HISTORY_CACHE_SETTLE_HOURS = ENV.get('HISTORY_CACHE_SETTLE_HOURS', default=3, cast=int)
+
+
+def today():
+    return datetime.now(pytz.timezone('Asia/Taipei')).date()
+
+
+def day_range(datetime_start, datetime_end):
+    """["YYYY-MM-DD", ...] of [datetime_start, datetime_end]"""
+    day = datetime.strptime(datetime_start, "%Y-%m-%d").date()
+    last_day = datetime.strptime(datetime_end, "%Y-%m-%d").date()
+    days = []
+    while day <= last_day:
+        days.append(day.strftime("%Y-%m-%d"))
+        day += timedelta(days=1)
+    return days
+
+
+def latest_complete_day():
+    """Last day that has ended HISTORY_CACHE_SETTLE_HOURS ago (date)"""
+    now = datetime.now(pytz.timezone('Asia/Taipei'))
+    return (now - timedelta(hours=HISTORY_CACHE_SETTLE_HOURS)).date() - timedelta(days=1)
+
+
+def is_complete(day):
+    return datetime.strptime(day, "%Y-%m-%d").date() <= latest_complete_day()
+
+
+def day_path(pq_uuid, day):
+    return f"{HISTORY_CACHE_DIR}{day}/{pq_uuid}.npz"
+
+
+def is_cached(pq_uuid, day):
+    return os.path.isfile(day_path(pq_uuid, day))
+
+
+def load_day(pq_uuid, day, st_name=""):
+    """TimeSeries of one cached day (possibly empty), or None when the day is not cached"""
+    try:
+        with np.load(day_path(pq_uuid, day)) as arrays:
+            return TimeSeries(
+                arrays["timestamps"],
+                arrays["values"],
+                [st_name or ""],
+                None,
+                arrays["quality"] if "quality" in arrays else None,
+                int(arrays["utc_offset"][0]) if "utc_offset" in arrays else None,
+            )
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def store_day(pq_uuid, day, series):
+    """Writes one complete day (atomically: readers never see half a file)"""
+    if not is_complete(day):
+        return False
+    arrays = {"timestamps": series.timestamps, "values": series.values}
+    if series.quality is not None:
+        arrays["quality"] = series.quality
+    if series.utc_offset is not None:
+        arrays["utc_offset"] = np.asarray([series.utc_offset], dtype=np.int64)
+    path = day_path(pq_uuid, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp.npz"
+    np.savez_compressed(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+    return True
+
+
+def store_days(pq_uuid, days, series):
+    """Splits a fetch of [days[0], days[-1]] into local days and stores the complete ones (empty days too)"""
+    local_days = series.local_days()
+    for day in days:
+        if is_complete(day):
+            store_day(pq_uuid, day, series.take(local_days == np.datetime64(day)))
+
+
+def purge_history_cache(retain_days=HISTORY_CACHE_RETAIN_DAYS):
+    """Removes the day folders older than `retain_days`; returns how many"""
+    if not os.path.isdir(HISTORY_CACHE_DIR):
+        return 0
+    oldest = (today() - timedelta(days=retain_days)).strftime("%Y-%m-%d")
+    removed = 0
+    for day in os.listdir(HISTORY_CACHE_DIR):
+        if len(day) == 10 and day < oldest:
+            shutil.rmtree(HISTORY_CACHE_DIR + day, ignore_errors=True)
+            removed += 1
+    return removed
+
+
+def history_cache_usage():
+    """{days, files, bytes} of HISTORY_CACHE_DIR"""
+    days, files, total_bytes = 0, 0, 0
+    if os.path.isdir(HISTORY_CACHE_DIR):
+        for day in os.listdir(HISTORY_CACHE_DIR):
+            day_dir = HISTORY_CACHE_DIR + day
+            if not os.path.isdir(day_dir):
+                continue
+            days += 1
+            for file_name in os.listdir(day_dir):
+                try:
+                    total_bytes += os.path.getsize(os.path.join(day_dir, file_name))
+                    files += 1
+                except OSError:
+                    pass
+    return {"days": days, "files": files, "bytes": total_bytes}
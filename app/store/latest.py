@@ -0,0 +1,121 @@
+# store/latest.py
+import threading
+import uuid
+import time
+
+from app.store.cache import CACHE, CACHE_LATEST_TTL_SEC
+
+
+def shared_key(st_uuid):
+    """Key of a station's latest values in the cache shared by the workers (app/store/cache.py)"""
+    return f"latest:{st_uuid}"
+
+
+def parse_cursor(cursor):
+    """(instance, version) of a `changes_since` cursor, None when it is not one"""
+    instance, _, version = (cursor or "").partition("-")
+    if len(instance) != 8 or not version.isdigit():
+        return None
+    return instance, int(version)
+
+
+class LatestSnapshot:
+    """
+    In-memory latest values: pq_uuid => {Value, TimeStamp}, grouped by station with the fetch time.
+    Every PQ whose Value / TimeStamp changes (or that appears / disappears) gets the next value of
+    a version counter, so clients can ask for the changes since the version they last saw.
+    Versions are per process: `instance` changes on restart and differs between workers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # st_uuid => {"pq": {pq_uuid: {"Value", "TimeStamp"}}, "fetched_at": epoch sec,
+        #             "versions": {pq_uuid: version}, "removed": {pq_uuid: version}}
+        self.stations = {}
+        self.last_poll = None
+        self.instance = uuid.uuid4().hex[:8]
+        self.version = 0
+
+    def update_station(self, st_uuid, pq_uuid_dict, fetched_at=None, share=False):
+        pq = {pq_uuid: dict(data) for pq_uuid, data in pq_uuid_dict.items()}
+        fetched_at = fetched_at or time.time()
+        with self._lock:
+            previous = self.stations.get(st_uuid) or {"pq": {}, "versions": {}, "removed": {}}
+            versions = {}
+            for pq_uuid, data in pq.items():
+                old = previous["pq"].get(pq_uuid)
+                if old is not None and old.get("Value") == data.get("Value") and old.get("TimeStamp") == data.get("TimeStamp"):
+                    versions[pq_uuid] = previous["versions"][pq_uuid]
+                else:
+                    self.version += 1
+                    versions[pq_uuid] = self.version
+            removed = {pq_uuid: version for pq_uuid, version in previous["removed"].items() if pq_uuid not in pq}
+            for pq_uuid in previous["pq"]:
+                if pq_uuid not in pq:
+                    self.version += 1
+                    removed[pq_uuid] = self.version
+            self.stations[st_uuid] = {"pq": pq, "fetched_at": fetched_at, "versions": versions, "removed": removed}
+        if share:
+            CACHE.set(shared_key(st_uuid), {"pq": pq, "fetched_at": fetched_at}, CACHE_LATEST_TTL_SEC)
+
+    def load_shared(self, st_uuid):
+        """(pq_uuid_dict, fetched_at) stored by another worker, or None"""
+        entry = CACHE.get(shared_key(st_uuid))
+        if entry is None:
+            return None
+        self.update_station(st_uuid, entry["pq"], entry["fetched_at"])
+        return self.get_station(st_uuid)
+
+    def get_station(self, st_uuid):
+        """(pq_uuid_dict, fetched_at) or None"""
+        with self._lock:
+            entry = self.stations.get(st_uuid)
+        if entry is None:
+            return None
+        return entry["pq"], entry["fetched_at"]
+
+    def cursor(self):
+        with self._lock:
+            return f"{self.instance}-{self.version}"
+
+    def changes_since(self, cursor=None, st_uuids=None):
+        """
+        (changed, removed, new cursor, full): the PQs changed / removed after `cursor`, or every PQ
+        (full=True) when the cursor is missing or from another process.
+        changed: [{st_uuid, pq_uuid, Value, TimeStamp}], removed: [{st_uuid, pq_uuid}]
+        """
+        parsed = parse_cursor(cursor)
+        with self._lock:
+            full = parsed is None or parsed[0] != self.instance or parsed[1] > self.version
+            since = 0 if full else parsed[1]
+            changed, removed = [], []
+            for st_uuid in (self.stations if st_uuids is None else st_uuids):
+                entry = self.stations.get(st_uuid)
+                if entry is None:
+                    continue
+                for pq_uuid, data in entry["pq"].items():
+                    if entry["versions"][pq_uuid] > since:
+                        changed.append({"st_uuid": st_uuid, "pq_uuid": pq_uuid, **data})
+                if not full:
+                    removed += [
+                        {"st_uuid": st_uuid, "pq_uuid": pq_uuid}
+                        for pq_uuid, version in entry["removed"].items() if version > since
+                    ]
+            new_cursor = f"{self.instance}-{self.version}"
+        return changed, removed, new_cursor, full
+
+    def age(self, fetched_at):
+        return round(time.time() - fetched_at, 1)
+
+    def status(self):
+        with self._lock:
+            fetched = [entry["fetched_at"] for entry in self.stations.values()]
+        return {
+            "stations": len(fetched),
+            "last_poll": self.last_poll,
+            "oldest_age_sec": self.age(min(fetched)) if fetched else None,
+            "cursor": self.cursor(),
+        }
+
+
+LATEST_SNAPSHOT = LatestSnapshot()
@@ -0,0 +1,129 @@
+# store/pump_index.py
+"""
+Grid index over the dispatchable MPD / MPDCY pumps of the AIOT device lists, for
+"k nearest available pumps to this point / RFD station" without going through every pump.
+
+Pumps are bucketed into CELL_DEG x CELL_DEG cells; a query searches rings of cells around its
+cell and stops once no unvisited cell can hold a pump closer than the k-th found one.
+The index is rebuilt with the device lists (same cache TTL, see statistics_data.get_pump_index).
+"""
+from decouple import Config, RepositoryEnv
+import numpy as np
+import os
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+# ~5.5 km cells: a few pumps per cell in 嘉義縣
+PUMP_INDEX_CELL_DEG = ENV.get('PUMP_INDEX_CELL_DEG', default=0.05, cast=float)
+# 1 (未出勤)、2 (出勤中)、3 (抽水中)、4 (運送中)、5 (異常)
+DISPATCHABLE_STATUS = (1, 2)
+EARTH_RADIUS_KM = 6371.0088
+
+
+def dispatchable_pumps(*device_lists):
+    """Report rows of the pumps with detailStatus 1 / 2 (the last list wins for a repeated _id)"""
+    pumps = {}
+    for devices in device_lists:
+        for st in devices:
+            if st["detailStatus"] in DISPATCHABLE_STATUS:
+                pumps[st["_id"]] = {
+                    "st_name": st["name"],
+                    "st_uuid": st["_id"],
+                    "lat": st["lat"],
+                    "lon": st["lon"],
+                    "location": st["county"] + st["town"] + st["village"],
+                    "dev_type": st["type"],
+                }
+    return pumps
+
+
+def haversine_km(lat, lon, lat_rad, lon_rad):
+    """Great-circle distances (km) from (lat, lon) in degrees to arrays of radians"""
+    lat0, lon0 = np.radians(lat), np.radians(lon)
+    a = np.sin((lat_rad - lat0) / 2) ** 2 + np.cos(lat0) * np.cos(lat_rad) * np.sin((lon_rad - lon0) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class PumpIndex:
+    """Grid over pump rows ({st_uuid, lat, lon, ...}); rows without coordinates are left out"""
+
+    def __init__(self, pumps, cell_deg=PUMP_INDEX_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.pumps = [pump for pump in pumps if pump.get("lat") is not None and pump.get("lon") is not None]
+        lat = np.asarray([pump["lat"] for pump in self.pumps], dtype=np.float64)
+        lon = np.asarray([pump["lon"] for pump in self.pumps], dtype=np.float64)
+        self.lat_rad, self.lon_rad = np.radians(lat), np.radians(lon)
+        self.max_abs_lat = float(np.abs(lat).max()) if len(lat) else 0.0
+
+        self.cells = {}  # (row, col) => positions in self.pumps
+        rows, cols = self.cell_of(lat, lon)
+        for position, cell in enumerate(zip(rows.tolist(), cols.tolist())):
+            self.cells.setdefault(cell, []).append(position)
+        self.cells = {cell: np.asarray(positions) for cell, positions in self.cells.items()}
+        self.bounds = (rows.min(), rows.max(), cols.min(), cols.max()) if len(rows) else None
+
+    def __len__(self):
+        return len(self.pumps)
+
+    def cell_of(self, lat, lon):
+        return (
+            np.floor(np.asarray(lat) / self.cell_deg).astype(np.int64),
+            np.floor(np.asarray(lon) / self.cell_deg).astype(np.int64),
+        )
+
+    def ring(self, row, col, r):
+        """Cells at Chebyshev distance r from (row, col)"""
+        if r == 0:
+            return [(row, col)]
+        cells = [(row - r, c) for c in range(col - r, col + r + 1)]
+        cells += [(row + r, c) for c in range(col - r, col + r + 1)]
+        cells += [(rw, col - r) for rw in range(row - r + 1, row + r)]
+        cells += [(rw, col + r) for rw in range(row - r + 1, row + r)]
+        return cells
+
+    def outside_ring_km(self, lat, r):
+        """Lower bound of the distance to any pump more than r cells away from the query's cell"""
+        delta = np.radians(min(r * self.cell_deg, 180.0))
+        by_lat = EARTH_RADIUS_KM * delta
+        cos_lat = np.cos(np.radians(min(max(abs(lat), self.max_abs_lat), 90.0)))
+        by_lon = 2 * EARTH_RADIUS_KM * np.arcsin(min(cos_lat * np.sin(delta / 2), 1.0))
+        return min(by_lat, by_lon)
+
+    def nearest(self, lat, lon, k=5, max_km=None):
+        """[(pump row, distance km)] of the k nearest pumps (within max_km), nearest first"""
+        if not self.pumps or k <= 0:
+            return []
+        row, col = (int(value) for value in self.cell_of(lat, lon))
+        row_min, row_max, col_min, col_max = self.bounds
+        last_ring = max(abs(row - row_min), abs(row - row_max), abs(col - col_min), abs(col - col_max))
+
+        found = []
+        r = 0
+        while r <= last_ring:
+            if 8 * r > len(self.cells):
+                # Far from the pumps (or a sparse grid): visiting the remaining rings costs more than all cells
+                found = [np.arange(len(self.pumps))]
+                break
+            found += [self.cells[cell] for cell in self.ring(row, col, r) if cell in self.cells]
+            n_found = sum(len(positions) for positions in found)
+            bound = self.outside_ring_km(lat, r)
+            if max_km is not None and bound > max_km:
+                break
+            if n_found >= k:
+                positions = np.concatenate(found)
+                distances = haversine_km(lat, lon, self.lat_rad[positions], self.lon_rad[positions])
+                if np.partition(distances, k - 1)[k - 1] <= bound:
+                    break
+            r += 1
+
+        if not found:
+            return []
+        positions = np.concatenate(found)
+        distances = haversine_km(lat, lon, self.lat_rad[positions], self.lon_rad[positions])
+        if max_km is not None:
+            within = distances <= max_km
+            positions, distances = positions[within], distances[within]
+        order = np.argsort(distances, kind="stable")[:k]
+        return [(self.pumps[position], float(distances[i])) for i, position in zip(order, positions[order])]
@@ -0,0 +1,128 @@
+# store/pump_window.py
+"""
+Rolling pumping state of every pump PQ in MPD_MPDCY_all_info.csv, for the 12-hour available-pumps report.
+
+Per PQ: points / positive points per hour for the last PUMP_WINDOW_RETAIN_HOURS, the last data and
+last positive (Value > 0) timestamps, and how far the poller has read (`synced_until`).
+app/jobs/pump_window.py appends the points that arrived since its previous poll; the report only
+sums the hours of its window. States live in the shared cache, so every worker reads the same ones.
+"""
+from decouple import Config, RepositoryEnv
+import numpy as np
+import pandas as pd
+import time
+import os
+
+from app.store.cache import CACHE
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+PUMPS_FILE = base_dir + "/STATION_UUIDs/MPD_MPDCY_all_info.csv"
+PUMP_WINDOW_INTERVAL_SEC = ENV.get('PUMP_WINDOW_INTERVAL_SEC', default=300, cast=int)
+# Older states are not used by the report (it fetches those pumps from IoW instead)
+PUMP_WINDOW_MAX_AGE_SEC = ENV.get('PUMP_WINDOW_MAX_AGE_SEC', default=3 * PUMP_WINDOW_INTERVAL_SEC, cast=int)
+# The report window is [yesterday HH:00, today HH:00); keep a little more
+PUMP_WINDOW_RETAIN_HOURS = ENV.get('PUMP_WINDOW_RETAIN_HOURS', default=26, cast=int)
+NS_PER_SEC = 1_000_000_000
+
+
+def list_pumps():
+    """
+    [{st_uuid, st_name, pq_uuid, has_history}] of MPD_MPDCY_all_info.csv:
+    pq_uuid is 抽水量 (else 出水量); pumps with neither have no history (pq_uuid = 經度 PQ).
+    """
+    pumps = []
+    for _, row in pd.read_csv(PUMPS_FILE, encoding='utf-8').iterrows():
+        if pd.isna(row['抽水量']) and pd.isna(row['出水量']):
+            pq_uuid, has_history = row['經度'], False
+        else:
+            pq_uuid, has_history = (row['抽水量'] if not pd.isna(row['抽水量']) else row['出水量']), True
+        pumps.append({"st_uuid": row['st_uuid'], "st_name": row['st_name'], "pq_uuid": pq_uuid, "has_history": has_history})
+    return pumps
+
+
+def window_key(pq_uuid):
+    return f"pump_window:{pq_uuid}"
+
+
+def new_state():
+    return {
+        # hour start (epoch sec) => [points, positive points, points at hh:00:00, positive points at hh:00:00]
+        "hours": {},
+        "last_data": None,      # epoch sec of the newest point
+        "last_positive": None,  # epoch sec of the newest Value > 0 point
+        "synced_until": None,   # epoch sec up to which IoW has been read
+    }
+
+
+def apply_points(state, series, synced_until, retain_hours=PUMP_WINDOW_RETAIN_HOURS):
+    """New state with the points of `series` newer than `state["last_data"]` added"""
+    timestamps = series.timestamps // NS_PER_SEC
+    positive = series.values > 0
+    if state["last_data"] is not None:
+        newer = timestamps > state["last_data"]
+        timestamps, positive = timestamps[newer], positive[newer]
+
+    hours = {hour: list(counts) for hour, counts in state["hours"].items()}
+    hour_of = timestamps // 3600 * 3600
+    on_hour = timestamps == hour_of
+    for column, mask in enumerate((None, positive, on_hour, positive & on_hour)):
+        selected = hour_of if mask is None else hour_of[mask]
+        for hour, count in zip(*np.unique(selected, return_counts=True)):
+            hours.setdefault(int(hour), [0, 0, 0, 0])[column] += int(count)
+    oldest = (synced_until - retain_hours * 3600) // 3600 * 3600
+    hours = {hour: counts for hour, counts in hours.items() if hour >= oldest}
+
+    last_data, last_positive = state["last_data"], state["last_positive"]
+    if len(timestamps):
+        last_data = max(last_data or 0, int(timestamps.max()))
+    if positive.any():
+        last_positive = max(last_positive or 0, int(timestamps[positive].max()))
+    return {"hours": hours, "last_data": last_data, "last_positive": last_positive, "synced_until": synced_until}
+
+
+def window_flags(state, start_sec, end_sec):
+    """(has data, pumped) in [start_sec, end_sec], both hour aligned and included like the IoW range"""
+    points, positives = 0, 0
+    for hour, counts in state["hours"].items():
+        if start_sec <= hour < end_sec:
+            points += counts[0]
+            positives += counts[1]
+        elif hour == end_sec:
+            points += counts[2]
+            positives += counts[3]
+    return points > 0, positives > 0
+
+
+class PumpWindow:
+    """States of the pump PQs in the shared cache"""
+
+    def __init__(self):
+        self.last_poll = None
+
+    def ttl(self):
+        return PUMP_WINDOW_RETAIN_HOURS * 3600
+
+    def get(self, pq_uuid):
+        return CACHE.get(window_key(pq_uuid))
+
+    def update(self, pq_uuid, series, synced_until):
+        state = apply_points(self.get(pq_uuid) or new_state(), series, synced_until)
+        CACHE.set(window_key(pq_uuid), state, self.ttl())
+        return state
+
+    def status(self):
+        synced = [
+            state["synced_until"] for state in (self.get(pump["pq_uuid"]) for pump in list_pumps() if pump["has_history"])
+            if state is not None
+        ]
+        return {
+            "pumps": len(synced),
+            "last_poll": self.last_poll,
+            "oldest_age_sec": round(time.time() - min(synced), 1) if synced else None,
+        }
+
+
+PUMP_WINDOW = PumpWindow()
@@ -0,0 +1,207 @@
+# store/rollup.py
+from datetime import datetime, timedelta
+from decouple import Config, RepositoryEnv
+from pymongo import MongoClient, ASCENDING, UpdateOne
+import numpy as np
+import pandas as pd
+import os
+
+from app.ingest.series import NS_PER_SEC, as_series
+from app.store.history_cache import is_complete
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+# Off by default: when on, every whole-day history fetch also writes to `iow.pq_rollup`
+ROLLUP_ENABLED = ENV.get('ROLLUP_ENABLED', default=False, cast=bool)
+# Two consecutive positive points further apart than this are not counted as "Value > 0" time / one run
+ROLLUP_POSITIVE_MAX_GAP_MIN = ENV.get('ROLLUP_POSITIVE_MAX_GAP_MIN', default=10, cast=int)
+
+# 聚合粒度 => pandas offset alias
+GRANULARITIES = {"hourly": "h", "daily": "D"}
+ROLLUP_COLUMNS = [
+    "bucket", "count", "min", "max", "mean", "sum", "positive_seconds", "last_value", "first_time", "last_time",
+    "runs", "utc_offset",
+]
+
+# Get IoW history from DB
+ROLLUP_dbClient = MongoClient(
+    ENV.get('HISTORY_DB_HOST_PORT'),
+    username=ENV.get('HISTORY_DB_USER'),
+    password=ENV.get('HISTORY_DB_PASSWORD'),
+    authSource=ENV.get('HISTORY_DB_AUTH_SOURCE')
+)
+ROLLUP_db = ROLLUP_dbClient.iow
+_index_ready = False
+
+
+def ensure_rollup_index():
+    global _index_ready
+    if not _index_ready:
+        ROLLUP_db.pq_rollup.create_index(
+            [("pq_uuid", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+            name="pq_granularity_bucket", unique=True
+        )
+        _index_ready = True
+
+
+def to_local_timestamps(timestamps):
+    """IoW TimeStamp strings => naive Asia/Taipei datetime64"""
+    ts = pd.to_datetime(timestamps, format="ISO8601")
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert("Asia/Taipei").dt.tz_localize(None)
+    return ts
+
+
+def compute_rollups(df, granularity, max_gap_min=ROLLUP_POSITIVE_MAX_GAP_MIN):
+    """
+    Aggregate raw points (TimeStamp, Value or a TimeSeries) into hourly / daily buckets.
+    count: every point (NaN values too, like the raw 妥善率); min / max / mean / sum / last_value skip NaN.
+    positive_seconds: time between consecutive points that are both > 0 (and at most `max_gap_min` apart),
+    split at bucket boundaries.
+    runs: [[first, last] epoch ns] of the bucket's `positive_runs` (Value > 0 points at most
+    `max_gap_min` apart, found within the bucket); `merge_runs` joins them across buckets.
+    """
+    series = as_series(df)
+    if len(series) == 0:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+
+    freq = GRANULARITIES[granularity]
+    data = pd.DataFrame({
+        "TimeStamp": to_local_timestamps(pd.Series(series.datetimes())),
+        "Value": series.values.astype(np.float64),
+        "ns": series.timestamps,
+    }).sort_values("TimeStamp", kind="stable").reset_index(drop=True)
+    data["bucket"] = data["TimeStamp"].dt.floor(freq)
+
+    counts = data.groupby("bucket").size()
+    data = data.dropna(subset=["Value"]).reset_index(drop=True)
+    result = data.groupby("bucket").agg(
+        min=("Value", "min"),
+        max=("Value", "max"),
+        mean=("Value", "mean"),
+        sum=("Value", "sum"),
+        last_value=("Value", "last"),
+        first_time=("TimeStamp", "first"),
+        last_time=("TimeStamp", "last"),
+    ).reindex(counts.index)
+    result["count"] = counts
+
+    # Seconds with Value > 0
+    ts = data["TimeStamp"].to_numpy()
+    positive = (data["Value"] > 0).to_numpy()
+    delta = (ts[1:] - ts[:-1]) / np.timedelta64(1, "s")
+    in_session = positive[:-1] & positive[1:] & (delta <= max_gap_min * 60)
+    boundary = data["bucket"].to_numpy()[1:]
+    crosses = boundary > ts[:-1]
+    head = np.where(crosses, (boundary - ts[:-1]) / np.timedelta64(1, "s"), delta)
+    tail = delta - head
+    seconds = pd.concat([
+        pd.Series(head[in_session], index=data["bucket"].to_numpy()[:-1][in_session]),
+        pd.Series(tail[in_session & crosses], index=boundary[in_session & crosses]),
+    ])
+    result["positive_seconds"] = seconds.groupby(level=0).sum().reindex(result.index, fill_value=0.0)
+
+    # Pumping runs: a new run at each bucket change or gap > max_gap_min between positive points
+    on = data[data["Value"] > 0]
+    run_ns = on["ns"].to_numpy()
+    run_bucket = on["bucket"].to_numpy()
+    new_run = np.ones(len(on), dtype=bool)
+    new_run[1:] = (run_bucket[1:] != run_bucket[:-1]) | (np.diff(run_ns) > max_gap_min * 60 * NS_PER_SEC)
+    starts = np.flatnonzero(new_run)
+    ends = np.append(starts[1:], len(on))[:len(starts)] - 1
+    runs = {}
+    for bucket, first, last in zip(on["bucket"].iloc[starts], run_ns[starts].tolist(), run_ns[ends].tolist()):
+        runs.setdefault(bucket, []).append([first, last])
+    result["runs"] = [runs.get(bucket, []) for bucket in result.index]
+    result["utc_offset"] = series.utc_offset
+    return result.reset_index()[ROLLUP_COLUMNS]
+
+
+def update_rollups(pq_uuid, df, datetime_start, datetime_end):
+    """
+    Upsert hourly & daily buckets of the raw data fetched for [datetime_start 00:00, datetime_end 23:59:59].
+    Every fetched day gets a daily bucket (count 0 when empty); days past the history cache's settle
+    delay (history_cache.is_complete) are marked `complete`, so late uploads are not missed.
+    """
+    if not ROLLUP_ENABLED:
+        return
+    ensure_rollup_index()
+
+    operations = []
+    hourly = compute_rollups(df, "hourly")
+    for row in hourly.to_dict("records"):
+        operations.append(UpdateOne(
+            {"pq_uuid": pq_uuid, "granularity": "hourly", "bucket": row["bucket"].to_pydatetime()},
+            {"$set": rollup_document(row)},
+            upsert=True
+        ))
+
+    daily = compute_rollups(df, "daily").set_index("bucket")
+    day = datetime.strptime(datetime_start, "%Y-%m-%d")
+    last_day = datetime.strptime(datetime_end, "%Y-%m-%d")
+    while day <= last_day:
+        if day in daily.index:
+            document = rollup_document(daily.loc[day].to_dict())
+        else:
+            document = {"count": 0}
+        document["complete"] = is_complete(day.strftime("%Y-%m-%d"))
+        operations.append(UpdateOne(
+            {"pq_uuid": pq_uuid, "granularity": "daily", "bucket": day},
+            {"$set": document},
+            upsert=True
+        ))
+        day += timedelta(days=1)
+
+    if operations:
+        ROLLUP_db.pq_rollup.bulk_write(operations, ordered=False)
+
+
+def rollup_document(row):
+    document = {}
+    for key in ROLLUP_COLUMNS[1:]:
+        value = row[key]
+        if value is pd.NaT:
+            value = None
+        elif isinstance(value, pd.Timestamp):
+            value = value.to_pydatetime()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        document[key] = value
+    return document
+
+
+def get_rollups(pq_uuid, granularity, datetime_start, datetime_end):
+    """
+    Buckets of [datetime_start, datetime_end] (YYYY-MM-DD), or None when some day of the range
+    has not been completely ingested yet (or ROLLUP_ENABLED is off).
+    """
+    if not ROLLUP_ENABLED:
+        return None
+    format_datetime_start = datetime.strptime(datetime_start, "%Y-%m-%d")
+    format_datetime_end = datetime.strptime(datetime_end, "%Y-%m-%d") + timedelta(hours=23, minutes=59, seconds=59)
+    duration_in_days = (format_datetime_end.date() - format_datetime_start.date()).days + 1
+
+    covered_days = ROLLUP_db.pq_rollup.count_documents({
+        "pq_uuid": pq_uuid,
+        "granularity": "daily",
+        "complete": True,
+        "bucket": {"$gte": format_datetime_start, "$lte": format_datetime_end},
+    })
+    if covered_days < duration_in_days:
+        return None
+
+    data = list(ROLLUP_db.pq_rollup.find(
+        {
+            "pq_uuid": pq_uuid,
+            "granularity": granularity,
+            "count": {"$gt": 0},
+            "bucket": {"$gte": format_datetime_start, "$lte": format_datetime_end},
+        },
+        {"_id": 0, "pq_uuid": 0, "granularity": 0, "complete": 0}
+    ).sort("bucket", 1))
+    if any("runs" not in document for document in data):
+        # Written before runs were stored
+        return None
+    return pd.DataFrame(data, columns=ROLLUP_COLUMNS)
@@ -0,0 +1,147 @@
+# store/scratch.py
+"""Per-request scratch directories under temp/ and the temp/ disk quota"""
+from decouple import Config, RepositoryEnv
+from fastapi import BackgroundTasks
+import threading
+import uuid
+import re
+import shutil
+import time
+import os
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+SCRATCH_ROOT = base_dir + "/temp/"
+SCRATCH_QUOTA_MB = ENV.get('SCRATCH_QUOTA_MB', default=2048, cast=int)
+SCRATCH_MAX_AGE_MIN = ENV.get('SCRATCH_MAX_AGE_MIN', default=60, cast=int)
+SCRATCH_PURGE_INTERVAL_SEC = ENV.get('SCRATCH_PURGE_INTERVAL_SEC', default=60, cast=int)
+
+ACTIVE_DIRS = {}  # scratch dir -> reserved at (epoch sec), for requests still running (never purged)
+_active_lock = threading.Lock()
+# temp/req-<pid>-<hex>/: with several workers (`--workers N`), each one only purges its own scratch dirs
+# (ACTIVE_DIRS is per process) and those of workers that are gone
+SCRATCH_NAME = re.compile(r"^req-(\d+)-[0-9a-f]+$")
+
+
+def new_scratch_dir():
+    """
+    temp/req-<pid>-XXXX/ (with trailing slash, like the other temp_folder_path values).
+    Only the name is reserved; the folder is created by the first write (write_file / upload).
+    """
+    path = f"{SCRATCH_ROOT}req-{os.getpid()}-{uuid.uuid4().hex[:12]}/"
+    with _active_lock:
+        ACTIVE_DIRS[path] = time.time()
+    return path
+
+
+def remove_scratch_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    with _active_lock:
+        ACTIVE_DIRS.pop(path, None)
+
+
+def scratch_dir(background_tasks: BackgroundTasks):
+    """
+    Dependency: a private folder for the request's upload / intermediate / result files,
+    removed by a background task once the response has been sent
+    (or right away when the endpoint raises). Nothing is created on disk when
+    the request fails validation, since the folder only appears on the first write.
+    """
+    path = new_scratch_dir()
+    background_tasks.add_task(remove_scratch_dir, path)
+    try:
+        yield path
+    except Exception:
+        remove_scratch_dir(path)
+        raise
+
+
+def entry_usage(path):
+    """(bytes, last used epoch sec) of a file or a folder tree"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0, 0
+    if not os.path.isdir(path):
+        return stat.st_size, max(stat.st_atime, stat.st_mtime)
+
+    total_bytes, last_used = 0, stat.st_mtime
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                file_stat = os.stat(os.path.join(root, file_name))
+            except OSError:
+                continue
+            total_bytes += file_stat.st_size
+            last_used = max(last_used, file_stat.st_atime, file_stat.st_mtime)
+    return total_bytes, last_used
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def owned_by_other_worker(name):
+    """Scratch dir of another running process (its requests may still be writing / streaming it)"""
+    match = SCRATCH_NAME.match(name)
+    if match is None:
+        return False
+    pid = int(match.group(1))
+    return pid != os.getpid() and pid_alive(pid)
+
+
+def purge_scratch(quota_mb=None, max_age_min=None, now=None):
+    """
+    Removes temp/ entries unused for `max_age_min`, then least recently used entries
+    until temp/ fits in `quota_mb`. Scratch dirs of running requests are kept, and so are
+    the scratch dirs of the other live workers (they purge their own).
+    """
+    quota_bytes = (SCRATCH_QUOTA_MB if quota_mb is None else quota_mb) * 2 ** 20
+    max_age_sec = (SCRATCH_MAX_AGE_MIN if max_age_min is None else max_age_min) * 60
+    now = now or time.time()
+    if not os.path.isdir(SCRATCH_ROOT):
+        return {"usage_bytes": 0, "removed": 0, "freed_bytes": 0}
+
+    with _active_lock:
+        # Names reserved by requests that failed validation are never released by a background task
+        for path, reserved_at in list(ACTIVE_DIRS.items()):
+            if now - reserved_at >= max_age_sec:
+                del ACTIVE_DIRS[path]
+        active = set(ACTIVE_DIRS)
+    entries = []
+    usage_bytes = 0
+    for name in os.listdir(SCRATCH_ROOT):
+        path = os.path.join(SCRATCH_ROOT, name)
+        size, last_used = entry_usage(path)
+        usage_bytes += size
+        if path + "/" not in active and not owned_by_other_worker(name):
+            entries.append((last_used, size, path))
+
+    removed, freed_bytes = 0, 0
+    for last_used, size, path in sorted(entries):
+        if now - last_used < max_age_sec and usage_bytes - freed_bytes <= quota_bytes:
+            break
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+        removed += 1
+        freed_bytes += size
+    return {"usage_bytes": usage_bytes - freed_bytes, "removed": removed, "freed_bytes": freed_bytes}
+
+
+def run_scratch_purge():
+    result = purge_scratch()
+    if result["removed"]:
+        print(f"[scratch] removed {result['removed']} entries ({result['freed_bytes'] / 2 ** 20:.1f} MB)")
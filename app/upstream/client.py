@@ -0,0 +1,59 @@
+# upstream/client.py
+from decouple import Config, RepositoryEnv
+import os
+
+from app.upstream.ratelimit import RateScheduler
+from app.upstream.resilience import AdaptiveLimiter, CircuitBreaker, UpstreamGuard
+from app.upstream.singleflight import SingleFlight
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+IOW_BASE_URL = ENV.get('IOW_BASE_URL', default='https://iapi.wra.gov.tw/v3')
+AIOT_BASE_URL = ENV.get('AIOT_BASE_URL', default='https://api.floodsolution.aiot.ing')
+# Calls per second shared by every router and job (0 = no limit)
+RATE_PER_SEC_DEFAULTS = {"iow": 10.0, "aiot": 0.0}
+
+
+def build_guard(name):
+    prefix = name.upper()
+    limiter = AdaptiveLimiter(
+        initial=ENV.get(f'{prefix}_INITIAL_CONCURRENCY', default=8, cast=int),
+        max_limit=ENV.get(f'{prefix}_MAX_CONCURRENCY', default=32, cast=int),
+        target_latency=ENV.get(f'{prefix}_TARGET_LATENCY_SEC', default=2.0, cast=float),
+    )
+    breaker = CircuitBreaker(
+        failure_threshold=ENV.get(f'{prefix}_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int),
+        open_sec=ENV.get(f'{prefix}_CIRCUIT_OPEN_SEC', default=30, cast=int),
+        probe_timeout=ENV.get(f'{prefix}_CIRCUIT_PROBE_TIMEOUT_SEC', default=120, cast=int),
+    )
+    scheduler = RateScheduler(
+        name,
+        rate=ENV.get(f'{prefix}_RATE_PER_SEC', default=RATE_PER_SEC_DEFAULTS[name], cast=float),
+        burst=ENV.get(f'{prefix}_RATE_BURST', default=20, cast=int),
+        queue_timeout=ENV.get(f'{prefix}_RATE_QUEUE_TIMEOUT_SEC', default=60, cast=int),
+    )
+    return UpstreamGuard(name, limiter, breaker, scheduler)
+
+
+UPSTREAMS = {
+    "iow": build_guard("iow"),
+    "aiot": build_guard("aiot"),
+}
+IOW_FLIGHTS = SingleFlight()
+
+
+def iow_request(method, path, **kwargs):
+    """e.g. iow_request("get", "api/Station/Get/{st_uuid}", headers=headers, timeout=5)"""
+    return UPSTREAMS["iow"].request(method, f"{IOW_BASE_URL}/{path}", **kwargs)
+
+
+def aiot_request(method, path, **kwargs):
+    """e.g. aiot_request("get", "api/v1/devices/MPD", headers=headers, timeout=5)"""
+    return UPSTREAMS["aiot"].request(method, f"{AIOT_BASE_URL}/{path}", **kwargs)
+
+
+def iow_get_coalesced(path, **kwargs):
+    """GET shared by all concurrent identical requests (keyed by path, i.e. regardless of token)"""
+    return IOW_FLIGHTS.do(path, lambda: iow_request("get", path, **kwargs))
@@ -0,0 +1,140 @@
+# upstream/ratelimit.py
+"""
+Token bucket shared by every call to one upstream (see UpstreamGuard), handing out tokens by
+priority class: interactive (operator queries) > report (report / download requests) > prefetch
+(background jobs). Within a class, waiting callers are served round-robin per job (one HTTP
+request or one background job), so one large report cannot starve the other reports.
+
+The class and job of the calls made by the current request / job are set with `upstream_caller`
+(main.py middleware, jobs/scheduler.py); thread pools pass them on with `map_in_context`.
+"""
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+import threading
+import time
+
+from app.monitoring.metrics import UPSTREAM_QUEUE_DEPTH, UPSTREAM_QUEUE_WAIT
+from app.monitoring.profiling import run_attached
+
+
+PRIORITIES = ("interactive", "report", "prefetch")
+UPSTREAM_CALLER = ContextVar("upstream_caller", default=("report", "default"))
+
+
+@contextmanager
+def upstream_caller(priority, job):
+    context_token = UPSTREAM_CALLER.set((priority if priority in PRIORITIES else "report", job))
+    try:
+        yield
+    finally:
+        UPSTREAM_CALLER.reset(context_token)
+
+
+def map_in_context(executor, fn, items):
+    """
+    `list(executor.map(fn, items))`, each call running with the caller's context (upstream class / job,
+    profile); the worker threads are sampled by the caller's profile while they run its calls.
+    """
+    futures = [executor.submit(copy_context().run, run_attached, fn, item) for item in items]
+    return [future.result() for future in futures]
+
+
+class Ticket:
+    __slots__ = ("priority", "job", "granted")
+
+    def __init__(self, priority, job):
+        self.priority = priority
+        self.job = job
+        self.granted = False
+
+
+class RateScheduler:
+    """`rate` calls per second (bursts of up to `burst`); rate <= 0 disables the limit"""
+
+    def __init__(self, name, rate, burst, queue_timeout=60):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.queue_timeout = queue_timeout
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.queues = {priority: OrderedDict() for priority in PRIORITIES}  # job => deque of Tickets
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _next_ticket(self):
+        for priority in PRIORITIES:
+            jobs = self.queues[priority]
+            if jobs:
+                job, tickets = next(iter(jobs.items()))
+                ticket = tickets.popleft()
+                # The job goes to the back of its class (round-robin)
+                del jobs[job]
+                if tickets:
+                    jobs[job] = tickets
+                return ticket
+        return None
+
+    def _dispatch(self):
+        granted = False
+        while self.tokens >= 1:
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            ticket.granted = True
+            self.tokens -= 1
+            UPSTREAM_QUEUE_DEPTH.dec(upstream=self.name, priority=ticket.priority)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _remove(self, ticket):
+        tickets = self.queues[ticket.priority].get(ticket.job)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self.queues[ticket.priority][ticket.job]
+            UPSTREAM_QUEUE_DEPTH.dec(upstream=self.name, priority=ticket.priority)
+
+    def acquire(self):
+        """Waits for a token in the caller's class; False after `queue_timeout` seconds"""
+        if self.rate <= 0:
+            return True
+        priority, job = UPSTREAM_CALLER.get()
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        ticket = Ticket(priority, job)
+        with self._cond:
+            self.queues[priority].setdefault(job, deque()).append(ticket)
+            UPSTREAM_QUEUE_DEPTH.inc(upstream=self.name, priority=priority)
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                self._dispatch()
+                if ticket.granted:
+                    break
+                if now >= deadline:
+                    self._remove(ticket)
+                    break
+                next_token = max((1 - self.tokens) / self.rate, 0.001)
+                self._cond.wait(min(deadline - now, next_token))
+        UPSTREAM_QUEUE_WAIT.observe(time.monotonic() - started, upstream=self.name, priority=priority)
+        return ticket.granted
+
+    def status(self):
+        with self._cond:
+            self._refill(time.monotonic())
+            queued = {priority: sum(len(tickets) for tickets in jobs.values()) for priority, jobs in self.queues.items()}
+            jobs = {priority: len(jobs) for priority, jobs in self.queues.items()}
+            tokens = self.tokens
+        return {
+            "rate_per_sec": self.rate,
+            "burst": self.burst,
+            "tokens": round(tokens, 2),
+            "queued": queued,
+            "queued_jobs": jobs,
+        }
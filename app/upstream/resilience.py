@@ -0,0 +1,266 @@
+# upstream/resilience.py
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import threading
+import time
+
+import requests
+
+from app.monitoring.metrics import (
+    UPSTREAM_CALLS, UPSTREAM_LATENCY, UPSTREAM_RETRIES, TOKEN_REFRESHES, endpoint_label
+)
+from app.monitoring.profiling import record_time
+
+
+class UpstreamUnavailable(Exception):
+    """Upstream is failing fast (circuit open or no concurrency slot); answered as 503"""
+
+    def __init__(self, upstream, detail, retry_after=None):
+        super().__init__(f"{upstream}: {detail}")
+        self.upstream = upstream
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+def parse_retry_after(response, max_delay=60):
+    """Seconds from a `Retry-After` header (delta-seconds or HTTP-date), None when absent"""
+    if response is None:
+        return None
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), max_delay)
+
+
+def retry_delay(error, delay):
+    """Delay before the next attempt: the upstream's `Retry-After` if given, else `delay`"""
+    request = getattr(error, "request", None)
+    UPSTREAM_RETRIES.inc(endpoint=endpoint_label(getattr(request, "path_url", None) or ""))
+    retry_after = parse_retry_after(getattr(error, "response", None))
+    return delay if retry_after is None else retry_after
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit: +1/limit per fast success, *decrease_ratio on error or slow response
+    (at most once per `decrease_interval` seconds).
+    """
+
+    def __init__(self, initial=8, min_limit=1, max_limit=32, target_latency=2.0,
+                 decrease_ratio=0.7, decrease_interval=1.0, acquire_timeout=30):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.target_latency = target_latency
+        self.decrease_ratio = decrease_ratio
+        self.decrease_interval = decrease_interval
+        self.acquire_timeout = acquire_timeout
+        self.inflight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            self.inflight += 1
+            return True
+
+    def release(self, latency, ok):
+        with self._cond:
+            self.inflight -= 1
+            if ok and latency <= self.target_latency:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif time.monotonic() - self._last_decrease >= self.decrease_interval:
+                self.limit = max(self.min_limit, self.limit * self.decrease_ratio)
+                self._last_decrease = time.monotonic()
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """
+    closed => open after `failure_threshold` consecutive failures => half_open (one probe) after `open_sec`.
+    A probe that has not settled after `probe_timeout` seconds (e.g. a streamed body nobody closed)
+    no longer blocks the next one.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, open_sec=30, probe_timeout=120):
+        self.failure_threshold = failure_threshold
+        self.open_sec = open_sec
+        self.probe_timeout = probe_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.open_until = 0.0
+        self._probe_inflight = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns (allowed, seconds until the next probe)"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now < self.open_until:
+                    return False, self.open_until - now
+                self.state = self.HALF_OPEN
+                self._probe_inflight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_inflight and now - self._probe_started < self.probe_timeout:
+                    return False, 1.0
+                self._probe_inflight = True
+                self._probe_started = now
+            return True, 0.0
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_inflight = False
+
+    def record_failure(self, retry_after=None):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold or retry_after:
+                self.state = self.OPEN
+                self.open_until = time.monotonic() + (retry_after or self.open_sec)
+                self._probe_inflight = False
+
+    def release_probe(self):
+        """The call let through by `allow` ended without an upstream outcome (local congestion, cancelled, ...)"""
+        with self._lock:
+            self._probe_inflight = False
+
+
+class StreamedResponse:
+    """
+    A `stream=True` response whose call is settled (see UpstreamGuard.settle) when it is closed,
+    not when the headers arrive, so the concurrency slot and latency cover the body download.
+    An error while reading the body inside `with response:` (e.g. a truncated JSON array, which
+    is only known once the parser reaches the end) counts as a failed call.
+    """
+
+    def __init__(self, response, finish):
+        self._response = response
+        self._finish = finish
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        body_failed = False
+        if exc_type is not None and not issubclass(exc_type, requests.exceptions.HTTPError):
+            body_failed = issubclass(exc_type, (requests.exceptions.RequestException, ValueError, KeyError))
+        self.close(body_ok=not body_failed)
+
+    def _settle(self, body_ok):
+        finish, self._finish = self._finish, None
+        if finish is not None:
+            finish(body_ok)
+
+    def iter_content(self, *args, **kwargs):
+        try:
+            yield from self._response.iter_content(*args, **kwargs)
+        except requests.exceptions.RequestException:
+            self._settle(False)
+            raise
+
+    def close(self, body_ok=True):
+        try:
+            self._response.close()
+        finally:
+            self._settle(body_ok)
+
+
+class UpstreamGuard:
+    """Rate scheduler + adaptive concurrency limit + circuit breaker around every call to one upstream"""
+
+    def __init__(self, name, limiter, breaker, scheduler=None):
+        self.name = name
+        self.limiter = limiter
+        self.breaker = breaker
+        self.scheduler = scheduler
+
+    def request(self, method, url, **kwargs):
+        endpoint = endpoint_label(url.split("://", 1)[-1].split("/", 1)[-1])
+
+        # Breaker first, so calls rejected by an open circuit do not spend rate tokens
+        allowed, wait_sec = self.breaker.allow()
+        if not allowed:
+            raise UpstreamUnavailable(self.name, "circuit open", retry_after=round(wait_sec) + 1)
+        # Waiting locally (rate queue, concurrency slot) says nothing about the upstream's health;
+        # whatever ends the wait, no call was made, so a half-open probe is handed back
+        try:
+            if self.scheduler is not None and not self.scheduler.acquire():
+                raise UpstreamUnavailable(self.name, "rate limit queue timeout", retry_after=1)
+            if not self.limiter.acquire():
+                raise UpstreamUnavailable(self.name, "too many concurrent requests", retry_after=1)
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+
+        if endpoint in ("oauth2/token", "auth/login"):
+            TOKEN_REFRESHES.inc(upstream=self.name)
+
+        # From here every exit settles the call (StreamedResponse: when closed, see probe_timeout otherwise)
+        started = time.monotonic()
+        try:
+            response = requests.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self.settle(endpoint, started, "error", ok=False, failure=True)
+            raise
+        except BaseException:
+            self.settle(endpoint, started, "error", ok=False)
+            raise
+        if response.status_code == 429 or response.status_code >= 500:
+            retry_after = parse_retry_after(response)
+            self.settle(endpoint, started, response.status_code, ok=False, failure=True, retry_after=retry_after)
+            return response
+        if kwargs.get("stream"):
+            # Settled once the body is read or closed: the slot and latency cover the download
+            def finish(body_ok):
+                status = response.status_code if body_ok else "body_error"
+                self.settle(endpoint, started, status, ok=body_ok, failure=not body_ok)
+
+            return StreamedResponse(response, finish)
+        self.settle(endpoint, started, response.status_code, ok=True)
+        return response
+
+    def settle(self, endpoint, started, status, ok, failure=False, retry_after=None):
+        """Breaker outcome, concurrency slot and metrics of one finished call"""
+        if ok:
+            self.breaker.record_success()
+        elif failure:
+            self.breaker.record_failure(retry_after=retry_after)
+        else:
+            # Not the upstream's fault (e.g. the caller was cancelled): only frees a half-open probe
+            self.breaker.release_probe()
+        latency = time.monotonic() - started
+        self.limiter.release(latency, ok)
+        UPSTREAM_CALLS.inc(upstream=self.name, endpoint=endpoint, status=status)
+        UPSTREAM_LATENCY.observe(latency, upstream=self.name, endpoint=endpoint)
+        record_time("upstream_io", latency)
+
+    def status(self):
+        return {
+            "upstream": self.name,
+            "limit": round(self.limiter.limit, 2),
+            "inflight": self.limiter.inflight,
+            "circuit": self.breaker.state,
+            "rate": self.scheduler.status() if self.scheduler is not None else None,
+        }
@@ -0,0 +1,78 @@
+# upstream/stream.py
+"""
+Incremental parsing of large IoW JSON responses.
+
+`iter_json_array(response, "DataPoints")` yields the objects of one top-level array while the
+body is being downloaded (`stream=True`), so only a chunk of text and the current object are
+held instead of the whole body string plus the whole object tree.
+"""
+from decouple import Config, RepositoryEnv
+import requests
+import codecs
+import json
+import re
+import os
+
+
+# Load environment variables
+base_dir = os.getcwd()
+ENV = Config(RepositoryEnv(base_dir + '/.env'))
+STREAM_CHUNK_KB = ENV.get('STREAM_CHUNK_KB', default=64, cast=int)
+
+SKIP_SEPARATORS = re.compile(r"[\s,]*")
+KEY_TAIL_CHARS = 256  # text kept while searching for the array key (it may be split across chunks)
+
+
+def truncated(message, text, pos):
+    # A requests JSONDecodeError is a RequestException, so the fetchers retry it like `response.json()` errors
+    return requests.exceptions.JSONDecodeError(message, text, pos)
+
+
+def iter_json_array(response, key, chunk_size=None):
+    """
+    Objects of the top-level array `key` of a streamed JSON response, e.g.
+    {"Id": "...", "DataPoints": [{"TimeStamp": "...", "Value": 1.0}, ...]}.
+    Raises KeyError when the body has no such array (like `response.json()[key]`).
+    """
+    chunks = response.iter_content(chunk_size=(chunk_size or STREAM_CHUNK_KB * 1024))
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    json_decoder = json.JSONDecoder()
+    array_start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+
+    def read_more():
+        for chunk in chunks:
+            if chunk:
+                return decoder.decode(chunk)
+        return None
+
+    # The array
+    text = ""
+    while True:
+        more = read_more()
+        if more is None:
+            raise KeyError(key)
+        text += more
+        match = array_start.search(text)
+        if match:
+            break
+        text = text[-KEY_TAIL_CHARS:]
+    pos = match.end()
+
+    # Its items, one at a time
+    while True:
+        pos = SKIP_SEPARATORS.match(text, pos).end()
+        if pos < len(text) and text[pos] == "]":
+            return
+        try:
+            if pos == len(text):
+                raise ValueError("need more data")
+            item, pos = json_decoder.raw_decode(text, pos)
+        except ValueError:
+            # The item continues in the next chunk
+            more = read_more()
+            if more is None:
+                raise truncated(f"Unterminated {key} array", text, pos)
+            text = text[pos:] + more
+            pos = 0
+            continue
+        yield item
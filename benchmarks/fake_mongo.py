@@ -0,0 +1,248 @@
+# benchmarks/fake_mongo.py
+"""
+In-memory MongoClient stand-in covering the calls this service makes
+(find / find_one / insert_one / bulk_write(UpdateOne) / create_index).
+
+    import pymongo
+    pymongo.MongoClient = FakeMongoClient   # before importing app.*
+"""
+import threading
+import copy
+
+
+def _compare(value, op, operand):
+    try:
+        if op == "$gte":
+            return value is not None and value >= operand
+        if op == "$gt":
+            return value is not None and value > operand
+        if op == "$lte":
+            return value is not None and value <= operand
+        if op == "$lt":
+            return value is not None and value < operand
+    except TypeError:
+        return False
+    if op == "$ne":
+        return value != operand
+    if op == "$in":
+        return value in operand
+    if op == "$nin":
+        return value not in operand
+    raise NotImplementedError(f"FakeMongo: unsupported operator {op}")
+
+
+def _get(doc, key):
+    for part in key.split("."):
+        if not isinstance(doc, dict) or part not in doc:
+            return None, False
+        doc = doc[part]
+    return doc, True
+
+
+def matches(doc, query):
+    for key, condition in (query or {}).items():
+        value, exists = _get(doc, key)
+        if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            for op, operand in condition.items():
+                if op == "$exists":
+                    if exists != bool(operand):
+                        return False
+                elif op == "$elemMatch":
+                    if not isinstance(value, list) or not any(
+                        isinstance(element, dict) and matches(element, operand) for element in value
+                    ):
+                        return False
+                elif not _compare(value, op, operand):
+                    return False
+        elif isinstance(value, list) and not isinstance(condition, list):
+            if condition not in value:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+def project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    included = {k for k, v in projection.items() if v and k != "_id"}
+    if included:
+        result = {k: copy.deepcopy(doc[k]) for k in included if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {k: copy.deepcopy(v) for k, v in doc.items() if projection.get(k, 1)}
+
+
+def _hashable(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+
+def _sort_key(field):
+    def key(doc):
+        value, exists = _get(doc, field)
+        # None / missing sort first, like MongoDB
+        return (exists and value is not None, value if value is not None else 0)
+    return key
+
+
+class FakeCursor(list):
+    def sort(self, key_or_list, direction=1):
+        keys = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        for field, field_direction in reversed(keys):
+            super().sort(key=_sort_key(field), reverse=field_direction < 0)
+        return self
+
+    def limit(self, n):
+        return FakeCursor(self[:n]) if n else self
+
+    def skip(self, n):
+        return FakeCursor(self[n:])
+
+
+class FakeCollection:
+    """Documents in a list; fields of create_index() keys get a hash index for equality lookups"""
+
+    def __init__(self, name):
+        self.name = name
+        self.documents = []
+        self.indexes = {}
+        self._field_index = {}
+        self._lock = threading.RLock()
+        self._next_id = 0
+
+    def _new_id(self):
+        self._next_id += 1
+        return f"{self.name}-{self._next_id}"
+
+    def _index_add(self, doc):
+        for field, buckets in self._field_index.items():
+            value, exists = _get(doc, field)
+            if exists:
+                buckets.setdefault(_hashable(value), {})[id(doc)] = doc
+
+    def _index_remove(self, doc):
+        for field, buckets in self._field_index.items():
+            value, exists = _get(doc, field)
+            if exists:
+                buckets.get(_hashable(value), {}).pop(id(doc), None)
+
+    def _candidates(self, filter):
+        best = None
+        for key, condition in (filter or {}).items():
+            if key in self._field_index and not isinstance(condition, (dict, list)):
+                bucket = self._field_index[key].get(_hashable(condition), {})
+                if best is None or len(bucket) < len(best):
+                    best = bucket
+        return self.documents if best is None else list(best.values())
+
+    def create_index(self, keys, name=None, unique=False, **kwargs):
+        name = name or "_".join(f"{k}_{d}" for k, d in keys)
+        with self._lock:
+            self.indexes[name] = {"keys": keys, "unique": unique}
+            for field, _ in keys:
+                if field not in self._field_index:
+                    self._field_index[field] = {}
+                    for doc in self.documents:
+                        value, exists = _get(doc, field)
+                        if exists:
+                            self._field_index[field].setdefault(_hashable(value), {})[id(doc)] = doc
+        return name
+
+    def find(self, filter=None, projection=None, sort=None):
+        with self._lock:
+            cursor = FakeCursor(
+                project(doc, projection) for doc in self._candidates(filter) if matches(doc, filter)
+            )
+        return cursor.sort(sort) if sort else cursor
+
+    def find_one(self, filter=None, projection=None, sort=None):
+        cursor = self.find(filter, projection, sort)
+        return cursor[0] if cursor else None
+
+    def count_documents(self, filter=None):
+        return len(self.find(filter))
+
+    def insert_one(self, document):
+        with self._lock:
+            document.setdefault("_id", self._new_id())
+            doc = copy.deepcopy(document)
+            self.documents.append(doc)
+            self._index_add(doc)
+
+    def insert_many(self, documents):
+        for document in documents:
+            self.insert_one(document)
+
+    def update_one(self, filter, update, upsert=False):
+        with self._lock:
+            for doc in self._candidates(filter):
+                if matches(doc, filter):
+                    self._index_remove(doc)
+                    doc.update(copy.deepcopy(update.get("$set", {})))
+                    self._index_add(doc)
+                    return
+            if upsert:
+                doc = {k: v for k, v in filter.items() if not isinstance(v, dict)}
+                doc.update(copy.deepcopy(update.get("$set", {})))
+                doc.update(copy.deepcopy(update.get("$setOnInsert", {})))
+                doc["_id"] = self._new_id()
+                self.documents.append(doc)
+                self._index_add(doc)
+
+    def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            # pymongo.UpdateOne keeps its arguments in _filter / _doc / _upsert
+            self.update_one(operation._filter, operation._doc, upsert=operation._upsert)
+
+    def delete_many(self, filter):
+        with self._lock:
+            for doc in self.documents:
+                if matches(doc, filter):
+                    self._index_remove(doc)
+            self.documents = [doc for doc in self.documents if not matches(doc, filter)]
+
+
+class FakeDatabase:
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(name)
+            return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+
+class FakeMongoClient:
+    """All FakeMongoClient instances share one in-memory server"""
+
+    _databases = {}
+
+    def __init__(self, host=None, *args, **kwargs):
+        self.host = host
+
+    def __getitem__(self, name):
+        databases = FakeMongoClient._databases
+        if name not in databases:
+            databases[name] = FakeDatabase(name)
+        return databases[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def close(self):
+        pass
@@ -0,0 +1,332 @@
+# benchmarks/fake_upstream.py
+"""
+Local stand-ins for the IoW (https://iapi.wra.gov.tw/v3) and AIOT APIs
+
+    python -m benchmarks.fake_upstream --iow-port 18080 --aiot-port 18081 --latency-ms 20
+
+Only the routes this service calls are implemented. Time series are generated
+deterministically from (pq_uuid, day), so repeated runs see the same data.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timedelta
+from collections import Counter
+from urllib.parse import urlparse
+import multiprocessing
+import argparse
+import hashlib
+import random
+import json
+import time
+import threading
+import csv
+import os
+
+
+TS_PATH_FORMAT = "%Y-%m-%dT%H.%M.%S"
+TZ_SUFFIX = "+08:00"
+TOWNS = ["東石鄉", "朴子市", "布袋鎮", "義竹鄉", "六腳鄉", "太保市", "鹿草鄉", "水上鄉"]
+
+
+class FakeUpstreamConfig:
+    """
+    latency_ms / jitter_ms: per request sleep
+    error_rate:             share of data requests answered with 503 (+ Retry-After)
+    interval_sec:           spacing of generated DataPoints
+    stations:               st_uuid -> {"name", "device_type", "pq": {pq_uuid: kind}}
+                            kind: "pump" (0 / on cycles), "flood" (0 / episodes), "level" (continuous)
+    """
+
+    def __init__(
+        self, latency_ms=0, jitter_ms=0, error_rate=0.0, retry_after_sec=1, interval_sec=60, stations=None, seed=0
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.retry_after_sec = retry_after_sec
+        self.interval_sec = interval_sec
+        self.stations = stations or {}
+        self.seed = seed
+        self._pq_kinds = {
+            pq_uuid: kind for station in self.stations.values() for pq_uuid, kind in station["pq"].items()
+        }
+
+    def kind_of(self, pq_uuid):
+        return self._pq_kinds.get(pq_uuid, "level")
+
+    def to_dict(self):
+        return {key: value for key, value in vars(self).items() if not key.startswith("_")}
+
+
+def read_uuid_lines(path):
+    if not os.path.isfile(path):
+        return []
+    with open(path, "r", encoding="utf-8-sig") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_fixture_stations(repo_dir):
+    """Station registry from the repo's STATION_UUIDs / Documents lists (245 RFD, 254 pumps, 滯洪池)"""
+    stations = {}
+
+    rfd_path = os.path.join(repo_dir, "Documents", "STuuid_PQuuid_RFD_ALL_245_淹.csv")
+    for i, line in enumerate(read_uuid_lines(rfd_path)):
+        st_uuid, pq_uuid = line.split(",")[:2]
+        stations[st_uuid] = {"name": f"RFD-{i + 1:03d}", "device_type": "RFD", "pq": {pq_uuid: "flood"}}
+
+    mpdcy = set(read_uuid_lines(os.path.join(repo_dir, "STATION_UUIDs", "MPDCY_station_ID.txt")))
+    all_info_path = os.path.join(repo_dir, "STATION_UUIDs", "MPD_MPDCY_all_info.csv")
+    if os.path.isfile(all_info_path):
+        with open(all_info_path, "r", encoding="utf-8-sig") as f:
+            for row in csv.DictReader(f):
+                pq = {}
+                for column in ["緯度", "經度", "運作狀態", "GPS主機電壓", "電瓶電壓", "抽水量", "出水量"]:
+                    if row.get(column):
+                        pq[row[column]] = "pump" if column in ("抽水量", "出水量") else "level"
+                stations[row["st_uuid"]] = {
+                    "name": row["st_name"],
+                    "device_type": "MPDCY" if row["st_uuid"] in mpdcy else "MPD",
+                    "pq": pq,
+                }
+
+    pool_path = os.path.join(repo_dir, "STATION_UUIDs", "滯洪池_stUUID_pqUUID_滯洪池底.txt")
+    for line in read_uuid_lines(pool_path):
+        fields = line.split("\t")
+        stations.setdefault(fields[2], {"name": fields[0], "device_type": "", "pq": {}})["pq"][fields[3]] = "level"
+    return stations
+
+
+def stable_seed(*parts):
+    return int(hashlib.md5("|".join(str(p) for p in parts).encode("utf-8")).hexdigest()[:12], 16)
+
+
+def generate_day(pq_uuid, kind, day, interval_sec, seed=0):
+    """[(datetime, value)] for one local day"""
+    rng = random.Random(stable_seed(seed, pq_uuid, day.isoformat()))
+    n = 86400 // interval_sec
+    start = datetime.combine(day, datetime.min.time())
+    values = [0.0] * n
+
+    if kind == "pump":
+        # A few on-cycles per day; some start late at night and cross midnight in the next day's data
+        for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+            first = rng.randrange(n)
+            length = rng.randint(5, 240) * 60 // interval_sec
+            for i in range(first, min(first + length, n)):
+                values[i] = 1.0
+    elif kind == "flood":
+        if rng.random() < 0.15:
+            first = rng.randrange(n)
+            length = rng.randint(10, 180) * 60 // interval_sec
+            peak = rng.uniform(5, 80)
+            for k, i in enumerate(range(first, min(first + length, n))):
+                values[i] = round(peak * (1 - abs(2 * k / max(length, 1) - 1)), 1)
+    else:
+        level = rng.uniform(0.5, 3)
+        for i in range(n):
+            level = max(level + rng.gauss(0, 0.01), 0)
+            values[i] = round(level, 3)
+
+    # Gaps: occasionally drop a block of readings (device offline)
+    if rng.random() < 0.1:
+        first = rng.randrange(n)
+        drop = set(range(first, min(first + rng.randint(10, 360) * 60 // interval_sec, n)))
+    else:
+        drop = set()
+    return [(start + timedelta(seconds=i * interval_sec), values[i]) for i in range(n) if i not in drop]
+
+
+def generate_points(config, pq_uuid, time_start, time_end):
+    kind = config.kind_of(pq_uuid)
+    points = []
+    day = time_start.date()
+    while day <= time_end.date():
+        for ts, value in generate_day(pq_uuid, kind, day, config.interval_sec, config.seed):
+            if time_start <= ts <= time_end:
+                points.append({"TimeStamp": ts.strftime("%Y-%m-%dT%H:%M:%S") + TZ_SUFFIX, "Value": value})
+        day += timedelta(days=1)
+    return points
+
+
+def latest_point(config, pq_uuid, now=None):
+    now = (now or datetime.now()).replace(second=0, microsecond=0)
+    points = generate_day(pq_uuid, config.kind_of(pq_uuid), now.date(), config.interval_sec, config.seed)
+    points = [p for p in points if p[0] <= now] or [(now, 0.0)]
+    ts, value = points[-1]
+    return {"Id": pq_uuid, "Value": value, "TimeStamp": ts.strftime("%Y-%m-%dT%H:%M:%S") + TZ_SUFFIX}
+
+
+def station_record(config, st_uuid):
+    return config.stations.get(st_uuid) or {"name": f"ST-{st_uuid[:8]}", "device_type": "", "pq": {}}
+
+
+def aiot_device(config, st_uuid, station):
+    rng = random.Random(stable_seed(config.seed, "aiot", st_uuid))
+    return {
+        "_id": st_uuid,
+        "name": station["name"],
+        "type": station["device_type"],
+        "county": "嘉義縣",
+        "town": rng.choice(TOWNS),
+        "village": f"{rng.randint(1, 30)}村",
+        "lat": round(rng.uniform(23.35, 23.60), 6),
+        "lon": round(rng.uniform(120.10, 120.45), 6),
+        # 1 (未出勤)、2 (出勤中)、3 (抽水中)、4 (運送中)、5 (異常)
+        "detailStatus": rng.choice([1, 1, 1, 2, 3, 4, 5]),
+    }
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    config = None
+    stats = None
+    stats_lock = None
+    upstream = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _count(self, route, n=1):
+        with self.stats_lock:
+            self.stats[route] += n
+
+    def _send(self, status, body, headers=None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _delay(self):
+        config = self.config
+        delay_ms = config.latency_ms + (random.uniform(0, config.jitter_ms) if config.jitter_ms else 0)
+        if delay_ms:
+            time.sleep(delay_ms / 1000)
+
+    def _failed(self):
+        if self.config.error_rate and random.random() < self.config.error_rate:
+            self._send(503, {"message": "injected error"}, {"Retry-After": str(self.config.retry_after_sec)})
+            return True
+        return False
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_POST(self):
+        self._read_body()
+        path = urlparse(self.path).path.strip("/")
+        self._delay()
+        if path == "oauth2/token":
+            self._count("oauth2/token")
+            return self._send(200, {"access_token": "fake-iow-token", "token_type": "bearer", "expires_in": 3600})
+        if path == "auth/v1/login":
+            self._count("auth/v1/login")
+            return self._send(200, {"token": "fake-aiot-token"})
+        self._count("unknown")
+        return self._send(404, {"message": f"unknown route {path}"})
+
+    def do_GET(self):
+        path = urlparse(self.path).path.strip("/")
+        if path == "__stats":
+            with self.stats_lock:
+                return self._send(200, dict(self.stats))
+        parts = path.split("/")
+        self._delay()
+        if self.upstream == "iow" and parts[0] == "api":
+            return self._iow(parts[1:])
+        if self.upstream == "aiot" and parts[:3] == ["api", "v1", "devices"] and len(parts) == 4:
+            self._count("api/v1/devices")
+            if self._failed():
+                return
+            device_type = parts[3]
+            devices = [
+                aiot_device(self.config, st_uuid, station)
+                for st_uuid, station in self.config.stations.items() if station["device_type"] == device_type
+            ]
+            return self._send(200, {"data": devices})
+        self._count("unknown")
+        return self._send(404, {"message": f"unknown route {path}"})
+
+    def _iow(self, parts):
+        config = self.config
+        route = "/".join(parts[:2])
+        self._count(route)
+        if self._failed():
+            return
+        if route == "Station/Get":
+            station = station_record(config, parts[2])
+            return self._send(200, {
+                "Id": parts[2],
+                "Name": station["name"],
+                "JsonProperties": json.dumps({"MetaData": {"Institution": "嘉義縣政府"}}, ensure_ascii=False),
+            })
+        if route == "LatestData/Read":
+            # LatestData/Read/Station/{st_uuid}/480
+            station = station_record(config, parts[3])
+            return self._send(200, [latest_point(config, pq_uuid) for pq_uuid in station["pq"]])
+        if route == "PhysicalQuantity/Get":
+            return self._send(200, {"Id": parts[2], "Name": f"PQ-{parts[2][:8]}", "JsonProerties": None})
+        if route == "TimeSeriesData/ReadRawData":
+            # TimeSeriesData/ReadRawData/{pq_uuid}/{start}/{end}/true/480
+            pq_uuid, time_start, time_end = parts[2], parts[3], parts[4]
+            try:
+                time_start = datetime.strptime(time_start, TS_PATH_FORMAT)
+                time_end = datetime.strptime(time_end, TS_PATH_FORMAT)
+            except ValueError:
+                return self._send(400, {"message": "bad time range"})
+            points = generate_points(config, pq_uuid, time_start, time_end)
+            self._count("DataPoints", len(points))
+            return self._send(200, {"Id": pq_uuid, "DataPoints": points})
+        return self._send(404, {"message": f"unknown route {route}"})
+
+
+def make_server(upstream, port, config):
+    handler = type(f"{upstream.upper()}Handler", (FakeHandler,), {
+        "config": config, "stats": Counter(), "stats_lock": threading.Lock(), "upstream": upstream,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def serve(iow_port, aiot_port, config_dict):
+    config = FakeUpstreamConfig(**config_dict)
+    servers = [make_server("iow", iow_port, config), make_server("aiot", aiot_port, config)]
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def start_in_subprocess(iow_port, aiot_port, config):
+    """Separate process, so the fakes do not compete with the service for the GIL"""
+    process = multiprocessing.get_context("spawn").Process(
+        target=serve, args=(iow_port, aiot_port, config.to_dict()), daemon=True
+    )
+    process.start()
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake IoW / AIOT upstreams")
+    parser.add_argument("--iow-port", type=int, default=18080)
+    parser.add_argument("--aiot-port", type=int, default=18081)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--interval-sec", type=int, default=60)
+    args = parser.parse_args()
+    config = FakeUpstreamConfig(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, interval_sec=args.interval_sec,
+        stations=load_fixture_stations(os.getcwd()),
+    )
+    print(f"IoW  -> http://127.0.0.1:{args.iow_port}\nAIOT -> http://127.0.0.1:{args.aiot_port}")
+    serve(args.iow_port, args.aiot_port, config.to_dict())
+
+
+if __name__ == "__main__":
+    main()
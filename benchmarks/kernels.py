@@ -0,0 +1,187 @@
+# benchmarks/kernels.py
+"""
+Microbenchmarks of the statistics kernels on synthetic data (benchmarks/synthetic.py)
+
+    python -m benchmarks.kernels                               # 1k, 10k, 100k points
+    python -m benchmarks.kernels --sizes 1k 1m 10m --kernels calculate_avail_rate
+    python -m benchmarks.kernels --baseline benchmarks/results/kernels_A.json --max-slowdown 1.3
+
+Throughput (points/s) is the best of --repeat runs; peak memory is measured in a separate
+run under tracemalloc. Results are checked against benchmarks/kernel_thresholds.json (and
+--baseline when given); any violation exits with status 1.
+"""
+from datetime import datetime
+import tracemalloc
+import argparse
+import json
+import time
+import sys
+import os
+
+from benchmarks.fake_upstream import FakeUpstreamConfig
+from benchmarks.run import RESULTS_DIR, git_commit, start_stand_ins
+from benchmarks.synthetic import generate_series, generate_sessions, midnight_sessions, parse_size
+
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kernel_thresholds.json")
+DEFAULT_SIZES = ["1k", "10k", "100k"]
+
+
+def kernel_cases(statistics_data, Metadata, Item, TimeSeries):
+    """name -> (setup(size) -> input, run(input))"""
+    pump = Metadata(
+        st_uuid="st", st_name="MPD-001", pq_uuid="pq", location="嘉義縣東石鄉", institution="嘉義縣政府",
+        datetime_start="2024-07-01", datetime_end="2024-07-31",
+    )
+
+    # The history fetchers hand the kernels a TimeSeries (app/ingest/series.py)
+    def series(kind):
+        return lambda size: TimeSeries.from_frame(generate_series(size, kind=kind, seed=size))
+
+    def avail_rate_input(size):
+        df = generate_series(size, kind="level", seed=size)
+        item = Item(
+            datetime_start=df["TimeStamp"].iloc[0][:10], datetime_end=df["TimeStamp"].iloc[-1][:10],
+            st_uuid="st", pq_uuid="pq",
+        )
+        return item, TimeSeries.from_frame(df)
+
+    def date_list_loop(sessions):
+        for start_time, end_time in sessions:
+            statistics_data.get_date_list(start_time, end_time)
+
+    return {
+        "calculate_pump_runtime": (
+            series("pump"), lambda series: statistics_data.calculate_pump_runtime(pump, series, 10)
+        ),
+        "calculate_max_flood_height": (
+            series("flood"), lambda series: statistics_data.calculate_max_flood_height(pump, series, 8)
+        ),
+        "calculate_avail_rate": (
+            avail_rate_input, lambda args: statistics_data.calculate_avail_rate(args[0], args[1], 24)
+        ),
+        "calculate_opsUnits_pumpingVol": (
+            lambda size: generate_sessions(size, seed=size),
+            lambda df: statistics_data.calculate_opsUnits_pumpingVol(df.copy()),
+        ),
+        # size = number of midnight-crossing sessions
+        "get_date_list": (lambda size: midnight_sessions(size, seed=size), date_list_loop),
+    }
+
+
+def measure(setup, run, size, repeat, memory):
+    data = setup(size)
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak_mb = None
+    if memory:
+        tracemalloc.start()
+        run(data)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return {
+        "size": size,
+        "best_sec": round(best, 6),
+        "points_per_sec": round(size / best, 1) if best else None,
+        "peak_mb": round(peak_mb, 2) if peak_mb is not None else None,
+    }
+
+
+def check(results, thresholds, baseline=None, max_slowdown=None):
+    """[violation messages]"""
+    violations = []
+    for result in results:
+        limits = thresholds.get(result["kernel"], {})
+        if result["size"] != limits.get("size"):
+            continue
+        if "min_points_per_sec" in limits and result["points_per_sec"] < limits["min_points_per_sec"]:
+            violations.append(
+                f"{result['kernel']}@{result['size']}: {result['points_per_sec']} points/s "
+                f"< {limits['min_points_per_sec']}"
+            )
+        if "max_peak_mb" in limits and result["peak_mb"] is not None and result["peak_mb"] > limits["max_peak_mb"]:
+            violations.append(f"{result['kernel']}@{result['size']}: peak {result['peak_mb']} MB > {limits['max_peak_mb']} MB")
+
+    if baseline and max_slowdown:
+        previous = {(r["kernel"], r["size"]): r for r in baseline["results"]}
+        for result in results:
+            base = previous.get((result["kernel"], result["size"]))
+            if base and result["best_sec"] > base["best_sec"] * max_slowdown:
+                violations.append(
+                    f"{result['kernel']}@{result['size']}: {result['best_sec']}s vs baseline {base['best_sec']}s "
+                    f"(> x{max_slowdown})"
+                )
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Statistics kernel microbenchmarks")
+    parser.add_argument("--sizes", nargs="*", default=DEFAULT_SIZES, help="points per input, e.g. 1k 100k 10m")
+    parser.add_argument("--kernels", nargs="*", help="kernel names (default all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    parser.add_argument("--baseline", help="earlier kernels results file")
+    parser.add_argument("--max-slowdown", type=float, default=1.3)
+    parser.add_argument("--output", help="results file (default benchmarks/results/kernels_<timestamp>_<commit>.json)")
+    args = parser.parse_args()
+    for name in ("thresholds", "baseline", "output"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    # statistics_data asks IoW for a token at import time
+    fakes, _ = start_stand_ins(FakeUpstreamConfig())
+    try:
+        from app.routers.iow import statistics_data
+        from app.schemas import Item, Metadata
+        from app.ingest.series import TimeSeries
+    finally:
+        fakes.terminate()
+
+    cases = kernel_cases(statistics_data, Metadata, Item, TimeSeries)
+    names = args.kernels or list(cases)
+    results = []
+    for name in names:
+        setup, run = cases[name]
+        for size in map(parse_size, args.sizes):
+            # Keep multi-million-point runs to a single pass
+            repeat = 1 if size >= 1_000_000 else args.repeat
+            result = {"kernel": name, **measure(setup, run, size, repeat, not args.no_memory)}
+            print(
+                f"{name:<32} {size:>10,} {result['best_sec']:>10.4f}s "
+                f"{result['points_per_sec']:>14,.0f}/s  peak={result['peak_mb']} MB",
+                flush=True,
+            )
+            results.append(result)
+
+    with open(args.thresholds, encoding="utf-8") as f:
+        thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    violations = check(results, thresholds, baseline, args.max_slowdown)
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"kernels_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{commit}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {"commit": commit, "started_at": datetime.now().isoformat(timespec="seconds"), "repeat": args.repeat},
+            "results": results,
+            "violations": violations,
+        }, f, indent=2, ensure_ascii=False)
+    print(f"Results: {output}")
+
+    for violation in violations:
+        print(f"REGRESSION {violation}")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
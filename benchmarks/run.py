@@ -0,0 +1,359 @@
+# benchmarks/run.py
+"""
+End-to-end benchmark of the report endpoints against local IoW / AIOT / Mongo stand-ins
+
+    python -m benchmarks.run                          # 245 RFD, 254 pumps, 30 days of minute data
+    python -m benchmarks.run --days 3 --limit 20      # quick run
+    python -m benchmarks.run --compare benchmarks/results/a.json benchmarks/results/b.json
+
+Each scenario records wall time, upstream calls, DataPoints served, peak RSS and throughput
+into benchmarks/results/<timestamp>_<commit>.json.
+"""
+from datetime import datetime, timedelta
+import subprocess
+import threading
+import argparse
+import platform
+import resource
+import tempfile
+import socket
+import json
+import time
+import sys
+import os
+
+import requests
+
+from benchmarks.fake_upstream import FakeUpstreamConfig, load_fixture_stations, start_in_subprocess
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+ENV_TEMPLATE = """API_GRANT_TYPE = "client_credentials"
+API_CLIENT_ID = "benchmark"
+API_CLIENT_SECRET = "benchmark"
+AIOT_username = "benchmark"
+AIOT_password = "benchmark"
+DB_HOST_PORT = "fake-mongo:27017"
+DB_USER = ""
+DB_PASSWORD = ""
+DB_AUTH_SOURCE = ""
+HISTORY_DB_HOST_PORT = "fake-mongo:27017"
+HISTORY_DB_USER = ""
+HISTORY_DB_PASSWORD = ""
+HISTORY_DB_AUTH_SOURCE = ""
+IOW_BASE_URL = "{iow_base_url}"
+AIOT_BASE_URL = "{aiot_base_url}"
+LATEST_SNAPSHOT_INTERVAL_SEC = 3600
+IOW_RATE_PER_SEC = 0
+ROLLUP_ENABLED = True
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return requests.get(url, timeout=1).json()
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        # ru_maxrss: KiB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class PeakRSS:
+    """Samples the process RSS while a scenario runs"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.start_mb = 0.0
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+class Upstreams:
+    def __init__(self, iow_base_url, aiot_base_url):
+        self.urls = {"iow": iow_base_url, "aiot": aiot_base_url}
+
+    def stats(self):
+        return {name: requests.get(f"{url}/__stats", timeout=5).json() for name, url in self.urls.items()}
+
+    @staticmethod
+    def diff(before, after):
+        calls = {}
+        points = 0
+        for name in after:
+            for route, count in after[name].items():
+                delta = count - before.get(name, {}).get(route, 0)
+                if route == "DataPoints":
+                    points += delta
+                elif delta:
+                    calls[f"{name}:{route}"] = delta
+        return calls, points
+
+
+def prepare_workdir(iow_base_url, aiot_base_url):
+    """The service reads .env / STATION_UUIDs / Documents and writes temp/ relative to the working directory"""
+    workdir = tempfile.mkdtemp(prefix="iow-benchmark-")
+    for name in ["STATION_UUIDs", "Documents"]:
+        os.symlink(os.path.join(REPO_DIR, name), os.path.join(workdir, name))
+    with open(os.path.join(workdir, ".env"), "w", encoding="utf-8") as f:
+        f.write(ENV_TEMPLATE.format(iow_base_url=iow_base_url, aiot_base_url=aiot_base_url))
+    return workdir
+
+
+def upload_lines(stations, device_types, kind, limit):
+    lines = []
+    for st_uuid, station in stations.items():
+        if station["device_type"] not in device_types:
+            continue
+        pq_uuids = [pq_uuid for pq_uuid, pq_kind in station["pq"].items() if pq_kind == kind]
+        if pq_uuids:
+            lines.append(f"{st_uuid},{pq_uuids[0]}")
+    return lines[:limit] if limit else lines
+
+
+def build_scenarios(stations, datetime_start, datetime_end, limit):
+    rfd = upload_lines(stations, ["RFD"], "flood", limit)
+    pumps = upload_lines(stations, ["MPD", "MPDCY"], "pump", limit)
+    period = {"datetime_start": datetime_start, "datetime_end": datetime_end}
+    report = "/iow/statistics/report"
+    # Order matters: the raw-data passes fill the rollup store that the *_rollup scenarios read
+    return [
+        ("pump_runtime", f"{report}/pump_runtime", period, pumps),
+        ("operating_units", f"{report}/operating_units_and_pumping_volumes", period, pumps),
+        ("operating_units_rollup", f"{report}/operating_units_and_pumping_volumes", {**period, "use_rollup": "true"}, pumps),
+        ("operating_units_prefetched", f"{report}/operating_units_and_pumping_volumes", period, pumps),
+        ("max_flood_height", f"{report}/max_flood_height", period, rfd),
+        ("max_flood_height_daily", f"{report}/max_flood_height", {**period, "granularity": "daily"}, rfd),
+        ("avail_rate", f"{report}/avail_rate", period, rfd),
+        ("aligned_matrix_pools", f"{report}/aligned_matrix", {**period, "preset": "flood_detention_pools"}, None),
+        ("available_pumps", f"{report}/available_pumps", {}, None),
+        ("available_pumps_within12hr", f"{report}/available_pumps_within12hr", {}, None),
+        ("available_pumps_within12hr_window", f"{report}/available_pumps_within12hr", {}, None),
+        ("nearest_available_pumps", "/iow/statistics/nearest_available_pumps", {"lat": 23.48, "lon": 120.28, "k": 10}, None),
+        (
+            "raw_data_multiple_stations", "/iow/history/download/multiple_stations/raw_data",
+            {**period, "client_id": "benchmark", "client_secret": "benchmark"}, rfd[:20],
+        ),
+    ]
+
+
+def run_scenario_setup(name, params, lines):
+    """
+    Scenarios that read state kept by a background job: the job runs once first (not timed).
+    Every other scenario starts with an empty local history cache, so it measures IoW fetches.
+    """
+    import shutil
+    from app.store.history_cache import HISTORY_CACHE_DIR
+    shutil.rmtree(HISTORY_CACHE_DIR, ignore_errors=True)
+
+    if name == "available_pumps_within12hr_window":
+        from app.jobs.pump_window import poll_pump_window
+        poll_pump_window()
+    elif name.endswith("_prefetched"):
+        # What the history_prefetch job leaves for the morning reports: every day of the period cached
+        from app.jobs.history_prefetch import PAYLOAD
+        from app.routers.iow.history_data import get_PhysicalQuantity_history_data
+        from app.routers.iow.latest_data import get_IoW_headers
+        from app.schemas import Item
+        headers = get_IoW_headers(PAYLOAD["client_id"], PAYLOAD["client_secret"])
+        for line in lines:
+            st_uuid, pq_uuid = line.split(",")
+            item = Item(datetime_start=params["datetime_start"], datetime_end=params["datetime_end"], st_uuid=st_uuid, pq_uuid=pq_uuid)
+            get_PhysicalQuantity_history_data(headers, PAYLOAD["client_id"], PAYLOAD["client_secret"], item, "")
+
+
+def run_scenario(client, upstreams, name, path, params, lines):
+    files = None
+    if lines is not None:
+        files = {"st_pq_file": (f"benchmark_{name}.txt", "\n".join(lines).encode("utf-8"), "text/plain")}
+    before = upstreams.stats()
+    with PeakRSS() as rss:
+        started = time.perf_counter()
+        response = client.post(path, params=params, files=files)
+        wall_sec = time.perf_counter() - started
+    calls, points = Upstreams.diff(before, upstreams.stats())
+    stations = len(lines) if lines is not None else None
+    return {
+        "scenario": name,
+        "status": response.status_code,
+        "wall_sec": round(wall_sec, 3),
+        "stations": stations,
+        "upstream_calls": sum(calls.values()),
+        "upstream_calls_by_route": calls,
+        "data_points": points,
+        "stations_per_sec": round(stations / wall_sec, 2) if stations else None,
+        "points_per_sec": round(points / wall_sec, 1) if points else None,
+        "rss_start_mb": round(rss.start_mb, 1),
+        "peak_rss_mb": round(rss.peak_mb, 1),
+        "response_bytes": len(response.content),
+    }
+
+
+def start_stand_ins(config):
+    """
+    Fake IoW / AIOT process + in-memory MongoDB + scratch working directory.
+    Must run before app.* is imported (module-level MongoClients / IoW token).
+    """
+    iow_port, aiot_port = free_port(), free_port()
+    upstreams = Upstreams(f"http://127.0.0.1:{iow_port}", f"http://127.0.0.1:{aiot_port}")
+    fakes = start_in_subprocess(iow_port, aiot_port, config)
+    for url in upstreams.urls.values():
+        wait_for(f"{url}/__stats")
+
+    import pymongo
+    from benchmarks.fake_mongo import FakeMongoClient
+    pymongo.MongoClient = FakeMongoClient
+
+    os.chdir(prepare_workdir(*upstreams.urls.values()))
+    sys.path.insert(0, REPO_DIR)
+    return fakes, upstreams
+
+
+def run(args):
+    config = FakeUpstreamConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        interval_sec=args.interval_sec,
+        stations=load_fixture_stations(REPO_DIR),
+        seed=args.seed,
+    )
+    fakes, upstreams = start_stand_ins(config)
+    try:
+        from fastapi.testclient import TestClient
+        from app.main import app
+        from app.auth.rbac import get_current_active_user
+        app.dependency_overrides[get_current_active_user] = lambda: None
+        # No `with`: the lifespan (background jobs) is not started
+        client = TestClient(app)
+
+        end = datetime.strptime(args.end, "%Y-%m-%d") if args.end else datetime.now() - timedelta(days=1)
+        datetime_end = end.strftime("%Y-%m-%d")
+        datetime_start = (end - timedelta(days=args.days - 1)).strftime("%Y-%m-%d")
+        scenarios = build_scenarios(config.stations, datetime_start, datetime_end, args.limit)
+        if args.only:
+            scenarios = [s for s in scenarios if s[0] in args.only]
+
+        results = []
+        for name, path, params, lines in scenarios:
+            run_scenario_setup(name, params, lines)
+            result = run_scenario(client, upstreams, name, path, params, lines)
+            print(
+                f"{name:<30} {result['status']} {result['wall_sec']:>9.2f}s "
+                f"calls={result['upstream_calls']:<6} points={result['data_points']:<10} peak_rss={result['peak_rss_mb']}MB"
+            )
+            results.append(result)
+    finally:
+        fakes.terminate()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "period": [datetime_start, datetime_end],
+            "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output")},
+        },
+        "results": results,
+    }
+
+
+def compare(path_a, path_b):
+    with open(path_a, encoding="utf-8") as f:
+        a = json.load(f)
+    with open(path_b, encoding="utf-8") as f:
+        b = json.load(f)
+    baseline = {r["scenario"]: r for r in a["results"]}
+    print(
+        f"{'scenario':<30} {'status':>7} {'wall A':>9} {'wall B':>9} {'Δ%':>7} "
+        f"{'calls A':>8} {'calls B':>8} {'rss A':>8} {'rss B':>8}"
+    )
+    for r in b["results"]:
+        base = baseline.get(r["scenario"])
+        if base is None:
+            continue
+        delta = (r["wall_sec"] - base["wall_sec"]) / base["wall_sec"] * 100 if base["wall_sec"] else 0
+        status = f"{base['status']}/{r['status']}" if base["status"] != r["status"] else str(r["status"])
+        print(
+            f"{r['scenario']:<30} {status:>7} {base['wall_sec']:>9.2f} {r['wall_sec']:>9.2f} {delta:>+7.1f} "
+            f"{base['upstream_calls']:>8} {r['upstream_calls']:>8} {base['peak_rss_mb']:>8} {r['peak_rss_mb']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end report benchmarks")
+    parser.add_argument("--days", type=int, default=30, help="report period length")
+    parser.add_argument("--end", help="last day of the period (YYYY-MM-DD, default yesterday)")
+    parser.add_argument("--interval-sec", type=int, default=60, help="DataPoints spacing")
+    parser.add_argument("--limit", type=int, default=0, help="stations per upload file (0 = all)")
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="scenario names")
+    parser.add_argument("--output", help="results file (default benchmarks/results/<timestamp>_<commit>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("A", "B"), help="compare two results files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    if args.output:
+        # run() changes into a scratch working directory
+        args.output = os.path.abspath(args.output)
+    report = run(args)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['meta']['commit']}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Results: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# benchmarks/synthetic.py
+"""
+Synthetic IoW time series for the statistics kernels (vectorized; 1k .. 10M points)
+
+    df = generate_series(100_000, kind="pump", seed=1)     # TimeStamp (str, +08:00), Value
+    df = generate_series(100_000, kind="flood", seed=2)
+    sessions = generate_sessions(5_000, n_pumps=254, days=30)
+
+kind:
+    "pump"  on/off cycles (Value > 0 while pumping) plus sessions crossing midnight
+    "flood" rare episodes rising to a peak (cm) and draining back to 0
+    "level" continuous random walk
+Gaps (device offline) are inserted as jumps in the time axis.
+"""
+import numpy as np
+import pandas as pd
+
+
+TZ_SUFFIX = "+08:00"
+
+
+def parse_size(text):
+    """"10k" -> 10_000, "1m" -> 1_000_000"""
+    text = str(text).strip().lower()
+    factor = {"k": 1_000, "m": 1_000_000}.get(text[-1], 1)
+    return int(float(text.rstrip("km")) * factor)
+
+
+def time_axis(rng, n_points, interval_sec, start, gap_probability, mean_gap_points):
+    steps = np.full(n_points, interval_sec, dtype=np.int64)
+    steps[0] = 0
+    gaps = rng.random(n_points) < gap_probability
+    gaps[0] = False
+    steps[gaps] += rng.geometric(1 / mean_gap_points, gaps.sum()) * interval_sec
+    return np.datetime64(pd.Timestamp(start).to_datetime64(), "s") + np.cumsum(steps).astype("timedelta64[s]")
+
+
+def alternating_runs(rng, n_points, mean_off_points, mean_on_points):
+    """(is_on, position_in_run, run_length) per point, starting in the off state"""
+    expected_runs = int(2 * n_points / (mean_off_points + mean_on_points)) + 16
+    while True:
+        off = rng.geometric(1 / mean_off_points, expected_runs)
+        on = rng.geometric(1 / mean_on_points, expected_runs)
+        lengths = np.column_stack([off, on]).ravel()
+        if lengths.sum() >= n_points:
+            break
+        expected_runs *= 2
+    lengths = lengths[:np.searchsorted(np.cumsum(lengths), n_points) + 1]
+    states = np.arange(len(lengths)) % 2 == 1
+    run_ids = np.repeat(np.arange(len(lengths)), lengths)[:n_points]
+    run_starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    position = np.arange(n_points) - run_starts[run_ids]
+    return states[run_ids], position, lengths[run_ids]
+
+
+def midnight_mask(times, rng, probability, half_width_sec):
+    """Points within ±half_width of midnight on randomly chosen days"""
+    seconds = times.astype("datetime64[s]").astype(np.int64)
+    day = seconds // 86400
+    second_of_day = seconds % 86400
+    first_day = day[0]
+    chosen = rng.random(day[-1] - first_day + 2) < probability
+    before = (second_of_day >= 86400 - half_width_sec) & chosen[day - first_day]
+    after = (second_of_day < half_width_sec) & chosen[np.maximum(day - first_day - 1, 0)] & (day > first_day)
+    return before | after
+
+
+def format_timestamps(times):
+    return pd.Series(np.char.add(np.datetime_as_string(times, unit="s"), TZ_SUFFIX))
+
+
+def generate_series(
+    n_points,
+    kind="pump",
+    interval_sec=60,
+    start="2024-07-01",
+    seed=0,
+    gap_probability=0.001,
+    mean_gap_points=90,
+    midnight_probability=0.2,
+    as_string=True,
+):
+    """DataFrame(TimeStamp, Value) shaped like IoW TimeSeriesData/ReadRawData DataPoints"""
+    rng = np.random.default_rng(seed)
+    times = time_axis(rng, n_points, interval_sec, start, gap_probability, mean_gap_points)
+    points_per_hour = max(3600 // interval_sec, 1)
+
+    if kind == "pump":
+        is_on, _, _ = alternating_runs(rng, n_points, mean_off_points=8 * points_per_hour, mean_on_points=points_per_hour)
+        is_on |= midnight_mask(times, rng, midnight_probability, half_width_sec=1800)
+        values = np.where(is_on, np.round(rng.uniform(0.2, 0.4, n_points), 3), 0.0)
+    elif kind == "flood":
+        is_on, position, length = alternating_runs(
+            rng, n_points, mean_off_points=72 * points_per_hour, mean_on_points=2 * points_per_hour
+        )
+        peak = rng.uniform(5, 80, n_points)
+        shape = 1 - np.abs(2 * (position + 1) / (length + 1) - 1)
+        values = np.where(is_on, np.round(peak * shape, 1), 0.0)
+    elif kind == "level":
+        values = np.round(np.maximum(rng.uniform(0.5, 3) + np.cumsum(rng.normal(0, 0.01, n_points)), 0), 3)
+    else:
+        raise ValueError(f"unknown kind {kind}")
+
+    return pd.DataFrame({
+        "TimeStamp": format_timestamps(times) if as_string else pd.Series(times),
+        "Value": values,
+    })
+
+
+def generate_sessions(n_rows, n_pumps=254, days=30, start="2024-07-01", seed=0):
+    """Rows shaped like the merged 抽水區間報表 (input of calculate_opsUnits_pumpingVol)"""
+    rng = np.random.default_rng(seed)
+    offsets = np.sort(rng.integers(0, days * 86400, n_rows)).astype("timedelta64[s]")
+    starts = np.datetime64(pd.Timestamp(start).to_datetime64(), "s") + offsets
+    durations = rng.integers(10, 6 * 3600, n_rows)
+    return pd.DataFrame({
+        "抽水機編號": np.char.add("MPD-", rng.integers(1, n_pumps + 1, n_rows).astype(str)),
+        "抽水區間 (Start_TimeStamp)": pd.Series(starts).dt.strftime("%Y-%m-%d %H:%M:%S") + TZ_SUFFIX,
+        "抽水區間 (End_TimeStamp)": pd.Series(starts + durations.astype("timedelta64[s]")).dt.strftime("%Y-%m-%d %H:%M:%S") + TZ_SUFFIX,
+        "抽水量(立方公尺)": durations * 0.3,
+    })
+
+
+def midnight_sessions(n_sessions, start="2024-07-01", seed=0, tz="Asia/Taipei"):
+    """(start, end) tz-aware pairs spanning 1..3 midnights (input of get_date_list)"""
+    rng = np.random.default_rng(seed)
+    base = pd.Timestamp(start, tz=tz)
+    day = rng.integers(0, 365, n_sessions)
+    start_sec = rng.integers(18 * 3600, 86400, n_sessions)
+    duration = rng.integers(86400 - 18 * 3600, 3 * 86400, n_sessions)
+    return [
+        (base + pd.Timedelta(days=int(d), seconds=int(s)), base + pd.Timedelta(days=int(d), seconds=int(s + length)))
+        for d, s, length in zip(day, start_sec, duration)
+    ]